@@ -1,12 +1,18 @@
 import os
+import sys
 import glob
+import json
+import time
+import threading
 import numpy as np
-import librosa
 import pydomino
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 from tqdm import tqdm
 
+from audio_store import load_audio, configure_audio_store
+
 
 def pre_cleanup(text: str):
     # replace U before a, e, i, o, u, cl, N with u and replace ty with t i
@@ -41,14 +47,192 @@ def pre_cleanup(text: str):
     return p
 
 
-def align_domino(text: str, wav_path: str, model, model_path: str, cleanup: bool = True, device: str = "cpu"):
+def _to_htk(z: list[tuple[float, float, str]]):
+    # convert seconds to 100 nanoseconds (htk format)
+    z = [(int(a * 1000 * 1000 * 10 + 0.5), int(b * 1000 * 1000 * 10 + 0.5), q) for a, b, q in z]
+    return '\n'.join([f"{a}\t{b}\t{q}" for a, b, q in z])
+
+
+def find_silences(y: np.ndarray, sr: int = 16_000, top_db: float = 35, min_silence_sec: float = 0.2):
+    """
+    Returns (start, end) seconds of the silences between voiced parts of `y`.
+    """
+    import librosa
+    intervals = librosa.effects.split(y, top_db=top_db)
+    return [
+        (float(intervals[i][1] / sr), float(intervals[i + 1][0] / sr))
+        for i in range(len(intervals) - 1)
+        if intervals[i + 1][0] - intervals[i][1] >= min_silence_sec * sr
+    ]
+
+
+def match_pauses(phonemes: list[str], silences: list[tuple[float, float]], duration: float, tolerance: float = 0.1):
+    """
+    Matches silences in the audio to inner `pau` in the phoneme sequence.
+
+    Both are placed on a relative position: the voiced time before a silence over all voiced
+    time, and the number of phonemes before a pau over all phonemes other than pau. Pairs closer
+    than `tolerance` are matched in order, keeping as many close pairs as possible.
+
+    Returns:
+        A list of (cut seconds, pau index), the cut is the middle of the silence.
+    """
+    pauses = [i for i in range(1, len(phonemes) - 1) if phonemes[i] == "pau"]
+    if len(pauses) == 0 or len(silences) == 0:
+        return []
+    num_voiced_phonemes = max(1, sum(1 for q in phonemes if q != "pau"))
+    pause_pos = [sum(1 for q in phonemes[:i] if q != "pau") / num_voiced_phonemes for i in pauses]
+    voiced_duration = max(1e-6, duration - sum(b - a for a, b in silences))
+    silence_pos = []
+    silence_total = 0.0
+    for a, b in silences:
+        silence_pos.append((a - silence_total) / voiced_duration)
+        silence_total += b - a
+
+    # score[i][j]: best score matching the first i silences and j pauses
+    S, P = len(silences), len(pauses)
+    score = [[0.0] * (P + 1) for _ in range(S + 1)]
+    back = [[None] * (P + 1) for _ in range(S + 1)]
+    for i in range(S + 1):
+        for j in range(P + 1):
+            if i == 0 and j == 0:
+                continue
+            candidates = []
+            if i > 0:
+                candidates.append((score[i - 1][j], (i - 1, j)))
+            if j > 0:
+                candidates.append((score[i][j - 1], (i, j - 1)))
+            if i > 0 and j > 0:
+                diff = abs(silence_pos[i - 1] - pause_pos[j - 1])
+                if diff < tolerance:
+                    candidates.append((score[i - 1][j - 1] + tolerance - diff, (i - 1, j - 1)))
+            score[i][j], back[i][j] = max(candidates, key=lambda c: c[0])
+
+    matches = []
+    i, j = S, P
+    while back[i][j] is not None:
+        pi, pj = back[i][j]
+        if pi == i - 1 and pj == j - 1:
+            a, b = silences[i - 1]
+            matches.append(((a + b) / 2, pauses[j - 1]))
+        i, j = pi, pj
+    return matches[::-1]
+
+
+def plan_chunks(matches: list[tuple[float, int]], duration: float, num_phonemes: int, chunk_sec: float):
+    """
+    Chooses cuts from `matches` so that chunks are at most `chunk_sec` long where possible.
+
+    Returns:
+        A list of (start seconds, end seconds, first phoneme index, last phoneme index + 1).
+        Neighbouring chunks share the pau at the cut.
+    """
+    cuts = []
+    start = 0.0
+    last = None
+    for cut in matches:
+        if cut[0] - start > chunk_sec and last is not None:
+            cuts.append(last)
+            start = last[0]
+            last = None
+        if cut[0] - start <= chunk_sec or last is None:
+            last = cut
+    if last is not None and duration - start > chunk_sec:
+        cuts.append(last)
+
+    chunks = []
+    prev_sec, prev_index = 0.0, 0
+    for sec, index in cuts:
+        chunks.append((prev_sec, sec, prev_index, index + 1))
+        prev_sec, prev_index = sec, index
+    chunks.append((prev_sec, duration, prev_index, num_phonemes))
+    return chunks
+
+
+_THREAD_LOCAL = threading.local()
+# threads aligning chunks, kept for the whole run so that their aligners are loaded once
+_CHUNK_EXECUTOR = None
+_CHUNK_EXECUTOR_WORKERS = 0
+_CHUNK_EXECUTOR_LOCK = threading.Lock()
+
+
+def _thread_aligner(model_path: str):
+    if getattr(_THREAD_LOCAL, "model_path", None) != model_path:
+        _THREAD_LOCAL.aligner = pydomino.Aligner(model_path)
+        _THREAD_LOCAL.model_path = model_path
+    return _THREAD_LOCAL.aligner
+
+
+def _chunk_executor(workers: int):
+    global _CHUNK_EXECUTOR, _CHUNK_EXECUTOR_WORKERS
+    with _CHUNK_EXECUTOR_LOCK:
+        if _CHUNK_EXECUTOR is None or _CHUNK_EXECUTOR_WORKERS != workers:
+            if _CHUNK_EXECUTOR is not None:
+                _CHUNK_EXECUTOR.shutdown(wait=True)
+            _CHUNK_EXECUTOR = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="domino-chunk")
+            _CHUNK_EXECUTOR_WORKERS = workers
+        return _CHUNK_EXECUTOR
+
+
+def align_chunked(y: np.ndarray, p: str, model, model_path: str, chunk_sec: float, workers: int = 1, top_db: float = 35):
+    """
+    Aligns a long recording in chunks cut at silences matched to pau.
+
+    The chunks are aligned independently (on `workers` threads shared by all calls, each
+    with its own aligner loaded on its first chunk), and their timings are shifted back and joined; the two halves of the pau at a cut are
+    merged into one. Without any usable silence the whole recording is aligned at once.
+
+    Returns:
+        A list of (seconds_start, seconds_end, phoneme).
+    """
+    sr = 16_000
+    phonemes = p.split()
+    duration = len(y) / sr
+    matches = match_pauses(phonemes, find_silences(y, sr=sr, top_db=top_db), duration)
+    chunks = plan_chunks(matches, duration, len(phonemes), chunk_sec)
+    if len(chunks) == 1:
+        return model.align(y, p, 3)
+
+    def align_chunk(chunk):
+        start, end, first, last = chunk
+        aligner = model if workers <= 1 else _thread_aligner(model_path)
+        z = aligner.align(y[int(start * sr):int(end * sr)], " ".join(phonemes[first:last]), 3)
+        return [(a + start, b + start, q) for a, b, q in z]
+
+    if workers > 1:
+        aligned_chunks = list(_chunk_executor(workers).map(align_chunk, chunks))
+    else:
+        aligned_chunks = [align_chunk(chunk) for chunk in chunks]
+
+    z = []
+    for (start, _, _, _), aligned in zip(chunks, aligned_chunks):
+        if len(aligned) == 0:
+            continue
+        if len(z) > 0:
+            # both chunks end/start at the cut
+            z[-1] = (z[-1][0], start, z[-1][2])
+            aligned[0] = (start, aligned[0][1], aligned[0][2])
+            if z[-1][2] == "pau" and aligned[0][2] == "pau":
+                z[-1] = (z[-1][0], aligned[0][1], "pau")
+                aligned = aligned[1:]
+        z.extend(aligned)
+    return z
+
+
+def align_domino(text: str, wav_path: str, model, model_path: str, cleanup: bool = True, device: str = "cpu", chunk_sec: float = 0, workers: int = 1):
+    """
+    Aligns phonemes to a wav file with pydomino, returns the HTK label and the aligner.
+
+    Recordings longer than `chunk_sec` are aligned in chunks cut at silences (0: disabled),
+    see `align_chunked`.
+    """
     if model is None:
         global _DOMINO_MODEL
         _DOMINO_MODEL = pydomino.Aligner(model_path)
         model = _DOMINO_MODEL
         
     # y_sr = librosa.get_samplerate(wav_path)
-    y: np.ndarray = librosa.load(wav_path, sr=16_000, mono=True, dtype=np.float32)[0]
+    y: np.ndarray = np.asarray(load_audio(wav_path, sr=16_000))
     
     if cleanup:
         p = pre_cleanup(text)
@@ -58,7 +242,10 @@ def align_domino(text: str, wav_path: str, model, model_path: str, cleanup: bool
     try:
         # align
         # list[tuple[seconds_start, seconds_end, phoneme]]
-        z: list[tuple[float, float, str]] = model.align(y, p, 3)
+        if chunk_sec > 0 and len(y) > chunk_sec * 16_000:
+            z: list[tuple[float, float, str]] = align_chunked(y, p, model, model_path, chunk_sec, workers=workers)
+        else:
+            z: list[tuple[float, float, str]] = model.align(y, p, 3)
         
         # # replace pau with SP
         # z = [(a, b, "SP") if q == "pau" else (a, b, q) for a, b, q in z]
@@ -66,13 +253,7 @@ def align_domino(text: str, wav_path: str, model, model_path: str, cleanup: bool
         # # convert seconds to samples
         # z = [(int(a * y_sr), int(b * y_sr), q) for a, b, q in z]
         
-        # convert seconds to 100 nanoseconds (htk format)
-        z = [(int(a * 1000 * 1000 * 10 + 0.5), int(b * 1000 * 1000 * 10 + 0.5), q) for a, b, q in z]
-        
-        # to string
-        z = '\n'.join([f"{a}\t{b}\t{q}" for a, b, q in z])
-        
-        return z, model
+        return _to_htk(z), model
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -80,7 +261,144 @@ def align_domino(text: str, wav_path: str, model, model_path: str, cleanup: bool
         raise e
 
 
-def main(input_dir: str, output_dir: str, model_path: str, audio_ext: list[str], phoneme_ext: str = ".lab", output_ext: str = ".domino-lab"):
+def find_alignment_jobs(input_dir: str, output_dir: str, audio_ext: list[str], phoneme_ext: str = ".lab", output_ext: str = ".domino-lab"):
+    """
+    Returns (text_file, wav_path, output_file) of every phoneme file in `input_dir` which has an audio file.
+    """
+    jobs = []
+    for text_file in sorted(glob.glob(os.path.join(input_dir, f"*{phoneme_ext}"))):
+        wav_path = None
+        for ae in audio_ext:
+            _wav_path = os.path.splitext(text_file)[0] + ae
+            if os.path.exists(_wav_path):
+                wav_path = _wav_path
+                break
+        if wav_path is None:
+            print(f"Cannot find wav file for {text_file}, skipping...")
+            continue
+        output_file = os.path.join(output_dir, os.path.splitext(os.path.basename(text_file))[0] + output_ext)
+        jobs.append((text_file, wav_path, output_file))
+    return jobs
+
+
+def load_resume_manifest(manifest_path: str):
+    """
+    Returns the completed entries of a resume manifest (output_file -> entry).
+    The manifest has one json line per aligned file, appended as files finish.
+    """
+    done = {}
+    if manifest_path is None or not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # a line cut off by an interrupted run
+                continue
+            done[entry["output"]] = entry
+    return done
+
+
+_WORKER_ALIGNER = None
+
+
+def _init_worker(model_path: str, audio_cache_dir: str = None):
+    global _WORKER_ALIGNER
+    _WORKER_ALIGNER = pydomino.Aligner(model_path)
+    if audio_cache_dir is not None:
+        configure_audio_store(audio_cache_dir)
+
+
+def _align_file(text_file: str, wav_path: str, output_file: str, cleanup: bool = True, chunk_sec: float = 0):
+    start = time.perf_counter()
+    y: np.ndarray = np.asarray(load_audio(wav_path, sr=16_000))
+    with open(text_file, 'r') as f:
+        p = f.read()
+    if cleanup:
+        p = pre_cleanup(p)
+    if chunk_sec > 0 and len(y) > chunk_sec * 16_000:
+        z: list[tuple[float, float, str]] = align_chunked(y, p, _WORKER_ALIGNER, None, chunk_sec)
+    else:
+        z: list[tuple[float, float, str]] = _WORKER_ALIGNER.align(y, p, 3)
+
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, "w") as f:
+        for t, d, q in z:
+            f.write(f"{t:.3f}\t{d:.3f}\t{q}\n")
+    os.replace(tmp_file, output_file)
+    return time.perf_counter() - start, len(y) / 16_000
+
+
+def batch_align(jobs: list[tuple[str, str, str]], model_path: str, workers: int = 0, manifest_path: str = None, cleanup: bool = True, chunk_sec: float = 0, audio_cache_dir: str = None):
+    """
+    Aligns phoneme files with pydomino on a process pool, each worker with its own aligner.
+
+    Outputs recorded in the resume manifest are skipped without being opened again (only
+    their existence is checked), as well as non-empty outputs written before the manifest
+    existed. Outputs are written through a temporary file, so an interrupted run leaves no
+    partial output.
+
+    Args:
+        jobs: List of (text_file, wav_path, output_file), see `find_alignment_jobs`.
+        model_path: Path to the pydomino model.
+        workers: Number of worker processes (0: number of CPUs).
+        manifest_path: Path to the resume manifest (None: no manifest).
+        cleanup: Apply `pre_cleanup` to the phonemes.
+        chunk_sec: Align recordings longer than this in chunks cut at silences (0: disabled).
+        audio_cache_dir: Directory of the audio store shared by the workers (None: decode every file).
+
+    Returns:
+        (timings, failed): a dict of text_file -> seconds spent on the file for the files
+        aligned in this run, and the list of text files which failed to align.
+    """
+    done = load_resume_manifest(manifest_path)
+    pending = []
+    for text_file, wav_path, output_file in jobs:
+        if output_file in done and os.path.exists(output_file):
+            continue
+        if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+            print(f"Skipping {text_file} because {output_file} already exists")
+            continue
+        pending.append((text_file, wav_path, output_file))
+    print(f"{len(jobs) - len(pending)} files already aligned, {len(pending)} to align")
+    if len(pending) == 0:
+        return {}, []
+
+    workers = workers if workers > 0 else os.cpu_count() or 1
+    timings = {}
+    failed = []
+    manifest_file = open(manifest_path, 'a', encoding='utf-8') if manifest_path is not None else None
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending)), initializer=_init_worker, initargs=(model_path, audio_cache_dir)) as executor:
+            futures = {executor.submit(_align_file, *job, cleanup=cleanup, chunk_sec=chunk_sec): job for job in pending}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                text_file, wav_path, output_file = futures[future]
+                try:
+                    elapsed, duration = future.result()
+                except Exception as e:
+                    failed.append(text_file)
+                    tqdm.write(f"Error processing {text_file}: {e}")
+                    continue
+                timings[text_file] = elapsed
+                tqdm.write(f"{text_file}: {elapsed:.2f} sec for {duration:.2f} sec of audio")
+                if manifest_file is not None:
+                    manifest_file.write(json.dumps({"text": text_file, "output": output_file, "elapsed": round(elapsed, 3), "duration": round(duration, 3)}, ensure_ascii=False) + "\n")
+                    manifest_file.flush()
+    finally:
+        if manifest_file is not None:
+            manifest_file.close()
+
+    if len(timings) > 0:
+        slowest = max(timings, key=timings.get)
+        print(f"Aligned {len(timings)} files with {workers} workers, "
+              f"{sum(timings.values()) / len(timings):.2f} sec per file on average, slowest {slowest} ({timings[slowest]:.2f} sec)")
+    if len(failed) > 0:
+        print(f"Failed to align {len(failed)} files: {', '.join(failed)}")
+    return timings, failed
+
+
+def main(input_dir: str, output_dir: str, model_path: str, audio_ext: list[str], phoneme_ext: str = ".lab", output_ext: str = ".domino-lab", workers: int = 0, manifest_path: str = None, chunk_sec: float = 0, audio_cache_dir: str = None):
     if not os.path.exists(input_dir):
         print(f"Error: Input directory not found: {input_dir}")
         return
@@ -89,80 +407,18 @@ def main(input_dir: str, output_dir: str, model_path: str, audio_ext: list[str],
         os.makedirs(output_dir)
         print(f"Created output directory: {output_dir}")
         
-    # Find all phoneme_ext files in the input directory
-    text_files = glob.glob(os.path.join(input_dir, f"*{phoneme_ext}"))
-
-    if not text_files:
+    jobs = find_alignment_jobs(input_dir, output_dir, audio_ext, phoneme_ext=phoneme_ext, output_ext=output_ext)
+    if not jobs:
         print(f"No {phoneme_ext} files found in {input_dir}")
         return
 
-    file_count = 0
-    for text_file in tqdm(text_files):
-        wav_path = None
-        for ae in audio_ext:
-            _wav_path = os.path.splitext(text_file)[0] + ae
-            if not os.path.exists(_wav_path):
-                continue
-            wav_path = _wav_path
-            break
-            
-        if wav_path is None:
-            print(f"Cannot find wav file for {text_file}, skipping...")
-            continue
-        
-        output_file = os.path.join(output_dir, os.path.splitext(text_file)[0] + output_ext)
-        
-        if os.path.exists(output_file):
-            with open(output_file, 'r') as f:
-                if f.read() != "":
-                    print(f"Skipping {text_file} because {output_file} already exists")
-                    continue
-        
-        global aligner
-        if aligner is None:
-            aligner = pydomino.Aligner(model_path)
+    if manifest_path is None:
+        manifest_path = os.path.join(output_dir, "domino_manifest.jsonl")
+    _, failed = batch_align(jobs, model_path, workers=workers, manifest_path=manifest_path, chunk_sec=chunk_sec, audio_cache_dir=audio_cache_dir)
+    return failed
 
-        y: np.ndarray = librosa.load(wav_path, sr=16_000, mono=True, dtype=np.float32)[0]
-        
-        # replace U before a, e, i, o, u, cl with u and replace ty with t i
-        replace_list = [
-            ("U a", "u a"),
-            ("U e", "u e"),
-            ("U i", "u i"),
-            ("U o", "u o"),
-            ("U u", "u u"),
-            ("U cl", "u cl"),
-            ("U N", "u N"),
-            ("ty", "t"),    # 
-            ("kw", "k"),
-            ("gw", "g"),
-        ]
-        
-        with open(text_file, 'r') as f:
-            p: list[str] = f.read().split(' ')
-        p = [p[i] for i in range(len(p)) if p[i] != ""]
-        
-        # merge repeated N
-        offset = 0
-        for i in range(len(p) - 1):
-            if p[i - offset] == "N" and p[i - offset + 1] == "N":
-                p.pop(i - offset + 1)
-                offset += 1
-        
-        p = " ".join(p)
-        
-        for r in replace_list:
-            p = p.replace(r[0], r[1])
-        
-        z: list[tuple[float, float, str]] = aligner.align(y, p, 3)
-    
-        with open(output_file, "w") as f:
-            for t, d, p in z:
-                f.write(f"{t:.3f}\t{d:.3f}\t{p}\n")
             
 if __name__ == "__main__":
-    global aligner
-    aligner: pydomino.Aligner = None
     parser = argparse.ArgumentParser(description="Convert text files to phoneme files using pydomino.")
     parser.add_argument("input_dir", help="Path to the input directory containing text files.")
     parser.add_argument("output_dir", help="Path to the output directory for phoneme files.")
@@ -170,6 +426,12 @@ if __name__ == "__main__":
     parser.add_argument("-a", "--audio_ext", nargs='+', default=['.wav', '.flac'], help="File extension for audio files.")
     parser.add_argument("-p", "--phoneme_ext", default=".lab", help="Path to the phoneme file.")
     parser.add_argument("-o", "--output_ext", default=".domino-lab", help="Path to the output phoneme file.")
+    parser.add_argument("-w", "--workers", type=int, default=0, help="Number of worker processes (0: number of CPUs).")
+    parser.add_argument("-m", "--manifest", default=None, help="Path to the resume manifest (default: domino_manifest.jsonl in the output directory).")
+    parser.add_argument("-c", "--chunk_sec", type=float, default=0, help="Align recordings longer than this in chunks cut at silences (0: disabled).")
+    parser.add_argument("--audio_cache_dir", default="False", help="Directory to store decoded audio for later runs (False: no store).")
     args = parser.parse_args()
     
-    main(args.input_dir, args.output_dir, args.model_path, args.audio_ext, phoneme_ext=args.phoneme_ext, output_ext=args.output_ext)
\ No newline at end of file
+    failed = main(args.input_dir, args.output_dir, args.model_path, args.audio_ext, phoneme_ext=args.phoneme_ext, output_ext=args.output_ext, workers=args.workers, manifest_path=args.manifest, chunk_sec=args.chunk_sec, audio_cache_dir=None if args.audio_cache_dir == "False" else args.audio_cache_dir)
+    if failed:
+        sys.exit(1)
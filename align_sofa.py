@@ -0,0 +1,134 @@
+import os
+import sys
+import pathlib
+import argparse
+
+from tqdm import tqdm
+
+from transcription_batching import bucket_by_duration
+
+
+DEFAULT_SOFA_DIR = "./SOFA"
+
+
+def format_sofa_htk(ph_seq, ph_intervals):
+    # same as the htk exporter of SOFA (htk/phones/*.lab)
+    return ''.join(f"{int(float(start) * 10000000)} {int(float(end) * 10000000)} {ph}\n" for ph, (start, end) in zip(ph_seq, ph_intervals))
+
+
+class SOFAAligner:
+    """
+    In-process SOFA forced aligner.
+
+    The checkpoint, the dictionary and the AP detector are loaded once, then files
+    from any number of folders are aligned in one pass, sorted by duration.
+    Each file is aligned from the phonemes in the .lab file next to it, same as
+    `SOFA/infer.py --in_format lab`.
+
+    Args:
+        ckpt_path: Path to the SOFA checkpoint.
+        dictionary_path: Path to the SOFA dictionary.
+        sofa_dir: Path to the SOFA repository.
+        g2p: Name of the SOFA g2p class.
+        ap_detector: Name of the SOFA AP detector class.
+    """
+    def __init__(self, ckpt_path, dictionary_path, sofa_dir=DEFAULT_SOFA_DIR, g2p="Dictionary", ap_detector="LoudnessSpectralcentroidAPDetector"):
+        sofa_dir = os.path.abspath(sofa_dir)
+        if sofa_dir not in sys.path:
+            sys.path.insert(0, sofa_dir)
+        import lightning as pl
+        import modules.g2p
+        import modules.AP_detector
+        from modules.task.forced_alignment import LitForcedAlignmentTask
+        from modules.utils.post_processing import post_processing
+
+        if not g2p.endswith("G2P"):
+            g2p += "G2P"
+        self.g2p = getattr(modules.g2p, g2p)(dictionary=dictionary_path)
+        self.g2p.set_in_format("lab")
+        if not ap_detector.endswith("APDetector"):
+            ap_detector += "APDetector"
+        self.ap_detector = getattr(modules.AP_detector, ap_detector)()
+        self.post_processing = post_processing
+
+        self.model = LitForcedAlignmentTask.load_from_checkpoint(ckpt_path)
+        self.model.set_inference_mode("force")
+        self.trainer = pl.Trainer(logger=False, enable_progress_bar=False)
+
+    def align(self, wav_paths, durations=None, batch_size=256, bucket_sec=1.0):
+        """
+        Aligns the .lab phonemes of `wav_paths`.
+
+        Args:
+            wav_paths: Paths to the wav files, each one needs a .lab file with its phonemes.
+            durations: Durations of the files in seconds, used to sort them (default: file order).
+            batch_size: Number of files per prediction pass.
+            bucket_sec: Duration granularity in seconds for sorting.
+
+        Returns:
+            A dict of wav path -> aligned phonemes in HTK format. Files SOFA could not align are left out.
+        """
+        if durations is None:
+            durations = [0.0] * len(wav_paths)
+        batches = bucket_by_duration(durations, batch_size, bucket_sec)
+        paths = {pathlib.Path(wav_path).resolve(): wav_path for wav_path in wav_paths}
+        results = {}
+        for batch in tqdm(batches, desc='SOFA'):
+            dataset = self.g2p.get_dataset([pathlib.Path(wav_paths[i]) for i in batch])
+            if len(dataset) == 0:
+                continue
+            predictions = self.trainer.predict(self.model, dataloaders=dataset, return_predictions=True)
+            predictions = self.ap_detector.process(predictions)
+            predictions, _ = self.post_processing(predictions)
+            for wav_path, _, _, ph_seq, ph_intervals, _, _ in predictions:
+                results[paths[pathlib.Path(wav_path).resolve()]] = format_sofa_htk(ph_seq, ph_intervals)
+        return results
+
+
+_SOFA_ALIGNERS = {}
+
+
+def get_sofa_aligner(ckpt_path, dictionary_path, sofa_dir=DEFAULT_SOFA_DIR):
+    """
+    Returns the aligner of the checkpoint and the dictionary, loaded once per process.
+    """
+    key = (os.path.abspath(ckpt_path), os.path.abspath(dictionary_path), os.path.abspath(sofa_dir))
+    if key not in _SOFA_ALIGNERS:
+        _SOFA_ALIGNERS[key] = SOFAAligner(ckpt_path, dictionary_path, sofa_dir=sofa_dir)
+    return _SOFA_ALIGNERS[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Align .lab phonemes of wav files with SOFA, loading the model once for all folders.")
+    parser.add_argument("input_dirs", nargs='+', help="Directories containing wav and .lab files (searched recursively).")
+    parser.add_argument("-c", "--ckpt", required=True, help="Path to the SOFA checkpoint.")
+    parser.add_argument("-d", "--dictionary", required=True, help="Path to the SOFA dictionary.")
+    parser.add_argument("-s", "--sofa_dir", default=DEFAULT_SOFA_DIR, help="Path to the SOFA repository.")
+    parser.add_argument("-o", "--output_ext", default=".lab", help="Extension of the aligned label files.")
+    parser.add_argument("-b", "--batch_size", type=int, default=256, help="Number of files per prediction pass.")
+    args = parser.parse_args()
+
+    from dataset_manifest import probe_audio_header
+
+    wav_paths = [
+        os.path.join(root, file)
+        for input_dir in args.input_dirs
+        for root, _, files in os.walk(input_dir)
+        for file in files
+        if file.endswith('.wav') and os.path.exists(os.path.join(root, os.path.splitext(file)[0] + '.lab'))
+    ]
+    durations = []
+    for wav_path in wav_paths:
+        header = probe_audio_header(wav_path)
+        durations.append(header["frames"] / header["sample_rate"])
+
+    aligner = get_sofa_aligner(args.ckpt, args.dictionary, sofa_dir=args.sofa_dir)
+    results = aligner.align(wav_paths, durations=durations, batch_size=args.batch_size)
+    for wav_path, htk in results.items():
+        with open(os.path.splitext(wav_path)[0] + args.output_ext, 'w') as f:
+            f.write(htk)
+    print(f"Aligned {len(results)} of {len(wav_paths)} files")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import os
+import json
+import argparse
+
+import numpy as np
+
+
+def worker_report_path(report_path):
+    """
+    Returns the report of this worker process, merged into `report_path` by `summarize_routes`.
+    Appends of several processes to one file may interleave (Windows), so each worker has its own.
+    """
+    return f"{report_path}.{os.getpid()}"
+
+
+def _worker_reports(report_path):
+    report_dir = os.path.dirname(report_path) or "."
+    prefix = os.path.basename(report_path) + "."
+    return sorted(
+        os.path.join(report_dir, file)
+        for file in os.listdir(report_dir)
+        if file.startswith(prefix) and file[len(prefix):].isdigit()
+    )
+
+
+def clear_routes(report_path):
+    """
+    Removes the report and the reports of the workers of an earlier run.
+    """
+    for path in [report_path] + _worker_reports(report_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def merge_worker_reports(report_path):
+    """
+    Appends the reports of the worker processes to `report_path` and removes them.
+    """
+    for path in _worker_reports(report_path):
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read()
+        with open(report_path, "a", encoding="utf-8") as f:
+            f.write(lines)
+        os.remove(path)
+
+
+def append_routes(report_path, routes):
+    """
+    Appends routing decisions to a JSON lines report.
+
+    Each route is a dict of file, route (the aligner used) and the confidence stats of
+    the CTC alignment. Worker processes write to their own report, see `worker_report_path`.
+    """
+    if len(routes) == 0:
+        return
+    lines = "".join(json.dumps(route, ensure_ascii=False) + "\n" for route in routes)
+    with open(report_path, "a", encoding="utf-8") as f:
+        f.write(lines)
+
+
+def load_routes(report_path):
+    # the last decision of a file wins
+    routes = {}
+    with open(report_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                route = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            routes[route["file"]] = route
+    return list(routes.values())
+
+
+def summarize_routes(report_path, bins=10):
+    """
+    Writes `<report>.summary.json` with the number of files per route and the
+    distributions of their confidence stats, and prints the counts. The reports of
+    worker processes are merged into the report first.
+
+    Returns:
+        The summary dict, None if there is no report.
+    """
+    merge_worker_reports(report_path)
+    if not os.path.exists(report_path):
+        return None
+    routes = load_routes(report_path)
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    summary = {"num_files": len(routes), "histogram_edges": [round(float(e), 4) for e in edges], "routes": {}}
+    for name in sorted(set(route["route"] for route in routes)):
+        selected = [route for route in routes if route["route"] == name]
+        summary["routes"][name] = {"num_files": len(selected)}
+        for stat in ["mean", "p10", "min", "low_ratio"]:
+            values = np.array([route[stat] for route in selected], dtype=np.float64)
+            summary["routes"][name][stat] = {
+                "percentiles": {str(q): round(float(np.percentile(values, q)), 4) for q in [0, 10, 50, 90, 100]},
+                "histogram": np.histogram(np.clip(values, 0.0, 1.0), bins=edges)[0].tolist(),
+            }
+    summary_path = os.path.splitext(report_path)[0] + ".summary.json"
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    counts = ", ".join(f"{name}: {value['num_files']}" for name, value in summary["routes"].items())
+    print(f"Cascaded alignment of {len(routes)} files ({counts}), report: {report_path}, summary: {summary_path}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a cascaded alignment report, optionally with other thresholds.")
+    parser.add_argument("report", help="Path to the report (cascade_report.jsonl).")
+    parser.add_argument("--min_mean_score", type=float, default=None, help="Count the files which would be accepted with this mean score threshold.")
+    parser.add_argument("--min_p10_score", type=float, default=0.0, help="10th percentile score threshold for --min_mean_score.")
+    parser.add_argument("--max_low_ratio", type=float, default=1.0, help="Ratio of low score spans threshold for --min_mean_score.")
+    args = parser.parse_args()
+
+    summarize_routes(args.report)
+    if args.min_mean_score is not None:
+        from ctc_align import confidence_passes
+        routes = load_routes(args.report)
+        accepted = sum(confidence_passes(route, args.min_mean_score, args.min_p10_score, args.max_low_ratio) for route in routes)
+        print(f"{accepted} of {len(routes)} files would skip the slower aligner")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import io
+import os
+import shutil
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+
+# members written as they are
+KEEP_EXTENSIONS = ('.wav', '.lab', '.txt', '.csv', '.ds', '.json')
+# audio members decoded and written as .wav
+DECODE_EXTENSIONS = ('.flac', '.ogg', '.mp3')
+
+
+def _is_kept(name):
+    parts = name.replace('\\', '/').split('/')
+    if '__MACOSX' in parts or parts[-1].startswith('.'):
+        return False
+    return name.lower().endswith(KEEP_EXTENSIONS + DECODE_EXTENSIONS)
+
+
+def _skip_decoded_duplicates(names, extract_path):
+    """
+    Drops compressed audio members that have a .wav of the same stem in the archive or on disk.
+    """
+    wav_stems = {os.path.splitext(name.replace('\\', '/'))[0].lower() for name in names if name.lower().endswith('.wav')}
+    kept = []
+    for name in names:
+        if name.lower().endswith(DECODE_EXTENSIONS):
+            stem = os.path.splitext(name.replace('\\', '/'))[0]
+            if stem.lower() in wav_stems or os.path.exists(os.path.splitext(_safe_path(extract_path, name))[0] + '.wav'):
+                continue
+        kept.append(name)
+    return kept
+
+
+def _safe_path(extract_path, name):
+    # drop absolute and parent parts so that members stay in extract_path
+    parts = [p for p in name.replace('\\', '/').split('/') if p not in ('', '.', '..')]
+    return os.path.join(extract_path, *parts)
+
+
+def _zip_member_name(info):
+    if info.flag_bits & 0x800:
+        return info.filename
+    # names without the utf-8 flag are mostly cp932 in Japanese archives
+    try:
+        return info.filename.encode('cp437').decode('cp932')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def _write_audio(fp, out_path):
+    """
+    Decodes an audio stream and writes it as .wav, returns the written path.
+    """
+    import soundfile
+    data = io.BytesIO(fp.read())
+    subtype = soundfile.info(data).subtype
+    data.seek(0)
+    y, sr = soundfile.read(data, always_2d=False)
+    if not soundfile.check_format('WAV', subtype):
+        subtype = 'PCM_16'
+    out_path = os.path.splitext(out_path)[0] + '.wav'
+    soundfile.write(out_path, y, sr, subtype=subtype)
+    return out_path
+
+
+def _write_member(fp, out_path):
+    """
+    Writes a member to `out_path`, returns the written path.
+    """
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    if out_path.lower().endswith(DECODE_EXTENSIONS):
+        return _write_audio(fp, out_path)
+    tmp_path = f"{out_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        shutil.copyfileobj(fp, f, 1 << 20)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def ingest_zip(archive_path, extract_path, workers=4, on_audio=None):
+    """
+    Extracts the kept members of a zip archive, decompressing members in parallel.
+    """
+    import zipfile
+    with zipfile.ZipFile(archive_path) as zf:
+        infos = [info for info in zf.infolist() if not info.is_dir() and _is_kept(_zip_member_name(info))]
+    kept_names = set(_skip_decoded_duplicates([_zip_member_name(info) for info in infos], extract_path))
+    infos = [info for info in infos if _zip_member_name(info) in kept_names]
+    # largest first to balance the threads
+    infos.sort(key=lambda info: info.file_size, reverse=True)
+
+    # every thread reads through its own handle
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def extract_member(info):
+        if not hasattr(local, "zf"):
+            local.zf = zipfile.ZipFile(archive_path)
+            with handles_lock:
+                handles.append(local.zf)
+        with local.zf.open(info) as fp:
+            out_path = _write_member(fp, _safe_path(extract_path, _zip_member_name(info)))
+        if on_audio is not None and out_path.lower().endswith('.wav'):
+            on_audio(out_path)
+        return out_path
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            return list(executor.map(extract_member, infos))
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def _list_7z(archive_path):
+    """
+    Returns the file members of an archive from the technical listing of the 7z command.
+    """
+    listing = subprocess.run(["7z", "l", "-slt", "-ba", archive_path], check=True, capture_output=True, text=True, encoding="utf-8", errors="replace").stdout
+    names = []
+    # one block of `Key = Value` lines per member, separated by blank lines
+    for block in listing.replace("\r\n", "\n").split("\n\n"):
+        fields = dict(line.split(" = ", 1) for line in block.split("\n") if " = " in line)
+        if "Path" in fields and fields.get("Folder") != "+" and "D" not in fields.get("Attributes", ""):
+            names.append(fields["Path"])
+    return names
+
+
+def ingest_7z(archive_path, extract_path, workers=4, on_audio=None):
+    """
+    Extracts the kept members of a 7z archive.
+    Solid 7z archives can not be decompressed per member in parallel, so the
+    kept members are extracted in one pass and only post-processed in parallel.
+    """
+    try:
+        import py7zr
+        with py7zr.SevenZipFile(archive_path, 'r') as archive:
+            names = _skip_decoded_duplicates([name for name in archive.getnames() if _is_kept(name)], extract_path)
+            archive.extract(path=extract_path, targets=names)
+        written = [os.path.join(extract_path, name) for name in names]
+    except ImportError:
+        # 7z command with the same filters
+        filters = [f"-ir!*{ext}" for ext in KEEP_EXTENSIONS + DECODE_EXTENSIONS]
+        subprocess.run(["7z", "x", archive_path, f"-o{extract_path}", "-y", *filters, "-xr!__MACOSX"], check=True)
+        # only the members of this archive, extract_path may have files of other archives
+        written = [_safe_path(extract_path, name) for name in _list_7z(archive_path) if _is_kept(name)]
+
+    def post_process(path):
+        if path.lower().endswith(DECODE_EXTENSIONS) and os.path.exists(os.path.splitext(path)[0] + '.wav'):
+            # the archive has the .wav already
+            os.remove(path)
+            return None
+        if path.lower().endswith(DECODE_EXTENSIONS):
+            with open(path, 'rb') as fp:
+                out_path = _write_audio(fp, path)
+            os.remove(path)
+            path = out_path
+        if on_audio is not None and path.lower().endswith('.wav'):
+            on_audio(path)
+        return path
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return [path for path in executor.map(post_process, [path for path in written if os.path.isfile(path)]) if path is not None]
+
+
+def ingest_archive(archive_path, extract_path, workers=4, on_audio=None):
+    """
+    Extracts only the files the pipeline keeps (audio, labels, transcriptions) from a zip or 7z archive.
+
+    Members are read as streams and written straight to `extract_path`; other audio
+    formats are decoded and written as .wav, unless a .wav of the same stem exists. `on_audio` is called with the path of each
+    written .wav on the worker threads, so audio can be decoded into the pipeline while
+    the rest of the archive is still being extracted.
+
+    Args:
+        archive_path: Path to the .zip or .7z archive.
+        extract_path: Directory to extract to.
+        workers: Number of threads.
+        on_audio: Callback for each written .wav (None: nothing).
+
+    Returns:
+        The list of written paths.
+    """
+    if archive_path.lower().endswith('.7z'):
+        return ingest_7z(archive_path, extract_path, workers=workers, on_audio=on_audio)
+    return ingest_zip(archive_path, extract_path, workers=workers, on_audio=on_audio)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract audio, labels and transcriptions from a zip/7z archive.")
+    parser.add_argument("archive", help="Path to the .zip or .7z archive.")
+    parser.add_argument("output_dir", help="Directory to extract to.")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Number of threads.")
+    args = parser.parse_args()
+
+    written = ingest_archive(args.archive, args.output_dir, workers=args.workers)
+    print(f"Extracted {len(written)} files")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import os
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+DEFAULT_CACHE_DIR = os.path.join("raw_data", ".audio_cache")
+DEFAULT_MAX_BYTES = 8 * 1024 ** 3   # 8 GiB
+
+
+class AudioStore:
+    """
+    Decode-once store of resampled audio.
+
+    Each (path, mtime, sample rate) is decoded and resampled only once and saved as
+    a float32 .npy file in `cache_dir`. Later loads return a read-only memory-mapped
+    array of that file, so every stage (and every worker process) shares the same
+    decoded samples without copying them.
+    The total size of the cache directory is kept under `max_bytes` by evicting the
+    least recently used entries.
+
+    Args:
+        cache_dir: Directory to store decoded audio.
+        max_bytes: Size limit of the cache directory in bytes (0: unlimited).
+        max_open: Number of memory maps kept open in this process.
+
+    Loads are thread-safe, so prefetch, ingest and slicing threads can share a store.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, max_open=256):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_open = max_open
+        self._opened = OrderedDict()
+        # guards _opened and _total_bytes, decoding runs outside of it
+        self._lock = threading.Lock()
+        # approximate size of the cache directory (None: not scanned yet)
+        self._total_bytes = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _key(self, path, sr):
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime_ns
+        return hashlib.sha1(f"{path}|{mtime}|{sr}".encode("utf-8")).hexdigest()
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def load(self, path, sr=16_000):
+        """
+        Returns mono float32 samples of `path` resampled to `sr` as a read-only array.
+        """
+        key = self._key(path, sr)
+        with self._lock:
+            y = self._opened.get(key)
+            if y is not None:
+                self._opened.move_to_end(key)
+                return y
+
+        cache_path = self._cache_path(key)
+        need_eviction = False
+        if os.path.exists(cache_path):
+            # mark as recently used for the eviction
+            try:
+                os.utime(cache_path)
+            except OSError:
+                pass
+        else:
+            y = decode_audio(path, sr=sr)
+            # write to a temporary file first, other processes and threads may read the same entry
+            tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, y)
+            os.replace(tmp_path, cache_path)
+            with self._lock:
+                if self._total_bytes is not None:
+                    self._total_bytes += y.nbytes
+                need_eviction = self._total_bytes is None or self._total_bytes > self.max_bytes
+
+        try:
+            y = np.load(cache_path, mmap_mode="r")
+        except FileNotFoundError:
+            # evicted by another thread or process in the meantime
+            return decode_audio(path, sr=sr)
+        with self._lock:
+            self._opened[key] = y
+            while len(self._opened) > self.max_open:
+                self._opened.popitem(last=False)
+        if need_eviction:
+            self.evict()
+        return y
+
+    def duration(self, path, sr=16_000):
+        """
+        Returns the duration of `path` in seconds.
+        """
+        return self.load(path, sr=sr).shape[0] / sr
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in `max_bytes`.
+        """
+        if self.max_bytes <= 0:
+            return
+        entries = []
+        total_bytes = 0
+        for file in os.listdir(self.cache_dir):
+            if not file.endswith(".npy"):
+                continue
+            file_path = os.path.join(self.cache_dir, file)
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, file_path))
+            total_bytes += st.st_size
+        with self._lock:
+            self._total_bytes = total_bytes
+        if total_bytes <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, file_path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            key = os.path.splitext(os.path.basename(file_path))[0]
+            with self._lock:
+                self._opened.pop(key, None)
+            try:
+                os.remove(file_path)
+            except OSError:
+                # still mapped by another process (Windows), try next one
+                continue
+            total_bytes -= size
+        with self._lock:
+            self._total_bytes = total_bytes
+
+    def clear(self):
+        with self._lock:
+            self._opened.clear()
+        for file in os.listdir(self.cache_dir):
+            try:
+                os.remove(os.path.join(self.cache_dir, file))
+            except OSError:
+                pass
+
+
+def decode_audio(path, sr=16_000):
+    import librosa
+    y: np.ndarray = librosa.load(path, sr=sr, mono=True, dtype=np.float32)[0]
+    return y
+
+
+_AUDIO_STORE = None
+
+
+def configure_audio_store(cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    global _AUDIO_STORE
+    _AUDIO_STORE = AudioStore(cache_dir, max_bytes=max_bytes)
+    return _AUDIO_STORE
+
+
+def load_audio(path, sr=16_000):
+    # the store is opt-in, without it the file is decoded every time
+    if _AUDIO_STORE is None:
+        return decode_audio(path, sr=sr)
+    return _AUDIO_STORE.load(path, sr=sr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode and resample audio files into the audio store.")
+    parser.add_argument("input_dir", help="Directory containing the audio files.")
+    parser.add_argument("-c", "--cache_dir", default=DEFAULT_CACHE_DIR, help="Directory to store decoded audio.")
+    parser.add_argument("-m", "--max_gb", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 3, help="Size limit of the store in GiB (0: unlimited).")
+    parser.add_argument("-r", "--sample_rate", type=int, default=16_000, help="Sample rate to resample to.")
+    parser.add_argument("-a", "--audio_ext", nargs='+', default=['.wav', '.flac'], help="File extension for audio files.")
+    args = parser.parse_args()
+
+    store = configure_audio_store(args.cache_dir, max_bytes=int(args.max_gb * 1024 ** 3))
+    for root, _, files in os.walk(args.input_dir):
+        for file in files:
+            if file.endswith(tuple(args.audio_ext)):
+                store.load(os.path.join(root, file), sr=args.sample_rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+import numpy as np
+import torch
+import librosa
+
+
+_TOKEN_LABELS = {}
+
+
+def token_labels(tokenizer):
+    """
+    Returns an object array to look up the decoded string of each token id.
+    The table is built once per tokenizer with `tokenizer.decode`.
+    """
+    key = id(tokenizer)
+    if key not in _TOKEN_LABELS:
+        labels = np.empty(len(tokenizer), dtype=object)
+        labels[:] = [tokenizer.decode(i) for i in range(len(tokenizer))]
+        _TOKEN_LABELS[key] = (tokenizer, labels)
+    return _TOKEN_LABELS[key][1]
+
+
+def ctc_collapse_batch(ids: torch.Tensor):
+    """
+    Merges consecutive repeated ids of a batch of greedy CTC paths in one pass.
+
+    Blanks are kept, so the result decodes to the same text as the input with the
+    usual greedy CTC decoding, but is much shorter to convert to python lists.
+
+    Args:
+        ids: (batch, frames) argmax token ids.
+
+    Returns:
+        A list of 1-D tensors, one for each item in the batch.
+    """
+    keep = torch.ones_like(ids, dtype=torch.bool)
+    keep[:, 1:] = ids[:, 1:] != ids[:, :-1]
+    return list(torch.split(ids[keep], keep.sum(dim=1).tolist()))
+
+
+def get_ctc_forced_alignment(
+    logits: torch.Tensor,
+    token_ids: torch.Tensor,
+    blank_id: int = 0,
+    frame_rate: float = 50.0,  # 50 frames/sec (20ms/frame) for HuBERT
+    pad_sec: float = 0.1,      # padded silence length (sec)
+    delay_sec: float = 0.0    # calibration delay for Emission Delay of CTC (sec)
+):
+    """
+    Forced alignment of one utterance with torchaudio.
+    This is the reference of `get_ctc_forced_alignment_batch`.
+    """
+    import torchaudio
+
+    if logits.ndim == 2:
+        logits = logits.unsqueeze(0)  # add batch dimension (1, frames, num_tokens)
+        
+    targets = token_ids
+    # remove blank
+    targets = targets[targets != blank_id]
+    if targets.ndim == 1:
+        targets = targets.unsqueeze(0)  # add batch dimension (1, num_tokens)
+    
+    # Forced Alignment
+    alignments, scores = torchaudio.functional.forced_align(logits, targets, blank=blank_id)
+    alignments = alignments[0]
+    scores = scores[0].exp()  # back to probability
+    
+    # merge tokens
+    token_spans = torchaudio.functional.merge_tokens(alignments, scores)
+    
+    total_offset_sec = pad_sec + delay_sec
+    results =[]
+    for span in token_spans:
+        # frame index to sec
+        start_time_sec = span.start / frame_rate
+        end_time_sec = span.end / frame_rate
+        # correct time
+        corrected_start = max(0.0, start_time_sec - total_offset_sec)
+        corrected_end   = max(0.0, end_time_sec - total_offset_sec)
+        results.append({
+            "token_id": span.token,
+            "start_time": round(corrected_start, 3),
+            "end_time": round(corrected_end, 3),
+            "score": round(span.score, 4)
+        })
+        
+    return results, total_offset_sec
+
+
+def forced_align_batch(log_probs: torch.Tensor, targets: torch.Tensor, input_lengths: torch.Tensor, target_lengths: torch.Tensor, blank: int = 0):
+    """
+    Viterbi CTC forced alignment of a padded batch.
+
+    Follows `torchaudio.functional.forced_align` (including its tie-breaking), but
+    aligns every item of the batch in one pass over the frames.
+
+    Args:
+        log_probs: (batch, frames, num_tokens) emissions.
+        targets: (batch, max_target_length) target ids, padded with any value.
+        input_lengths: (batch,) number of valid frames of each item.
+        target_lengths: (batch,) number of valid targets of each item.
+        blank: Blank id.
+
+    Returns:
+        (paths, scores), both (batch, frames). `paths` is the aligned token id of each
+        frame (blank after the valid frames) and `scores` is the emission at it.
+    """
+    batch_size, num_frames, _ = log_probs.shape
+    device = log_probs.device
+    input_lengths = input_lengths.to(device=device, dtype=torch.long)
+    target_lengths = target_lengths.to(device=device, dtype=torch.long)
+    max_target_length = targets.shape[1]
+    num_states = 2 * max_target_length + 1
+
+    if num_frames == 0:
+        empty = torch.zeros((batch_size, 0), dtype=torch.long, device=device)
+        return empty, log_probs.new_zeros((batch_size, 0))
+
+    targets = targets.to(device=device, dtype=torch.long)
+    repeats = ((targets[:, 1:] == targets[:, :-1]) & (torch.arange(1, max(1, max_target_length), device=device) < target_lengths[:, None])).sum(dim=1)
+    if torch.any(input_lengths < target_lengths + repeats):
+        raise ValueError("targets length is too long for CTC")
+
+    # extended targets: blank, t0, blank, t1, ..., blank
+    extended = torch.full((batch_size, num_states), blank, dtype=torch.long, device=device)
+    extended[:, 1::2] = targets
+    valid_states = torch.arange(num_states, device=device)[None, :] < (2 * target_lengths + 1)[:, None]
+    # skipping a blank is allowed between different targets
+    can_skip = torch.zeros((batch_size, num_states), dtype=torch.bool, device=device)
+    can_skip[:, 3::2] = targets[:, 1:] != targets[:, :-1]
+
+    # emissions of the states are gathered frame by frame, a (batch, frames, states) gather does not fit long batches
+    emission = log_probs[:, 0].gather(1, extended)
+    neg_inf = torch.tensor(float("-inf"), dtype=log_probs.dtype, device=device)
+
+    alpha = torch.full((batch_size, num_states), float("-inf"), dtype=log_probs.dtype, device=device)
+    alpha[:, 0] = emission[:, 0]
+    if max_target_length > 0:
+        alpha[:, 1] = torch.where(target_lengths > 0, emission[:, 1], neg_inf)
+    backptrs = torch.zeros((num_frames, batch_size, num_states), dtype=torch.int8, device=device)
+    pad1 = alpha.new_full((batch_size, 1), float("-inf"))
+    pad2 = alpha.new_full((batch_size, 2), float("-inf"))
+
+    for t in range(1, num_frames):
+        x0 = alpha
+        x1 = torch.cat((pad1, alpha), dim=1)[:, :num_states]
+        x2 = torch.where(can_skip, torch.cat((pad2, alpha), dim=1)[:, :num_states], neg_inf)
+        take2 = (x2 > x1) & (x2 > x0)
+        take1 = ~take2 & (x1 > x0) & (x1 > x2)
+        best = torch.where(take2, x2, torch.where(take1, x1, x0))
+        emission = log_probs[:, t].gather(1, extended)
+        next_alpha = torch.where(valid_states, best + emission, neg_inf)
+        active = (t < input_lengths)[:, None]
+        alpha = torch.where(active, next_alpha, alpha)
+        backptrs[t] = torch.where(active, take2.to(torch.int8) * 2 + take1.to(torch.int8), backptrs[t])
+
+    # end at the last target or the last blank
+    last_state = 2 * target_lengths
+    last_alpha = alpha.gather(1, last_state[:, None])[:, 0]
+    prev_alpha = alpha.gather(1, (last_state - 1).clamp(min=0)[:, None])[:, 0]
+    state = torch.where((target_lengths > 0) & ~(last_alpha > prev_alpha), last_state - 1, last_state)
+
+    paths = torch.full((batch_size, num_frames), blank, dtype=torch.long, device=device)
+    for t in range(num_frames - 1, -1, -1):
+        active = t < input_lengths
+        paths[:, t] = torch.where(active, extended.gather(1, state[:, None])[:, 0], paths[:, t])
+        step = backptrs[t].gather(1, state[:, None])[:, 0].long()
+        state = state - torch.where(active, step, torch.zeros_like(step))
+
+    scores = log_probs.gather(2, paths[:, :, None])[:, :, 0]
+    return paths, scores
+
+
+def merge_token_spans(tokens: np.ndarray, scores: torch.Tensor, blank: int = 0):
+    """
+    Merges repeated tokens of an aligned path into spans like `torchaudio.functional.merge_tokens`.
+
+    Returns:
+        (token_ids, starts, ends, span_scores), `ends` are exclusive frame indices and
+        `span_scores` are the mean of `scores` over each span.
+    """
+    tokens = np.asarray(tokens)
+    changes = np.flatnonzero(np.diff(tokens, prepend=-1, append=-1) != 0)
+    starts, ends = changes[:-1], changes[1:]
+    token_ids = tokens[starts]
+    keep = token_ids != blank
+    starts, ends, token_ids = starts[keep], ends[keep], token_ids[keep]
+    # torch mean of each span, to get the same float32 results as torchaudio
+    span_scores = np.array([scores[start:end].mean().item() for start, end in zip(starts.tolist(), ends.tolist())], dtype=np.float64)
+    return token_ids, starts, ends, span_scores
+
+
+def get_ctc_forced_alignment_batch(
+    logits: torch.Tensor,
+    token_ids: torch.Tensor,
+    blank_id: int = 0,
+    frame_rate: float = 50.0,
+    pad_secs=None,
+    delay_sec: float = 0.0,
+    input_lengths: torch.Tensor = None,
+):
+    """
+    Batched version of `get_ctc_forced_alignment`.
+
+    Args:
+        logits: (batch, frames, num_tokens) emissions.
+        token_ids: (batch, frames) greedy token ids, the non-blank ones are the targets.
+        pad_secs: Padded silence length of each item in seconds.
+        input_lengths: (batch,) number of valid frames of each item (default: all frames).
+
+    Returns:
+        A list of (token_ids, start_times, end_times, scores) arrays, one for each item.
+    """
+    batch_size, num_frames, _ = logits.shape
+    if pad_secs is None:
+        pad_secs = [0.1] * batch_size
+    if input_lengths is None:
+        input_lengths = torch.full((batch_size,), num_frames, dtype=torch.long)
+
+    is_target = token_ids != blank_id
+    target_lengths = is_target.sum(dim=1)
+    targets = torch.full((batch_size, max(1, int(target_lengths.max()))), blank_id, dtype=torch.long, device=token_ids.device)
+    # pack the non-blank ids of each item to the left
+    target_positions = torch.cumsum(is_target, dim=1) - 1
+    batch_index = torch.arange(batch_size, device=token_ids.device)[:, None].expand_as(token_ids)
+    targets[batch_index[is_target], target_positions[is_target]] = token_ids[is_target].long()
+    targets = targets[:, :int(target_lengths.max())]
+
+    paths, scores = forced_align_batch(logits, targets, input_lengths, target_lengths, blank=blank_id)
+    paths = paths.cpu().numpy()
+    scores = scores.exp().cpu()  # back to probability
+
+    results = []
+    for b in range(batch_size):
+        n = int(input_lengths[b])
+        span_tokens, starts, ends, span_scores = merge_token_spans(paths[b, :n], scores[b, :n])
+        total_offset_sec = pad_secs[b] + delay_sec
+        # same arithmetic and rounding as get_ctc_forced_alignment
+        start_times = [round(max(0.0, t - total_offset_sec), 3) for t in (starts / frame_rate).tolist()]
+        end_times = [round(max(0.0, t - total_offset_sec), 3) for t in (ends / frame_rate).tolist()]
+        results.append((span_tokens, np.array(start_times), np.array(end_times), np.array([round(score, 4) for score in span_scores.tolist()])))
+    return results
+
+
+def _speech_mask(wav, top_db=30):
+    # mark non-silent intervals with a difference array instead of a loop of slices
+    n_samples = len(wav)
+    intervals = librosa.effects.split(wav, top_db=top_db)
+    diff = np.zeros(n_samples + 1, dtype=np.int32)
+    if len(intervals) > 0:
+        np.add.at(diff, intervals[:, 0], 1)
+        np.add.at(diff, intervals[:, 1], -1)
+    return np.cumsum(diff[:-1]) > 0
+
+
+def _to_htk(sec):
+    # seconds to 100 nanoseconds, same rounding as int(round(sec * 10_000_000))
+    return np.rint(np.asarray(sec, dtype=np.float64) * 10_000_000).astype(np.int64)
+
+
+def ctc_alignment_to_htk(token_ids, start_times, end_times, labels, wav, sr=16_000, top_db=30, min_silence_samples=320):
+    """
+    Converts CTC token spans to HTK label rows, inserting pauses at silences.
+
+    Gaps between spans which contain more than `min_silence_samples` silent samples
+    (by the VAD of `librosa.effects.split`) become "pau", other gaps stretch the
+    previous phoneme. The silence runs of all gaps are computed at once with prefix
+    sums over the VAD mask.
+
+    Args:
+        token_ids: Token id of each span.
+        start_times: Start of each span in seconds.
+        end_times: End of each span in seconds.
+        labels: Lookup table from token id to phoneme (see `token_labels`).
+        wav: Mono audio at `sr`.
+
+    Returns:
+        (starts, ends, labels) of the HTK rows, starts and ends in 100 nanoseconds.
+    """
+    token_ids = np.asarray(token_ids, dtype=np.int64)
+    start_times = np.asarray(start_times, dtype=np.float64)
+    end_times = np.asarray(end_times, dtype=np.float64)
+    keep = end_times > start_times
+    token_ids, start_times, end_times = token_ids[keep], start_times[keep], end_times[keep]
+    span_labels = labels[token_ids] if len(token_ids) > 0 else np.empty(0, dtype=object)
+    num_spans = len(token_ids)
+
+    n_samples = len(wav)
+    is_speech = _speech_mask(wav, top_db=top_db)
+    is_silent = ~is_speech
+    sample_index = np.arange(n_samples)
+    # number of silent samples in [a, b) is silent_cumsum[b] - silent_cumsum[a]
+    silent_cumsum = np.concatenate(([0], np.cumsum(is_silent)))
+    # first silent sample at or after i, and last silent sample before i
+    next_silent = np.concatenate((np.minimum.accumulate(np.where(is_silent, sample_index, n_samples)[::-1])[::-1], [n_samples]))
+    prev_silent = np.concatenate(([-1], np.maximum.accumulate(np.where(is_silent, sample_index, -1))))
+
+    # the previous span always ends at its own end time, a pause is cut from the gap before the span
+    prev_end = np.concatenate(([0.0], end_times[:-1]))
+    prev_labels = np.concatenate((np.array(["pau"], dtype=object), span_labels[:-1]))
+    has_gap = start_times > prev_end
+
+    gap_start = np.minimum((prev_end * sr).astype(np.int64), n_samples)
+    gap_end = np.minimum((start_times * sr).astype(np.int64), n_samples)
+    gap_end_clipped = np.maximum(gap_end, gap_start)
+    silent_count = silent_cumsum[gap_end_clipped] - silent_cumsum[gap_start]
+    has_silence = has_gap & (silent_count > min_silence_samples) & (prev_labels != "cl")
+
+    silence_start = prev_end + (next_silent[gap_start] - gap_start) / sr
+    silence_end = prev_end + (prev_silent[gap_end_clipped] - gap_start) / sr
+
+    span_start = np.where(has_silence, silence_end, start_times)
+    span_end = np.maximum(end_times, span_start)
+    prev_is_pau = prev_labels == "pau"
+    # new end of the row before each span
+    prev_row_end = np.where(
+        has_silence,
+        np.where(prev_is_pau, _to_htk(silence_end), _to_htk(silence_start)),
+        _to_htk(start_times),
+    )
+    insert_pause = has_silence & ~prev_is_pau
+
+    span_row_end = _to_htk(span_end)
+    span_row_end[:-1] = np.where(has_gap[1:], prev_row_end[1:], span_row_end[:-1])
+
+    num_rows = 1 + num_spans + int(insert_pause.sum())
+    starts = np.zeros(num_rows, dtype=np.int64)
+    ends = np.zeros(num_rows, dtype=np.int64)
+    row_labels = np.empty(num_rows, dtype=object)
+    row_labels[0] = "pau"
+    if num_spans > 0 and has_gap[0]:
+        ends[0] = prev_row_end[0]
+
+    span_rows = 1 + np.arange(num_spans) + np.cumsum(insert_pause)
+    starts[span_rows] = _to_htk(span_start)
+    ends[span_rows] = span_row_end
+    row_labels[span_rows] = span_labels
+    pause_rows = span_rows[insert_pause] - 1
+    starts[pause_rows] = _to_htk(silence_start[insert_pause])
+    ends[pause_rows] = _to_htk(silence_end[insert_pause])
+    row_labels[pause_rows] = "pau"
+
+    # trailing silence
+    current_sec = float(span_end[-1]) if num_spans > 0 else 0.0
+    wav_sec = n_samples / sr
+    sil_start_htk = int(round(current_sec * 10_000_000))
+    sil_end_htk = int(round(wav_sec * 10_000_000))
+    if num_rows > 1 and sil_end_htk > sil_start_htk:
+        # the last moment of speech in the file
+        speech_indices = np.flatnonzero(is_speech)
+        if len(speech_indices) > 0:
+            detected_end_sec = speech_indices[-1] / sr
+        else:
+            detected_end_sec = current_sec
+
+        last_phoneme_start_sec = int(starts[-1]) / 10_000_000
+        last_phoneme_end_sec = max(last_phoneme_start_sec + 0.05, detected_end_sec)
+        last_phoneme_end_sec = min(last_phoneme_end_sec, wav_sec)
+        last_phoneme_end_htk = int(round(last_phoneme_end_sec * 10_000_000))
+        ends[-1] = last_phoneme_end_htk
+
+        if sil_end_htk > last_phoneme_end_htk:
+            if row_labels[-1] == "pau":
+                ends[-1] = sil_end_htk
+            else:
+                starts = np.append(starts, last_phoneme_end_htk)
+                ends = np.append(ends, sil_end_htk)
+                row_labels = np.append(row_labels, np.array(["pau"], dtype=object))
+
+    return starts, ends, row_labels
+
+
+def format_htk(starts, ends, labels):
+    return '\n'.join(f"{s}\t{e}\t{l}" for s, e, l in zip(starts.tolist(), ends.tolist(), labels))
+
+
+# spans below this probability count as low confidence
+LOW_SCORE = 0.5
+
+
+def alignment_confidence(span_scores, low_score=LOW_SCORE):
+    """
+    Summarizes the span scores (mean probabilities) of a CTC forced alignment.
+
+    Returns:
+        A dict of num_spans, mean, min, p10 (10th percentile) and low_ratio (the
+        ratio of spans scored below `low_score`).
+    """
+    scores = np.asarray(span_scores, dtype=np.float64)
+    if len(scores) == 0:
+        return {"num_spans": 0, "mean": 0.0, "min": 0.0, "p10": 0.0, "low_ratio": 1.0}
+    return {
+        "num_spans": int(len(scores)),
+        "mean": round(float(scores.mean()), 4),
+        "min": round(float(scores.min()), 4),
+        "p10": round(float(np.percentile(scores, 10)), 4),
+        "low_ratio": round(float((scores < low_score).mean()), 4),
+    }
+
+
+def confidence_passes(stats, min_mean=0.0, min_p10=0.0, max_low_ratio=1.0):
+    """
+    Returns True if the alignment summarized by `alignment_confidence` can be used as it is.
+    """
+    return stats["num_spans"] > 0 and stats["mean"] >= min_mean and stats["p10"] >= min_p10 and stats["low_ratio"] <= max_low_ratio
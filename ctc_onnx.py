@@ -0,0 +1,120 @@
+import os
+import re
+import hashlib
+
+import numpy as np
+import torch
+
+
+OUTPUT_NAMES = ["kana_logits", "phoneme_logits"]
+
+
+class _CTCHeads(torch.nn.Module):
+    # returns the logits as a tuple for the export
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_values, attention_mask):
+        outputs = self.model(input_values, attention_mask=attention_mask)
+        return tuple(outputs[name] for name in OUTPUT_NAMES)
+
+
+def export_ctc_onnx(model, onnx_path, opset_version=17):
+    """
+    Exports the kana/phoneme CTC model to ONNX with dynamic batch and time axes.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    input_values = torch.randn(2, 16_000)
+    attention_mask = torch.ones(2, 16_000, dtype=torch.int64)
+    dynamic_axes = {
+        "input_values": {0: "batch", 1: "samples"},
+        "attention_mask": {0: "batch", 1: "samples"},
+        **{name: {0: "batch", 1: "frames"} for name in OUTPUT_NAMES},
+    }
+    # write to a temporary file first, other processes may load the same export
+    tmp_path = f"{onnx_path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            _CTCHeads(model).eval(),
+            (input_values, attention_mask),
+            tmp_path,
+            input_names=["input_values", "attention_mask"],
+            output_names=OUTPUT_NAMES,
+            dynamic_axes=dynamic_axes,
+            opset_version=opset_version,
+        )
+    os.replace(tmp_path, onnx_path)
+
+
+class ONNXPhonemeModel:
+    """
+    Runs the kana/phoneme CTC model with onnxruntime on CPU.
+
+    The model is exported once to `cache_dir` and the export is reused by later runs.
+    Calls take and return the same values as the PyTorch model (`kana_logits` and
+    `phoneme_logits` as torch tensors), and other methods such as `ctc_decode` are
+    forwarded to the PyTorch model.
+
+    Args:
+        model: The PyTorch model.
+        model_id: Name or path of the model, used for the cache file name.
+        cache_dir: Directory to store the exported model.
+        intra_op_threads: Threads inside an operator (0: same as torch).
+        inter_op_threads: Threads running operators in parallel.
+        quantize: Run a dynamic int8 quantized copy of the export.
+    """
+    def __init__(self, model, model_id, cache_dir="onnx_cache", intra_op_threads=0, inter_op_threads=1, quantize=False):
+        import onnxruntime as ort
+
+        self.model = model.to("cpu").eval()
+        commit_hash = getattr(model.config, "_commit_hash", None) or ""
+        digest = hashlib.sha1(f"{model_id}|{commit_hash}|{torch.__version__}".encode("utf-8")).hexdigest()[:12]
+        self.onnx_path = os.path.join(cache_dir, f"{re.sub(r'[^0-9A-Za-z_.-]', '_', model_id)}-{digest}.onnx")
+        exported = False
+        if not os.path.exists(self.onnx_path):
+            print(f"Exporting {model_id} to {self.onnx_path}")
+            export_ctc_onnx(self.model, self.onnx_path)
+            exported = True
+        if quantize:
+            quantized_path = os.path.splitext(self.onnx_path)[0] + "-int8.onnx"
+            if not os.path.exists(quantized_path):
+                from onnxruntime.quantization import quantize_dynamic, QuantType
+                tmp_path = f"{quantized_path}.{os.getpid()}.tmp"
+                quantize_dynamic(self.onnx_path, tmp_path, weight_type=QuantType.QInt8)
+                os.replace(tmp_path, quantized_path)
+            self.onnx_path = quantized_path
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads if intra_op_threads > 0 else torch.get_num_threads()
+        options.inter_op_num_threads = max(1, inter_op_threads)
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        if exported:
+            print(f"Max difference from PyTorch: {self.max_abs_diff(torch.randn(1, 48_000), torch.ones(1, 48_000, dtype=torch.int64)):.2e}")
+
+    def max_abs_diff(self, input_values, attention_mask):
+        """
+        Returns the largest difference of the logits from the PyTorch model.
+        """
+        with torch.no_grad():
+            expected = self.model(input_values, attention_mask=attention_mask)
+        outputs = self(input_values, attention_mask)
+        return max((outputs[name] - expected[name].float()).abs().max().item() for name in OUTPUT_NAMES)
+
+    def __call__(self, input_values, attention_mask):
+        inputs = {
+            "input_values": input_values.detach().cpu().numpy().astype(np.float32),
+            "attention_mask": attention_mask.detach().cpu().numpy().astype(np.int64),
+        }
+        # the export drops inputs the model does not use
+        outputs = self.session.run(OUTPUT_NAMES, {name: inputs[name] for name in self.input_names})
+        return {name: torch.from_numpy(output) for name, output in zip(OUTPUT_NAMES, outputs)}
+
+    def __getattr__(self, name):
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
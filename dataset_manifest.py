@@ -0,0 +1,211 @@
+import os
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+
+MANIFEST_FILENAME = ".dataset_manifest.json"
+AUDIO_EXTENSIONS = (".wav", ".flac", ".ogg", ".mp3")
+
+
+def probe_audio_header(path):
+    """
+    Reads only the header of an audio file.
+
+    Returns:
+        A dict with "frames", "sample_rate" and "channels".
+    """
+    import soundfile
+    try:
+        info = soundfile.info(path)
+        return {"frames": info.frames, "sample_rate": info.samplerate, "channels": info.channels}
+    except RuntimeError:
+        # not supported by libsndfile, decode it instead
+        import librosa
+        sample_rate = librosa.get_samplerate(path)
+        duration = librosa.get_duration(path=path)
+        return {"frames": int(round(duration * sample_rate)), "sample_rate": sample_rate, "channels": 1}
+
+
+class DatasetManifest:
+    """
+    On-disk index of a dataset tree: directory listings and audio headers.
+
+    The listing of a directory is re-read only when the mtime of the directory
+    changed, and the header of an audio file is re-read only when its mtime or size
+    changed, so refreshing an unchanged tree costs one stat per directory and file.
+    Listings keep the order of `os.scandir`, so `walk` yields the same order as
+    `os.walk` on the same filesystem.
+
+    Args:
+        root: Root directory of the dataset.
+        path: Path to the manifest file (default: `root/.dataset_manifest.json`).
+    """
+    def __init__(self, root, path=None):
+        self.root = os.path.abspath(root)
+        self.path = path if path is not None else os.path.join(self.root, MANIFEST_FILENAME)
+        # relative dir -> {"mtime_ns": int, "dirs": [...], "files": [...]}
+        self.dirs = {}
+        # relative file -> {"mtime_ns": int, "size": int, "frames": int, "sample_rate": int, "channels": int, "sha1": str (optional)}
+        self.audio = {}
+        self.hash_audio = False
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("root") == self.root:
+                self.dirs = data.get("dirs", {})
+                self.audio = data.get("audio", {})
+
+    def _rel(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def refresh(self, workers=8, hash_audio=False):
+        """
+        Updates the index incrementally from the filesystem.
+        If `hash_audio` is True, the content hash of new or changed audio files is computed too.
+        """
+        self.hash_audio = hash_audio
+        dirs = {}
+        pending = ["."]
+        while len(pending) > 0:
+            # stat the directories of this level in parallel
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                listings = list(executor.map(self._refresh_dir, pending))
+            pending = []
+            for rel_dir, listing in listings:
+                if listing is None:
+                    continue
+                dirs[rel_dir] = listing
+                pending.extend(os.path.normpath(os.path.join(rel_dir, d)) for d in listing["dirs"])
+        self.dirs = dirs
+
+        audio_files = [
+            os.path.normpath(os.path.join(rel_dir, f))
+            for rel_dir, listing in dirs.items()
+            for f in listing["files"]
+            if f.lower().endswith(AUDIO_EXTENSIONS)
+        ]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            entries = list(executor.map(self._refresh_audio, audio_files))
+        self.audio = {rel_file: entry for rel_file, entry in zip(audio_files, entries) if entry is not None}
+        return self
+
+    def _refresh_dir(self, rel_dir):
+        path = os.path.join(self.root, rel_dir)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return rel_dir, None
+        listing = self.dirs.get(rel_dir)
+        if listing is not None and listing["mtime_ns"] == mtime_ns:
+            return rel_dir, listing
+        dirs = []
+        files = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                elif rel_dir != "." or entry.name != os.path.basename(self.path):
+                    files.append(entry.name)
+        return rel_dir, {"mtime_ns": mtime_ns, "dirs": dirs, "files": files}
+
+    def _refresh_audio(self, rel_file):
+        path = os.path.join(self.root, rel_file)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        entry = self.audio.get(rel_file)
+        if entry is None or entry["mtime_ns"] != st.st_mtime_ns or entry["size"] != st.st_size:
+            entry = {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+            entry.update(probe_audio_header(path))
+        if self.hash_audio and "sha1" not in entry:
+            from stage_cache import hash_file
+            entry["sha1"] = hash_file(path)
+        return entry
+
+    def save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"root": self.root, "dirs": self.dirs, "audio": self.audio}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def walk(self, top=None):
+        """
+        Yields (root, dirs, files) like `os.walk` from the index.
+        """
+        rel_top = "." if top is None else os.path.normpath(self._rel(top))
+        pending = [rel_top]
+        while len(pending) > 0:
+            rel_dir = pending.pop(0)
+            listing = self.dirs.get(rel_dir)
+            if listing is None:
+                continue
+            yield os.path.normpath(os.path.join(self.root, rel_dir)), list(listing["dirs"]), list(listing["files"])
+            # depth first, same as os.walk
+            pending[0:0] = [os.path.normpath(os.path.join(rel_dir, d)) for d in listing["dirs"]]
+
+    def info(self, path):
+        """
+        Returns the header info of an audio file, probing it if it is not indexed.
+        """
+        rel_file = os.path.normpath(self._rel(path))
+        entry = self.audio.get(rel_file)
+        if entry is None:
+            entry = self._refresh_audio(rel_file)
+            if entry is not None:
+                self.audio[rel_file] = entry
+        return entry
+
+    def duration(self, path):
+        entry = self.info(path)
+        return entry["frames"] / entry["sample_rate"]
+
+    def content_hash(self, path):
+        """
+        Returns the sha1 of the content of an audio file, computing it if it is not indexed.
+        """
+        entry = self.info(path)
+        if "sha1" not in entry:
+            from stage_cache import hash_file
+            entry["sha1"] = hash_file(path)
+        return entry["sha1"]
+
+
+_MANIFESTS = {}
+
+
+def load_manifest(root, refresh=True, workers=8, hash_audio=False):
+    """
+    Returns the manifest of `root`, shared within the process.
+
+    Args:
+        root: Root directory of the dataset.
+        refresh: If True, refresh the index from the filesystem and save it.
+        workers: Number of threads to stat and probe files.
+        hash_audio: If True, index the content hash of audio files too.
+    """
+    key = os.path.abspath(root)
+    manifest = _MANIFESTS.get(key)
+    if manifest is None:
+        manifest = DatasetManifest(root)
+        _MANIFESTS[key] = manifest
+    if refresh:
+        manifest.refresh(workers=workers, hash_audio=hash_audio)
+        manifest.save()
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the dataset manifest (directory listings and audio headers).")
+    parser.add_argument("root", help="Root directory of the dataset.")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="Number of threads to stat and probe files.")
+    args = parser.parse_args()
+
+    manifest = load_manifest(args.root, workers=args.workers)
+    total_sec = sum(entry["frames"] / entry["sample_rate"] for entry in manifest.audio.values())
+    print(f"Indexed {len(manifest.dirs)} directories and {len(manifest.audio)} audio files ({total_sec / 3600:.2f} hours)")
+
+
+if __name__ == "__main__":
+    main()
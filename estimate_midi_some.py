@@ -0,0 +1,167 @@
+import os
+import csv
+import sys
+import pathlib
+import argparse
+
+from tqdm import tqdm
+
+from transcription_batching import bucket_by_duration
+
+
+DEFAULT_SOME_DIR = "./SOME"
+DEFAULT_SOME_MODEL_PATH = "./DiffSinger/checkpoints/SOME/0119_continuous256_5spk/model_ckpt_steps_100000_simplified.ckpt"
+
+
+def format_notes(result):
+    # same format as SOME/batch_infer.py
+    import librosa
+    note_seq = [
+        'rest' if rest else librosa.midi_to_note(midi, cents=True, unicode=False)
+        for midi, rest in zip(result['note_midi'].tolist(), result['note_rest'].tolist())
+    ]
+    note_dur = [str(round(dur, 6)) for dur in result['note_dur'].tolist()]
+    return ' '.join(note_seq), ' '.join(note_dur)
+
+
+class SOMEEstimator:
+    """
+    In-process SOME MIDI estimator, the checkpoint is loaded once.
+
+    Args:
+        model_path: Path to the SOME checkpoint, with its config.yaml next to it.
+        some_dir: Path to the SOME repository.
+    """
+    def __init__(self, model_path=DEFAULT_SOME_MODEL_PATH, some_dir=DEFAULT_SOME_DIR):
+        some_dir = os.path.abspath(some_dir)
+        if some_dir not in sys.path:
+            sys.path.insert(0, some_dir)
+        import yaml
+        import importlib
+        import inference
+
+        model_path = pathlib.Path(model_path)
+        with open(model_path.with_name('config.yaml'), 'r', encoding='utf8') as f:
+            config = yaml.safe_load(f)
+        infer_cls = inference.task_inference_mapping[config['task_cls']]
+        pkg, cls_name = infer_cls.rsplit('.', 1)
+        self.infer_ins = getattr(importlib.import_module(pkg), cls_name)(config=config, model_path=model_path)
+        self.sample_rate = config['audio_sample_rate']
+
+    def estimate(self, wav_paths):
+        """
+        Returns (note_seq, note_dur) strings of each wav file.
+        """
+        from audio_store import load_audio
+        import numpy as np
+        waveforms = [np.asarray(load_audio(wav_path, sr=self.sample_rate)) for wav_path in wav_paths]
+        return [format_notes(result) for result in self.infer_ins.infer(waveforms)]
+
+
+_SOME_ESTIMATORS = {}
+
+
+def get_some_estimator(model_path=DEFAULT_SOME_MODEL_PATH, some_dir=DEFAULT_SOME_DIR):
+    key = (os.path.abspath(model_path), os.path.abspath(some_dir))
+    if key not in _SOME_ESTIMATORS:
+        _SOME_ESTIMATORS[key] = SOMEEstimator(model_path, some_dir=some_dir)
+    return _SOME_ESTIMATORS[key]
+
+
+def estimate_midi(folder_paths, model_path=DEFAULT_SOME_MODEL_PATH, some_dir=DEFAULT_SOME_DIR, stage_cache=None, batch_size=16):
+    """
+    Estimates the notes of every segment of DiffSinger datasets and updates their transcriptions.csv in place.
+
+    Segments of all folders are sorted by duration and estimated in batches. If
+    `stage_cache` is given, segments whose audio was already estimated by the same
+    model are not estimated again.
+
+    Args:
+        folder_paths: Dataset directories, each one with transcriptions.csv and wavs/.
+        model_path: Path to the SOME checkpoint.
+        some_dir: Path to the SOME repository.
+        stage_cache: StageCache to reuse the notes of unchanged segments (None: estimate all).
+        batch_size: Number of segments per batch.
+    """
+    from dataset_manifest import probe_audio_header
+    if stage_cache is not None:
+        from stage_cache import hash_file
+
+    datasets = []
+    # (dataset index, row index, wav path, cache key)
+    pending = []
+    for folder_path in folder_paths:
+        csv_path = os.path.join(folder_path, "transcriptions.csv")
+        if not os.path.exists(csv_path):
+            continue
+        with open(csv_path, 'r', encoding='utf8', newline='') as f:
+            reader = csv.DictReader(f)
+            fieldnames = list(reader.fieldnames)
+            rows = list(reader)
+        for column in ['note_seq', 'note_dur']:
+            if column not in fieldnames:
+                fieldnames.append(column)
+        datasets.append({"csv_path": csv_path, "fieldnames": fieldnames, "rows": rows, "changed": False})
+        for i, row in enumerate(rows):
+            wav_path = os.path.join(folder_path, 'wavs', f"{row['name']}.wav")
+            key = None
+            if stage_cache is not None:
+                key = stage_cache.key("some", audio=hash_file(wav_path), model=os.path.abspath(model_path))
+                notes = stage_cache.get("some", key)
+                if notes is not None:
+                    # up to date, no need to estimate
+                    if row.get('note_seq') != notes[0] or row.get('note_dur') != notes[1]:
+                        row['note_seq'], row['note_dur'] = notes
+                        datasets[-1]["changed"] = True
+                    continue
+            pending.append((len(datasets) - 1, i, wav_path, key))
+
+    if len(pending) > 0:
+        durations = []
+        for _, _, wav_path, _ in pending:
+            header = probe_audio_header(wav_path)
+            durations.append(header["frames"] / header["sample_rate"])
+        estimator = get_some_estimator(model_path, some_dir=some_dir)
+        for batch in tqdm(bucket_by_duration(durations, batch_size), desc='SOME'):
+            notes_batch = estimator.estimate([pending[j][2] for j in batch])
+            for j, notes in zip(batch, notes_batch):
+                dataset_index, row_index, _, key = pending[j]
+                row = datasets[dataset_index]["rows"][row_index]
+                row['note_seq'], row['note_dur'] = notes
+                datasets[dataset_index]["changed"] = True
+                if stage_cache is not None:
+                    stage_cache.put("some", key, list(notes))
+
+    for dataset in datasets:
+        if not dataset["changed"]:
+            continue
+        with open(dataset["csv_path"], 'w', encoding='utf8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=dataset["fieldnames"])
+            writer.writeheader()
+            writer.writerows(dataset["rows"])
+    print(f"Estimated MIDI of {len(pending)} segments")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate MIDI of DiffSinger datasets with SOME, loading the model once for all folders.")
+    parser.add_argument("dataset_dirs", nargs='+', help="Dataset directories, each one with transcriptions.csv and wavs/.")
+    parser.add_argument("-m", "--model", default=DEFAULT_SOME_MODEL_PATH, help="Path to the SOME checkpoint.")
+    parser.add_argument("-s", "--some_dir", default=DEFAULT_SOME_DIR, help="Path to the SOME repository.")
+    parser.add_argument("-b", "--batch_size", type=int, default=16, help="Number of segments per batch.")
+    parser.add_argument("-c", "--cache_dir", default="False", help="Directory of the stage cache to skip unchanged segments (False: estimate all).")
+    parser.add_argument("--audio_cache_dir", default="False", help="Directory to store decoded audio for later runs (False: no store).")
+    args = parser.parse_args()
+
+    if args.audio_cache_dir != "False":
+        from audio_store import configure_audio_store
+        configure_audio_store(args.audio_cache_dir)
+
+    stage_cache = None
+    if args.cache_dir != "False":
+        from stage_cache import StageCache
+        stage_cache = StageCache(args.cache_dir)
+    estimate_midi(args.dataset_dirs, model_path=args.model, some_dir=args.some_dir, stage_cache=stage_cache, batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
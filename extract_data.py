@@ -1,32 +1,64 @@
 import os
+import sys
 import csv
 import json
 import shutil
 import re
 import argparse
+import functools
+from collections import Counter
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Extract and process audio data for DiffSinger/NNSVS')
     parser.add_argument('--data_type', choices=['lab_wav', 'csv_wav', 'ds'],
                       default='lab_wav', help='Type of data to process')   # lab_wav: NNSVS format, csv_wav, ds: DiffSinger format
-    parser.add_argument('--data_zip_path', type=str, required=True, help='Path to data zip file')
+    parser.add_argument('--data_zip_path', type=str, nargs='+', required=True, help='Path to data zip file (several archives are extracted into one dataset)')
+    parser.add_argument('--archive_ingest', choices=['stream', '7z'], default='7z', help='7z: extract everything with the 7z command, stream: extract only audio, labels and transcriptions from zip/7z in parallel')
+    parser.add_argument('--ingest_workers', type=int, default=4, help='Number of threads to extract the archive')
     parser.add_argument('--no_cleanup', action='store_true', help='Do not cleanup data directory')
     parser.add_argument('--estimate_midi', choices=['False', 'parselmouth', 'harvest', 'SOME'],
                       default='False', help='MIDI estimation method')
+    parser.add_argument('--some_model_path', type=str,
+                        default="./DiffSinger/checkpoints/SOME/0119_continuous256_5spk/model_ckpt_steps_100000_simplified.ckpt",
+                        help="SOME model path")
+    parser.add_argument('--some_batch_size', type=int, default=16, help='Batch size for MIDI estimation by SOME')
+    parser.add_argument('--process_workers', type=int, default=4, help='Number of speaker folders converted by the external tools at once')
     parser.add_argument('--segment_length', type=int, default=15, help='Segment length in seconds')
     parser.add_argument('--max_silence_phoneme', type=int, default=2, help='Maximum silence phonemes allowed')
     parser.add_argument('--transcription_batch_size', type=int, default=1, help='Batch size for transcription')
+    parser.add_argument('--transcription_prefetch', type=int, default=2, help='Number of transcription batches decoded ahead of the model (0: no prefetch)')
+    parser.add_argument('--transcription_prefetch_workers', type=int, default=2, help='Number of threads for decoding transcription batches ahead')
+    parser.add_argument('--transcription_bucket_sec', type=float, default=1.0, help='Duration granularity in seconds for length-sorted transcription batches (0: directory order)')
+    parser.add_argument('--transcription_batch_sec', type=float, default=0.0, help='Budget of padded audio seconds per transcription batch, packs a variable number of files per batch instead of --transcription_batch_size (0: fixed batch size)')
+    parser.add_argument('--transcription_max_rss_gb', type=float, default=0.0, help='Resident memory ceiling in GiB, transcription batches are made smaller above it (0: only on out-of-memory errors)')
+    parser.add_argument('--slice_sec', type=float, default=0.0, help='Recordings longer than this are cut at silences into slices of at most this length, transcribed and aligned per slice, and their labels merged back (0: disabled)')
+    parser.add_argument('--slice_top_db', type=float, default=30, help='Threshold below the peak in dB to detect silences for slicing')
+    parser.add_argument('--transcription_chunk_sec', type=float, default=30.0, help='Files longer than this are transcribed by the phoneme model in overlapping windows (0: whole files)')
+    parser.add_argument('--transcription_chunk_overlap_sec', type=float, default=2.0, help='Overlap of the windows in seconds for chunked transcription')
     parser.add_argument('--transcription_model', type=str,
                       default='False', help='Model for transcription (when no exist it)\n ex) `openai/whisper-large`')
     parser.add_argument('--transcription_language', type=str,
                       default='ja', help='Language for transcription')
     parser.add_argument('--transcription_phoneme_model', type=str,
                         default='False', help='Model for transcription with phoneme (when no exist it)\n ex) `TylorShine/wavlm-base-plus-hiragana-ctc-v2`')
+    parser.add_argument('--transcription_precision', choices=['auto', 'fp32', 'bf16', 'int8'], default='auto', help='Precision of the transcription models (auto: bf16 for Whisper on CUDA, fp32 otherwise; int8: dynamic quantization of linear layers on CPU; bf16: autocast)')
+    parser.add_argument('--transcription_backend', choices=['torch', 'onnx'], default='torch', help='Backend to run the phoneme model (onnx: export once and run with onnxruntime on CPU)')
+    parser.add_argument('--onnx_cache_dir', type=str, default='onnx_cache', help='Directory to store the ONNX export of the phoneme model')
+    parser.add_argument('--onnx_intra_op_threads', type=int, default=0, help='onnxruntime threads inside an operator (0: same as torch)')
+    parser.add_argument('--onnx_inter_op_threads', type=int, default=1, help='onnxruntime threads running operators in parallel')
     parser.add_argument('--g2p_alignment_type', choices=['openjtalk+SOFA', 'openjtalk+domino', 'domino', 'ctc'],
                       default='openjtalk+SOFA', help='G2P alignment type')
     parser.add_argument('--g2p_model_path', type=str,
                       default='pydomino/onnx_model/phoneme_transition_model.onnx',
                       help="G2P model path")
+    parser.add_argument('--cascade_min_mean_score', type=float, default=0, help='With the phoneme model and SOFA/domino alignment, use the CTC alignment of files whose mean span score is at least this, and align only the other files by SOFA/domino (0: disabled)')
+    parser.add_argument('--cascade_min_p10_score', type=float, default=0.3, help='Minimum 10th percentile of the span scores to use the CTC alignment')
+    parser.add_argument('--cascade_max_low_ratio', type=float, default=0.1, help='Maximum ratio of spans scored below 0.5 to use the CTC alignment')
+    parser.add_argument('--cascade_report', type=str, default='cascade_report.jsonl', help='Report of the routing decisions and the confidence stats of the cascaded alignment')
+    parser.add_argument('--kana_dict_path', type=str, default='../jpn_dict_stops.txt', help='Dictionary with kana entries to convert texts written only in kana without pyopenjtalk, texts with kanji or other characters still go to pyopenjtalk (False: pyopenjtalk for everything)')
+    parser.add_argument('--g2p_workers', type=int, default=4, help='Number of processes converting texts not found in the g2p cache with pyopenjtalk')
+    parser.add_argument('--domino_chunk_sec', type=float, default=0, help='Align recordings longer than this with pydomino in chunks cut at silences matched to pau (0: disabled)')
+    parser.add_argument('--domino_workers', type=int, default=1, help='Number of threads aligning the chunks of a recording with pydomino')
     parser.add_argument('--sofa_model_path', type=str,
                       default="pretrain_models/sofa.japanese.test2.plus.step.100000.ckpt",
                       help="SOFA model path")
@@ -35,6 +67,12 @@ def parse_args():
                       help="SOFA dictionary path")
     parser.add_argument('--keep_punctuations', action='store_true', help='Try to keep punctuations')
     parser.add_argument('--use_punctuator', action='store_true', help='Use punctuation predictor (e.g. Kotoba-Whisper-v2.1)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes for making lab files (1: sequential)')
+    parser.add_argument('--shard_size', type=int, default=256, help='Split folders with more wav files than this into shards when using workers (0: no split)')
+    parser.add_argument('--scan_workers', type=int, default=8, help='Number of threads to scan directories and read audio headers for the dataset manifest')
+    parser.add_argument('--stage_cache_dir', type=str, default='stage_cache', help='Directory to cache transcription, g2p and alignment outputs by their inputs (False: disable)')
+    parser.add_argument('--audio_cache_dir', type=str, default=os.path.join("raw_data", ".audio_cache"), help='Directory to store decoded and resampled audio')
+    parser.add_argument('--audio_cache_size_gb', type=float, default=8.0, help='Size limit of the decoded audio cache in GiB (0: unlimited)')
     return parser.parse_args()
 
 def setup_directories(no_cleanup=False):
@@ -49,42 +87,157 @@ def setup_directories(no_cleanup=False):
     
     return all_shits, all_shits_not_wav_n_lab
 
-def extract_archive(data_zip_path, extract_path):
+def unpack_archive(data_zip_path, extract_path, ingest="7z", workers=4, on_audio=None):
+    if ingest == "stream" and data_zip_path.lower().endswith(('.zip', '.7z')):
+        # extract only the files we keep, members are decompressed in parallel
+        from archive_ingest import ingest_archive
+        ingest_archive(data_zip_path, extract_path, workers=workers, on_audio=on_audio)
+    else:
+        os.system(f'7z x "{data_zip_path}" -o{extract_path}')
+
+def extract_archive(data_zip_path, extract_path, ingest="7z", workers=4, on_audio=None):
     if os.path.exists(data_zip_path):
         zip_file_name = os.path.splitext(os.path.basename(data_zip_path))[0]
         with open(os.path.join(extract_path, "..", "..", "project_name.txt"), "w") as f:
             f.write(zip_file_name)
             
-        os.system(f'7z x "{data_zip_path}" -o{extract_path}')
+        unpack_archive(data_zip_path, extract_path, ingest=ingest, workers=workers, on_audio=on_audio)
 
-def process_lab_files(root_path):
-    for root, _, files in os.walk(root_path):
-        for filename in files:
-            if filename.endswith(".lab"):
-                file_path = os.path.join(root, filename)
-                with open(file_path, "r") as file:
-                    file_data = file.read()
-                file_data = file_data.replace("SP", "pau").replace("br", "AP")
-                with open(file_path, "w") as file:
-                    file.write(file_data)
+def unique_folder_name(name, used, suffix):
+    if name not in used:
+        return name
+    name = f"{name}_{suffix}"
+    unique_name = name
+    i = 2
+    while unique_name in used:
+        unique_name = f"{name}_{i}"
+        i += 1
+    return unique_name
 
-def collect_phonemes(data_type, phoneme_folder_path):
-    phonemes = set()
+def extract_archives(data_zip_paths, extract_path, ingest="7z", workers=4, on_audio=None):
+    """
+    Extracts several archives into one dataset tree, archives are extracted in parallel.
+    
+    Speaker folders with the same name in different archives are renamed with the
+    archive name (e.g. `singer_session2`), and files at the top level of an archive
+    go to a folder named after the archive. project_name.txt lists all archive names.
+    """
+    data_zip_paths = [p for p in data_zip_paths if os.path.exists(p)]
+    if len(data_zip_paths) <= 1:
+        for data_zip_path in data_zip_paths:
+            extract_archive(data_zip_path, extract_path, ingest=ingest, workers=workers, on_audio=on_audio)
+        return
+    
+    from concurrent.futures import ThreadPoolExecutor
+    zip_file_names = [os.path.splitext(os.path.basename(p))[0] for p in data_zip_paths]
+    with open(os.path.join(extract_path, "..", "..", "project_name.txt"), "w") as f:
+        f.write("+".join(zip_file_names))
     
-    def is_excluded(phoneme):
-        return phoneme in ["pau", "AP", "SP", "sil", "br"]
+    # extract each archive into its own staging directory first
+    staging_path = os.path.join(extract_path, "..", "ingest_staging")
+    staging_paths = [os.path.join(staging_path, str(i)) for i in range(len(data_zip_paths))]
+    num_parallel = max(1, min(len(data_zip_paths), workers))
+    with ThreadPoolExecutor(max_workers=num_parallel) as executor:
+        list(executor.map(
+            lambda i: unpack_archive(data_zip_paths[i], staging_paths[i], ingest=ingest, workers=max(1, workers // num_parallel)),
+            range(len(data_zip_paths)),
+        ))
+    
+    # merge into one tree with collision-safe speaker names
+    used = set(os.listdir(extract_path))
+    for zip_file_name, archive_staging_path in zip(zip_file_names, staging_paths):
+        if not os.path.exists(archive_staging_path):
+            continue
+        loose_files = []
+        for entry in sorted(os.listdir(archive_staging_path)):
+            src = os.path.join(archive_staging_path, entry)
+            if not os.path.isdir(src):
+                loose_files.append(src)
+                continue
+            folder_name = unique_folder_name(entry, used, zip_file_name)
+            used.add(folder_name)
+            if folder_name != entry:
+                print(f"Renamed speaker folder {entry} in {zip_file_name} to {folder_name}")
+            shutil.move(src, os.path.join(extract_path, folder_name))
+        if len(loose_files) > 0:
+            folder_name = unique_folder_name(zip_file_name, used, "files")
+            used.add(folder_name)
+            os.makedirs(os.path.join(extract_path, folder_name))
+            for src in loose_files:
+                shutil.move(src, os.path.join(extract_path, folder_name, os.path.basename(src)))
+    shutil.rmtree(staging_path, ignore_errors=True)
+    
+    if on_audio is not None:
+        # files were moved after extraction, decode them at their final paths
+        wav_paths = [os.path.join(root, file) for root, _, files in os.walk(extract_path) for file in files if file.endswith('.wav')]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            list(executor.map(on_audio, wav_paths))
+
+# labels replaced in .lab files, whole tokens only
+LAB_LABEL_MAP = {"SP": "pau", "br": "AP"}
+# labels not written to the phoneme dictionary
+EXCLUDED_PHONEMES = {"pau", "AP", "SP", "sil", "br"}
+
+
+def _scan_lab_file(file_path, normalize=True, count=True):
+    """
+    Reads a .lab once, counts its labels (with `count`, otherwise returns None) and,
+    with `normalize`, writes back the labels replaced by `LAB_LABEL_MAP` if any of them changed.
+    """
+    counts = Counter() if count else None
+    with open(file_path, "r") as file:
+        lines = file.read().split("\n")
+    changed = False
+    for i, line in enumerate(lines):
+        parts = line.split()
+        if len(parts) < 3:
+            continue
+        label = parts[2]
+        if normalize and label in LAB_LABEL_MAP:
+            label = LAB_LABEL_MAP[label]
+            parts[2] = label
+            lines[i] = ("\t" if "\t" in line else " ").join(parts)
+            changed = True
+        if count:
+            counts[label] += 1
+    if changed:
+        with open(file_path, "w") as file:
+            file.write("\n".join(lines))
+    return counts
+
+
+def scan_lab_files(root_path, normalize=True, workers=8, count=True):
+    """
+    Normalizes the labels of all .lab files under `root_path` and counts them in one parallel pass.
+
+    Returns:
+        A Counter of label -> number of occurrences (after normalization), None without `count`.
+    """
+    lab_paths = [os.path.join(root, filename) for root, _, files in os.walk(root_path) for filename in files if filename.endswith(".lab")]
+    counts = Counter() if count else None
+    if len(lab_paths) == 0:
+        return counts
+    from concurrent.futures import ProcessPoolExecutor
+    workers = max(1, min(workers, len(lab_paths)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for file_counts in executor.map(functools.partial(_scan_lab_file, normalize=normalize, count=count), lab_paths, chunksize=max(1, len(lab_paths) // (workers * 8))):
+            if count:
+                counts.update(file_counts)
+    return counts
+
+
+def process_lab_files(root_path, workers=8):
+    # the inventory of csv/ds data is read from other files, these labels are only normalized
+    scan_lab_files(root_path, normalize=True, workers=workers, count=False)
+
+def count_phonemes(data_type, phoneme_folder_path, workers=8):
+    """
+    Counts the phonemes of the dataset, excluding pauses and breaths.
+    """
+    counts = Counter()
     
     if data_type == "lab_wav":
-        for root, _, files in os.walk(phoneme_folder_path):
-            for file in files:
-                if file.endswith(".lab"):
-                    with open(os.path.join(root, file), "r") as lab_file:
-                        for line in lab_file:
-                            line = line.strip()
-                            if line:
-                                phoneme = line.split()[2]
-                                if not is_excluded(phoneme):
-                                    phonemes.add(phoneme)
+        counts = scan_lab_files(phoneme_folder_path, normalize=False, workers=workers)
     
     elif data_type == "csv_wav":
         for root, _, files in os.walk(phoneme_folder_path):
@@ -94,9 +247,7 @@ def collect_phonemes(data_type, phoneme_folder_path):
                         csv_reader = csv.DictReader(csv_file)
                         for row in csv_reader:
                             if "ph_seq" in row:
-                                for phoneme in row["ph_seq"].strip().split():
-                                    if not is_excluded(phoneme):
-                                        phonemes.add(phoneme)
+                                counts.update(row["ph_seq"].strip().split())
     
     else:  # ds format
         for root, _, files in os.walk(phoneme_folder_path):
@@ -106,13 +257,11 @@ def collect_phonemes(data_type, phoneme_folder_path):
                         data = json.load(json_file)
                         for entry in data:
                             if "ph_seq" in entry:
-                                for phoneme in entry["ph_seq"].strip().split():
-                                    if not is_excluded(phoneme):
-                                        phonemes.add(phoneme)
+                                counts.update(entry["ph_seq"].strip().split())
     
-    return sorted(phonemes)
+    return Counter({phoneme: count for phoneme, count in counts.items() if phoneme not in EXCLUDED_PHONEMES})
 
-def generate_phoneme_files(phonemes, dict_path):
+def generate_phoneme_files(phonemes, dict_path, counts=None):
     vowel_types = {"a", "i", "u", "e", "o", "N", "M", "NG"}
     liquid_types = {"y", "w", "l", "r"}
     
@@ -135,6 +284,12 @@ def generate_phoneme_files(phonemes, dict_path):
         for phoneme in phonemes:
             f.write(f"{phoneme}\t{phoneme}\n")
     
+    # Write occurrence counts, most frequent first
+    if counts is not None:
+        with open(os.path.join(directory, "phoneme_counts.txt"), "w") as f:
+            for phoneme, count in sorted(counts.items(), key=lambda item: (-item[1], item[0])):
+                f.write(f"{phoneme}\t{count}\n")
+    
     # Write component files
     for filename, data in [
         ("vowels.txt", vowels),
@@ -147,60 +302,311 @@ def generate_phoneme_files(phonemes, dict_path):
     return vowels, liquids, consonants
 
 
-def make_lab_files(args, root_path):
+g2p_model = None
+transcription_model = None
+transcription_phoneme_model = None
+transcription_g2p_tokenizers = None
+transcription_g2p_feature_extractor = None
+
+
+# longest input Whisper decodes at once, longer files are decoded in chunks
+WHISPER_WINDOW_SEC = 30.0
+
+
+def make_transcription_batches(args, durations):
+    """
+    Length-sorted transcription batches of files with `durations`, as lists of indices.
+    Files which need chunked decoding (longer than the Whisper window or than
+    --transcription_chunk_sec for the phoneme model) are batches of their own.
+    """
+    from transcription_batching import bucket_by_duration
+    long_sec = args.transcription_chunk_sec if args.transcription_phoneme_model != 'False' else WHISPER_WINDOW_SEC
+    return bucket_by_duration(durations, args.transcription_batch_size, args.transcription_bucket_sec, long_sec=long_sec, max_batch_sec=args.transcription_batch_sec)
+
+
+def shard_lab_work_units(args, root, files, manifest):
+    """
+    Split the files of one directory into work units for make_lab_files.
+
+    A work unit is (root, files, shard_files). `files` is always the full listing
+    of the directory so that sibling lookups (.lab, .txt, ...) stay the same as the
+    sequential run, `shard_files` is the subset of files to process (None: all).
+    Transcription batches are bucketed the same way as the sequential run and each
+    shard holds whole batches, so every file is transcribed in the same batch.
+    """
+    if args.shard_size <= 0:
+        return [(root, files, None)]
+    
+    from vad_slicing import is_sliced
+    # sliced recordings are processed as their slices
+    wav_files = [f for f in files if f.endswith('.wav') and not is_sliced(os.path.join(root, f))]
+    if len(wav_files) <= args.shard_size:
+        return [(root, files, None)]
+    
+    need_transcription_files = []
+    other_files = []
+    for f in wav_files:
+        stem = os.path.splitext(f)[0]
+        if stem + '.lab' not in files and stem + '.txt' not in files:
+            need_transcription_files.append(f)
+        else:
+            other_files.append(f)
+    
+    durations = [manifest.duration(os.path.join(root, f)) for f in need_transcription_files]
+    batches = make_transcription_batches(args, durations)
+    
+    shard_sets = []
+    shard = set()
+    for batch in batches:
+        shard.update(need_transcription_files[j] for j in batch)
+        if len(shard) >= args.shard_size:
+            shard_sets.append(shard)
+            shard = set()
+    # files with transcriptions are processed independently
+    for f in other_files:
+        shard.add(f)
+        if len(shard) >= args.shard_size:
+            shard_sets.append(shard)
+            shard = set()
+    if len(shard) > 0:
+        shard_sets.append(shard)
+    
+    # keep the directory order in each shard
+    return [(root, files, [f for f in wav_files if f in shard]) for shard in shard_sets]
+
+
+def _init_lab_worker(num_threads):
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+
+
+def _make_lab_files_worker(args, root_path, work_unit):
+    # models, aligner and g2p state are module globals, so each worker process holds its own
+    make_lab_files(args, root_path, work_units=[work_unit])
+    return work_unit[0]
+
+
+def make_lab_files(args, root_path, work_units=None):
     if args.transcription_model == 'False' and args.transcription_phoneme_model == 'False':
         print("No transcription model or phoneme model specified. Skipping...")
         return
     
+    from dataset_manifest import load_manifest
+    # the parent refreshes the manifest, workers only read it
+    manifest = load_manifest(root_path, refresh=work_units is None, workers=args.scan_workers, hash_audio=args.stage_cache_dir != 'False')
+    
+    from vad_slicing import is_sliced, merge_sliced_recordings, slice_long_recordings, SLICES_SUFFIX
+    if work_units is None and args.slice_sec > 0:
+        # cut long recordings at silences, the slices are processed as a folder next to them
+        long_wav_paths = [
+            os.path.join(root, f)
+            for root, _, files in manifest.walk(root_path)
+            if not root.endswith(SLICES_SUFFIX)
+            for f in files
+            # a recording with its own transcription or label can not be split into slices
+            if f.endswith('.wav') and os.path.splitext(f)[0] + '.lab' not in files and os.path.splitext(f)[0] + '.txt' not in files
+            and not is_sliced(os.path.join(root, f)) and manifest.duration(os.path.join(root, f)) > args.slice_sec
+        ]
+        if len(long_wav_paths) > 0:
+            num_slices = slice_long_recordings(long_wav_paths, args.slice_sec, top_db=args.slice_top_db, workers=args.scan_workers)
+            print(f"Sliced {len(long_wav_paths)} long recordings into {num_slices} slices")
+            manifest = load_manifest(root_path, workers=args.scan_workers, hash_audio=args.stage_cache_dir != 'False')
+    
+    # CTC alignments with enough confidence are used, others go to the slower aligner
+    cascade = args.cascade_min_mean_score > 0 and args.transcription_phoneme_model != 'False' and not args.g2p_alignment_type.endswith('ctc')
+    if cascade:
+        from alignment_cascade import append_routes, summarize_routes, clear_routes, worker_report_path
+        if work_units is None:
+            clear_routes(args.cascade_report)
+        # worker processes write their own report, the parent merges them
+        cascade_report = args.cascade_report if work_units is None else worker_report_path(args.cascade_report)
+    
+    if work_units is None and args.workers > 1:
+        work_units = []
+        for folder_name in os.listdir(root_path):
+            folder_path = os.path.join(root_path, folder_name)
+            if os.path.isdir(folder_path):
+                for root, _, files in manifest.walk(folder_path):
+                    work_units.extend(shard_lab_work_units(args, root, files, manifest))
+        
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        num_threads = max(1, (os.cpu_count() or 1) // args.workers)
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_lab_worker, initargs=(num_threads,)) as executor:
+            futures = [executor.submit(_make_lab_files_worker, args, root_path, work_unit) for work_unit in work_units]
+            try:
+                for future in as_completed(futures):
+                    print(f"Processed folder: {future.result()}")
+            except BaseException:
+                # do not wait for the remaining shards before the error surfaces
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+        merge_sliced_recordings(root_path)
+        if cascade:
+            summarize_routes(args.cascade_report)
+        return
+    
     import torch
     from transformers import pipeline, AutoProcessor
     import numpy as np
     import librosa
     from tqdm import tqdm
+    from audio_store import configure_audio_store
+    from transcription_batching import prefetch, chunk_windows, stitch_windows, MemoryBackoff
+    from transcription_precision import resolve_precision, apply_precision, quantize_model, autocast
+    transcription_precision = resolve_precision(args.transcription_precision, "cuda" if torch.cuda.is_available() else "cpu")
+    # auto keeps the phoneme model in fp32
+    ctc_precision = 'fp32' if args.transcription_precision == 'auto' else transcription_precision
+    memory_backoff = MemoryBackoff(int(args.transcription_max_rss_gb * 1024 ** 3))
+    audio_store = configure_audio_store(args.audio_cache_dir, max_bytes=int(args.audio_cache_size_gb * 1024 ** 3))
     if args.g2p_alignment_type.startswith('openjtalk'):
-        from g2p_openjtalk import g2p_openjtalk as g2p
+        from g2p_openjtalk import g2p_batch, shutdown_g2p_pool
         
     if args.g2p_alignment_type.endswith('SOFA'):
-        sofa_infer_script = "./SOFA/infer.py"
+        from align_sofa import get_sofa_aligner
     elif args.g2p_alignment_type.endswith('domino'):
         from align_domino import align_domino as aligner
         from align_domino import pre_cleanup as aligner_pre_cleanup
         
     if args.transcription_phoneme_model != 'False':
-        import torchaudio
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        from ctc_align import token_labels, ctc_collapse_batch, ctc_alignment_to_htk, format_htk, get_ctc_forced_alignment_batch, alignment_confidence, confidence_passes
         from transformers import AutoModel, AutoTokenizer, AutoFeatureExtractor
         
     global g2p_model
-    g2p_model = None
-        
     global transcription_model
-    transcription_model = None
-    
     global transcription_phoneme_model
-    transcription_phoneme_model = None
-    
     global transcription_g2p_tokenizers
-    transcription_g2p_tokenizers = None
     global transcription_g2p_feature_extractor
-    transcription_g2p_feature_extractor = None
+    
+    stage_cache = None
+    if args.stage_cache_dir != 'False':
+        from stage_cache import StageCache, hash_file
+        stage_cache = StageCache(args.stage_cache_dir)
+    # parameters which change the generated files of a wav
+    output_params = {k: getattr(args, k) for k in [
+        "transcription_model", "transcription_phoneme_model", "transcription_language", "use_punctuator",
+        "g2p_alignment_type", "g2p_model_path", "kana_dict_path", "domino_chunk_sec", "sofa_model_path", "sofa_dict_path", "keep_punctuations",
+        "cascade_min_mean_score", "cascade_min_p10_score", "cascade_max_low_ratio",
+    ]}
+    output_keys = {}
+    
+    def get_output_key(wav_path):
+        # inputs of the generated files of a wav: the audio, the parameters, and the transcript if it is given by the user
+        if wav_path not in output_keys:
+            text_file = os.path.splitext(wav_path)[0] + '.txt'
+            text_hash = None
+            if os.path.exists(text_file) and not stage_cache.is_generated(text_file):
+                text_hash = hash_file(text_file)
+            output_keys[wav_path] = stage_cache.key("outputs", audio=manifest.content_hash(wav_path), text=text_hash, **output_params)
+        return output_keys[wav_path]
+    
+    def write_output(path, content, wav_path):
+        if stage_cache is None:
+            with open(path, 'w') as f:
+                f.write(content)
+        else:
+            stage_cache.write_output(path, content, get_output_key(wav_path))
+    
+    def get_transcription_key(wav_path, return_timestamps=False):
+        if args.transcription_phoneme_model == 'False':
+            model_params = {"model": args.transcription_model, "language": args.transcription_language, "use_punctuator": args.use_punctuator, "return_timestamps": return_timestamps, "precision": args.transcription_precision}
+        else:
+            model_params = {"model": args.transcription_phoneme_model, "ctc_alignment": args.g2p_alignment_type.endswith('ctc') or cascade, "backend": args.transcription_backend, "precision": args.transcription_precision}
+        return stage_cache.key("transcription", audio=manifest.content_hash(wav_path), **model_params)
+    
+    # workers of a sharded run convert their own texts
+    g2p_workers = args.g2p_workers if work_units is None else 1
+    
+    kana_trie = None
+    if args.g2p_alignment_type.startswith('openjtalk') and args.kana_dict_path != 'False':
+        if os.path.exists(args.kana_dict_path):
+            from kana_g2p import KanaTrie
+            # only phonemes SOFA knows, other entries are left to pyopenjtalk
+            inventory_path = args.sofa_dict_path if args.g2p_alignment_type.endswith('SOFA') and os.path.exists(args.sofa_dict_path) else None
+            kana_trie = KanaTrie.from_files([args.kana_dict_path], inventory_path=inventory_path)
+        else:
+            print(f"Kana dictionary {args.kana_dict_path} not found, using pyopenjtalk for all texts")
+    
+    def g2p_cached(texts, **g2p_kwargs):
+        # memoized by the cleaned text, in the stage cache across runs
+        return g2p_batch(texts, cache_dir=args.stage_cache_dir if stage_cache is not None else None, workers=g2p_workers, kana_trie=kana_trie, **g2p_kwargs)
+    
+    # wav path -> phonemes to align by SOFA, aligned at once for all folders
+    sofa_pending = {}
+    
+    def align_sofa_pending():
+        aligned = {}
+        sofa_keys = {}
+        if stage_cache is not None:
+            for k, phonemes in sofa_pending.items():
+                sofa_keys[k] = stage_cache.key("sofa", audio=manifest.content_hash(k), phonemes=phonemes, model=args.sofa_model_path, dictionary=args.sofa_dict_path)
+                value = stage_cache.get("sofa", sofa_keys[k])
+                if value is not None:
+                    aligned[k] = value
+        need_sofa_files = [k for k in sofa_pending if k not in aligned]
+        if len(need_sofa_files) > 0:
+            # the checkpoint is loaded once per process
+            sofa_aligner = get_sofa_aligner(args.sofa_model_path, args.sofa_dict_path)
+            for k, phonemes_htk in sofa_aligner.align(need_sofa_files, durations=[manifest.duration(k) for k in need_sofa_files]).items():
+                aligned[k] = phonemes_htk
+                if stage_cache is not None:
+                    stage_cache.put("sofa", sofa_keys[k], phonemes_htk)
+        for k, phonemes_htk in aligned.items():
+            write_output(os.path.splitext(k)[0] + '.lab', phonemes_htk, k)
+        sofa_pending.clear()
+    
+    def align_cached(phonemes, wav_path):
+        global g2p_model
+        if stage_cache is None:
+            aligned, g2p_model = aligner(phonemes, wav_path, g2p_model, model_path=args.g2p_model_path, chunk_sec=args.domino_chunk_sec, workers=args.domino_workers)
+            return aligned
+        key = stage_cache.key("domino", audio=manifest.content_hash(wav_path), phonemes=phonemes, model=args.g2p_model_path, chunk_sec=args.domino_chunk_sec)
+        aligned = stage_cache.get("domino", key)
+        if aligned is None:
+            aligned, g2p_model = aligner(phonemes, wav_path, g2p_model, model_path=args.g2p_model_path, chunk_sec=args.domino_chunk_sec, workers=args.domino_workers)
+            stage_cache.put("domino", key, aligned)
+        return aligned
         
-    def make_lab_into_dir(root_path):
+    def make_lab_into_dir(root_path, work_units=None):
         global transcription_model, g2p_model, transcription_phoneme_model, transcription_g2p_tokenizers, transcription_g2p_feature_extractor
-        for root, _, files in os.walk(root_path):
+        if work_units is None:
+            work_units = [(root, files, None) for root, _, files in manifest.walk(root_path)]
+        for root, files, shard_files in work_units:
+            if stage_cache is not None:
+                # generated files whose inputs changed are removed and regenerated
+                stale_files = []
+                for filename in (files if shard_files is None else shard_files):
+                    if filename.endswith('.wav'):
+                        output_key = get_output_key(os.path.join(root, filename))
+                        for ext in ['.txt', '.phonemes.txt', '.lab']:
+                            sibling = os.path.splitext(filename)[0] + ext
+                            if sibling in files and stage_cache.is_stale(os.path.join(root, sibling), output_key):
+                                stale_files.append(sibling)
+                if len(stale_files) > 0:
+                    print(f"Regenerating {len(stale_files)} outdated files in {root}")
+                    for sibling in stale_files:
+                        os.remove(os.path.join(root, sibling))
+                    files = [f for f in files if f not in stale_files]
             wav_exists = False
             max_wav_duration = 0.0
+            wav_durations = {}
             need_transcription_files = []
             need_phonemization_files = []
             need_alignment_files = []
             file_paths = [os.path.join(root, file) for file in files]
-            for filename in files:
+            for filename in (files if shard_files is None else shard_files):
                 file_path = os.path.join(root, filename)
                 if os.path.isdir(file_path):
                     make_lab_into_dir(file_path)
-                elif os.path.isfile(file_path) and file_path.endswith('.wav'):
+                elif os.path.isfile(file_path) and file_path.endswith('.wav') and not is_sliced(file_path):
                     wav_exists = True
                     if not os.path.splitext(file_path)[0] + '.lab' in file_paths and (args.transcription_model != 'False' or args.transcription_phoneme_model != 'False'):
-                        wav_duration = librosa.get_duration(filename=file_path)
+                        wav_duration = manifest.duration(file_path)
+                        wav_durations[file_path] = wav_duration
                         if wav_duration > max_wav_duration:
                             max_wav_duration = wav_duration
                         need_alignment_files.append(file_path)
@@ -216,12 +622,25 @@ def make_lab_files(args, root_path):
                 # transcription and alignment
                 phonemeses = {}
                 all_texts = {}
-                if len(need_transcription_files) + len(need_phonemization_files) > 0:
-                    torch_dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
+                transcribed_texts = []
+                # wav path -> (CTC alignment, confidence stats) in the cascaded mode
+                ctc_aligned = {}
+                cascade_accepted = {}
+                # reuse transcriptions of the same audio with the same model
+                cached_transcriptions = {}
+                all_need_transcription_files = need_transcription_files
+                if stage_cache is not None:
+                    for f in need_transcription_files:
+                        value = stage_cache.get("transcription", get_transcription_key(f, wav_durations[f] > WHISPER_WINDOW_SEC))
+                        if value is not None:
+                            cached_transcriptions[f] = value
+                    need_transcription_files = [f for f in need_transcription_files if f not in cached_transcriptions]
+                if len(need_transcription_files) > 0:
+                    torch_dtype = torch.bfloat16 if transcription_precision == 'bf16' else torch.float32
                     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
                     if args.transcription_phoneme_model == 'False':
                         # return_timestamps = max_wav_duration > 30.0 if args.g2p_alignment_type != 'whisper+domino' else "word"
-                        return_timestamps = max_wav_duration > 30.0
+                        return_timestamps = False
                         # generate_kwargs = {"language": args.transcription_language, "task": "transcribe", "return_timestamps": return_timestamps}
                         generate_kwargs = {"language": args.transcription_language, "task": "transcribe"}
                         if transcription_model is None:
@@ -250,7 +669,23 @@ def make_lab_files(args, root_path):
                                 model_kwargs=model_kwargs,
                                 **pipeline_kwargs,
                             )
-                        transcribed_texts = transcription_model(need_transcription_files, generate_kwargs=generate_kwargs, return_timestamps=return_timestamps, batch_size=args.transcription_batch_size)
+                            if transcription_precision == 'int8':
+                                transcription_model.model = quantize_model(transcription_model.model)
+                        def transcribe_batch(batch_index):
+                            inputs = [{"raw": np.asarray(audio_store.load(need_transcription_files[j], sr=16_000)), "sampling_rate": 16_000} for j in batch_index]
+                            if any(wav_durations[need_transcription_files[j]] > WHISPER_WINDOW_SEC for j in batch_index):
+                                # chunked long-form decoding, the chunks of the file are batched
+                                return transcription_model(inputs, generate_kwargs=generate_kwargs, return_timestamps=True, chunk_length_s=WHISPER_WINDOW_SEC, batch_size=max(1, args.transcription_batch_size))
+                            return transcription_model(inputs, generate_kwargs=generate_kwargs, return_timestamps=return_timestamps, batch_size=len(inputs))
+                        
+                        # length-sorted batches of short files, long files one by one, results are restored to the original order
+                        transcribed_texts = [None] * len(need_transcription_files)
+                        batch_indices = make_transcription_batches(args, [wav_durations[f] for f in need_transcription_files])
+                        for batch_index in tqdm(batch_indices, desc='transcription'):
+                            # made smaller under memory pressure
+                            for sub_batch_index, texts in memory_backoff.run(transcribe_batch, batch_index):
+                                for j, text in zip(sub_batch_index, texts):
+                                    transcribed_texts[j] = text
                     else:
                         print(f"Transcription with phoneme model: {args.transcription_phoneme_model}")
                         if transcription_phoneme_model is None:
@@ -261,216 +696,160 @@ def make_lab_files(args, root_path):
                                 "phoneme_tokenizer": AutoTokenizer.from_pretrained(args.transcription_phoneme_model, trust_remote_code=True, subfolder=tokenizer_subfolders[1]),
                             }
                             transcription_phoneme_model = AutoModel.from_pretrained(args.transcription_phoneme_model, trust_remote_code=True).to(device)
-                        transcribed_texts = []
-                        need_transcription_files_batched = [need_transcription_files[i:i+args.transcription_batch_size] for i in range(0, len(need_transcription_files), args.transcription_batch_size)]
+                            if args.transcription_backend == 'onnx':
+                                # exported once to ONNX, then run by onnxruntime on CPU
+                                from ctc_onnx import ONNXPhonemeModel
+                                if ctc_precision == 'bf16':
+                                    print("bf16 is not supported by the onnx backend, using fp32")
+                                transcription_phoneme_model = ONNXPhonemeModel(transcription_phoneme_model, args.transcription_phoneme_model, cache_dir=args.onnx_cache_dir, intra_op_threads=args.onnx_intra_op_threads, inter_op_threads=args.onnx_inter_op_threads, quantize=ctc_precision == 'int8')
+                            else:
+                                transcription_phoneme_model = apply_precision(transcription_phoneme_model, ctc_precision)
+                        # length-sorted batches to reduce padding, results are restored to the original order
+                        transcribed_texts = [None] * len(need_transcription_files)
+                        # long files are batches of their own, transcribed in overlapping windows
+                        batch_indices = make_transcription_batches(args, [wav_durations[f] for f in need_transcription_files])
+                        if args.transcription_batch_sec > 0 and args.transcription_chunk_sec > 0:
+                            window_batch_size = max(1, int(args.transcription_batch_sec // args.transcription_chunk_sec))
+                        else:
+                            window_batch_size = max(1, args.transcription_batch_size)
+                        need_transcription_files_batched = [[need_transcription_files[j] for j in batch_index] for batch_index in batch_indices]
                         
-                        def get_ctc_forced_alignment(
-                            logits: torch.Tensor,
-                            token_ids: list[int],
-                            blank_id: int = 0,
-                            frame_rate: float = 50.0,  # 50 frames/sec (20ms/frame) for HuBERT
-                            pad_sec: float = 0.1,      # padded silence length (sec)
-                            delay_sec: float = 0.0    # calibration delay for Emission Delay of CTC (sec)
-                        ):
-                            if logits.ndim == 2:
-                                logits = logits.unsqueeze(0)  # add batch dimension (1, frames, num_tokens)
-                                
-                            # targets = torch.tensor(token_ids, dtype=torch.int32, device=logits.device)
-                            targets = token_ids
-                            # remove blank
-                            targets = targets[targets != blank_id]
-                            if targets.ndim == 1:
-                                targets = targets.unsqueeze(0)  # add batch dimension (1, num_tokens)
-                            # print(targets)
-                            
-                            # Forced Alignment
-                            alignments, scores = torchaudio.functional.forced_align(logits, targets, blank=blank_id)
-                            alignments = alignments[0]
-                            scores = scores[0].exp()  # back to probability
-                            
-                            # merge tokens
-                            token_spans = torchaudio.functional.merge_tokens(alignments, scores)
-                            
-                            total_offset_sec = pad_sec + delay_sec
-                            results =[]
-                            for span in token_spans:
-                                # frame index to sec
-                                start_time_sec = span.start / frame_rate
-                                end_time_sec = span.end / frame_rate
-                                # correct time
-                                corrected_start = max(0.0, start_time_sec - total_offset_sec)
-                                corrected_end   = max(0.0, end_time_sec - total_offset_sec)
-                                results.append({
-                                    "token_id": span.token,
-                                    "start_time": round(corrected_start, 3),
-                                    "end_time": round(corrected_end, 3),
-                                    "score": round(span.score, 4)
-                                })
-                                
-                            return results, total_offset_sec
+                        def prepare_batch(need_transcription_files_batch):
+                            # decode, pad and extract features (runs on the prefetch threads)
+                            wav_files = [audio_store.load(wav_path, sr=16_000) for wav_path in need_transcription_files_batch]
+                            max_wav_samples = max(len(wav) for wav in wav_files)
+                            max_wav_samples = max_wav_samples + 8_000   # +0.5s
+                            wav_files_padded = np.array([np.pad(wav, (max_wav_samples - len(wav), 0), 'constant') for wav in wav_files])
+                            features = transcription_g2p_feature_extractor(wav_files_padded, sampling_rate=16_000, return_tensors="pt", return_attention_mask=True)
+                            windows = None
+                            if args.transcription_chunk_sec > 0 and len(need_transcription_files_batch) == 1 and wav_durations[need_transcription_files_batch[0]] > args.transcription_chunk_sec:
+                                # features are normalized over the whole file, then cut into windows
+                                windows = chunk_windows(max_wav_samples, int(args.transcription_chunk_sec * 16_000), int(args.transcription_chunk_overlap_sec * 16_000))
+                            return wav_files, max_wav_samples, features, windows
                         
-                        with torch.no_grad():
-                            for i, need_transcription_files_batch in enumerate(tqdm(need_transcription_files_batched, desc='transcription+g2p')):
-                                wav_files = [wav for wav, _ in [librosa.load(wav_path, sr=16_000, mono=True, dtype=np.float32) for wav_path in need_transcription_files_batch]]
-                                max_wav_samples = max(len(wav) for wav in wav_files)
-                                max_wav_samples = max_wav_samples + 8_000   # +0.5s
-                                wav_files_padded = np.array([np.pad(wav, (max_wav_samples - len(wav), 0), 'constant') for wav in wav_files])
-                                features = transcription_g2p_feature_extractor(wav_files_padded, sampling_rate=16_000, return_tensors="pt", return_attention_mask=True)
-                                input_values = features.input_values.to(device)
-                                attention_mask = features.attention_mask.to(device)
-                                outputs = transcription_phoneme_model(input_values, attention_mask=attention_mask)
-                                kana_logits_argmax = outputs["kana_logits"].argmax(dim=-1)
-                                phoneme_logits_argmax = outputs["phoneme_logits"].argmax(dim=-1)
-                                if args.g2p_alignment_type.endswith('ctc'):
-                                    for i, (phoneme_logits, filename) in enumerate(zip(outputs["phoneme_logits"], need_transcription_files_batch)):
-                                        additional_padded_sec = (max_wav_samples - len(wav_files[i])) / 16_000
-                                        phoneme_aligned, total_offset_sec = get_ctc_forced_alignment(phoneme_logits, phoneme_logits_argmax[i], pad_sec=additional_padded_sec, blank_id=transcription_g2p_tokenizers["phoneme_tokenizer"].pad_token_id)
-                                        
-                                        wav_array = wav_files[i]
+                        def run_phoneme_model(input_values, attention_mask, windows=None):
+                            if windows is None:
+                                with autocast(ctc_precision, device):
+                                    outputs = transcription_phoneme_model(input_values.to(device), attention_mask=attention_mask.to(device))
+                                return {"kana_logits": outputs["kana_logits"].to("cpu").float(), "phoneme_logits": outputs["phoneme_logits"].to("cpu").float()}
+                            # windows of the same length are run together, at most batch size windows at once
+                            window_outputs = {"kana_logits": [], "phoneme_logits": []}
+                            i = 0
+                            while i < len(windows):
+                                window_length = windows[i][1] - windows[i][0]
+                                j = i
+                                while j < len(windows) and j - i < window_batch_size and windows[j][1] - windows[j][0] == window_length:
+                                    j += 1
+                                window_values = torch.stack([input_values[0, start:end] for start, end in windows[i:j]])
+                                window_mask = torch.stack([attention_mask[0, start:end] for start, end in windows[i:j]])
+                                with autocast(ctc_precision, device):
+                                    outputs = transcription_phoneme_model(window_values.to(device), attention_mask=window_mask.to(device))
+                                for k in window_outputs:
+                                    window_outputs[k].extend(outputs[k].to("cpu").float())
+                                del window_values, window_mask, outputs
+                                i = j
+                            return {k: stitch_windows(v, windows).unsqueeze(0) for k, v in window_outputs.items()}
+                        
+                        def postprocess_batch(need_transcription_files_batch, batch_index, wav_files, max_wav_samples, outputs):
+                            # forced alignment, decoding and writing (runs on the post-processing thread)
+                            kana_logits_argmax = outputs["kana_logits"].argmax(dim=-1)
+                            phoneme_logits_argmax = outputs["phoneme_logits"].argmax(dim=-1)
+                            if args.g2p_alignment_type.endswith('ctc') or cascade:
+                                phoneme_labels = token_labels(transcription_g2p_tokenizers["phoneme_tokenizer"])
+                                pad_secs = [(max_wav_samples - len(wav)) / 16_000 for wav in wav_files]
+                                # forced alignment of the whole batch at once
+                                phoneme_aligned_batch = get_ctc_forced_alignment_batch(outputs["phoneme_logits"], phoneme_logits_argmax, pad_secs=pad_secs, blank_id=transcription_g2p_tokenizers["phoneme_tokenizer"].pad_token_id)
+                                for i, ((token_ids, start_times, end_times, span_scores), filename) in enumerate(zip(phoneme_aligned_batch, need_transcription_files_batch)):
+                                    starts, ends, labels = ctc_alignment_to_htk(token_ids, start_times, end_times, phoneme_labels, wav_files[i])
+                                    phonemes_htk = format_htk(starts, ends, labels)
+                                    if cascade:
+                                        # routed after transcription
+                                        ctc_aligned[filename] = (phonemes_htk, alignment_confidence(span_scores))
+                                        continue
+                                    
+                                    # save aligned phonemes
+                                    with open(os.path.splitext(filename)[0] + '.phonemes_aligned.txt', 'w') as f:
+                                        f.write(phonemes_htk)
                                         
-                                        is_speech = np.zeros(len(wav_array), dtype=bool)
-                                        non_silent_intervals = librosa.effects.split(wav_array, top_db=30)
-                                        for start_samp, end_samp in non_silent_intervals:
-                                            is_speech[start_samp:end_samp] = True
+                                    phonemeses[filename] = phonemes_htk
                                         
-                                        phonemes = [["0", "0", "pau"]]
-                                        current_sec = 0.0
-                                        for item in phoneme_aligned:
-                                            # get char from token id in phoneme_aligned
-                                            phoneme = transcription_g2p_tokenizers["phoneme_tokenizer"].decode(item["token_id"])
-                                            start_sec = item["start_time"]
-                                            end_sec = item["end_time"]
-                                            
-                                            if end_sec <= start_sec:
-                                                continue
-                                            
-                                            if start_sec > current_sec and len(phonemes) > 0:
-                                                # # add silence
-                                                # sil_start_htk = int(round(current_sec * 10_000_000))
-                                                # sil_end_htk = int(round(start_sec * 10_000_000))
-                                                # if sil_end_htk > sil_start_htk:
-                                                #     phonemes.append([str(sil_start_htk), str(sil_end_htk), "pau"])
-                                                
-                                                # # change previous end time
-                                                # phonemes[-1][1] = str(int(round(start_sec * 10_000_000)))
-                                                
-                                                # Analyze the gap between the last phoneme and the current CTC spike
-                                                gap_start_samp = min(int(current_sec * 16_000), len(wav_array))
-                                                gap_end_samp = min(int(start_sec * 16_000), len(wav_array))
-                                                
-                                                gap_speech = is_speech[gap_start_samp:gap_end_samp]
-                                                silence_indices = np.where(~gap_speech)[0]
-                                                
-                                                # If we find at least 20ms of silence (320 samples at 16kHz) in this gap
-                                                if len(silence_indices) > 320 and not phonemes[-1][2] == "cl":
-                                                    sil_start_in_gap = silence_indices[0]
-                                                    sil_end_in_gap = silence_indices[-1]
-                                                    
-                                                    actual_sil_start_sec = current_sec + (sil_start_in_gap / 16_000)
-                                                    actual_sil_end_sec = current_sec + (sil_end_in_gap / 16_000)
-                                                    
-                                                    sil_start_htk = int(round(actual_sil_start_sec * 10_000_000))
-                                                    sil_end_htk = int(round(actual_sil_end_sec * 10_000_000))
-                                                    
-                                                    if phonemes[-1][2] == "pau":
-                                                        # Merge into previous pause
-                                                        phonemes[-1][1] = str(sil_end_htk)
-                                                    else:
-                                                        # Stop previous phoneme exactly where silence starts, then insert pau
-                                                        phonemes[-1][1] = str(sil_start_htk)
-                                                        phonemes.append([str(sil_start_htk), str(sil_end_htk), "pau"])
-                                                    
-                                                    # The current phoneme effectively starts right after the silence
-                                                    phoneme_start_sec = actual_sil_end_sec
-                                                else:
-                                                    # No significant silence detected, stretch previous phoneme
-                                                    phonemes[-1][1] = str(int(round(start_sec * 10_000_000)))
-                                                    phoneme_start_sec = start_sec
-                                            else:
-                                                phoneme_start_sec = start_sec
-                                                
-                                            phoneme_end_sec = max(end_sec, phoneme_start_sec)
-                                                    
-                                            # start_htk = int(round(start_sec * 10_000_000))
-                                            # end_htk = int(round(end_sec * 10_000_000))
-                                            
-                                            # phonemes.append([str(start_htk), str(end_htk), phoneme])
-                                            # current_sec = end_sec
-                                            
-                                            start_htk = int(round(phoneme_start_sec * 10_000_000))
-                                            end_htk = int(round(phoneme_end_sec * 10_000_000))
-                                            
-                                            phonemes.append([str(start_htk), str(end_htk), phoneme])
-                                            current_sec = phoneme_end_sec
-                                            
-                                        # add silence
-                                        wav_sec = wav_files[i].shape[0] / 16_000
-                                        sil_start_htk = int(round(current_sec * 10_000_000))
-                                        sil_end_htk = int(round(wav_sec * 10_000_000))
-                                        if len(phonemes) > 1 and sil_end_htk > sil_start_htk:
-                                            # # detect end of silence
-                                            # _, index = librosa.effects.trim(wav_files[i], top_db=30)
-                                            # detected_end_sec = index[1] / 16_000
-                                            # last_phoneme_end_sec = max(current_sec + 0.05, detected_end_sec)
-                                            # last_phoneme_end_htk = int(round(last_phoneme_end_sec * 10_000_000))
-                                            # last_phoneme_end_htk = min(last_phoneme_end_htk, sil_end_htk)
-                                            # phonemes[-1][1] = str(last_phoneme_end_htk)
-                                            # phonemes.append([str(last_phoneme_end_htk), str(sil_end_htk), "pau"])
-                                            
-                                            # Find the last moment of speech in the file
-                                            speech_indices = np.where(is_speech)[0]
-                                            if len(speech_indices) > 0:
-                                                detected_end_sec = speech_indices[-1] / 16_000
-                                            else:
-                                                detected_end_sec = current_sec
-                                                
-                                            last_phoneme_start_sec = int(phonemes[-1][0]) / 10_000_000
-                                            last_phoneme_end_sec = max(last_phoneme_start_sec + 0.05, detected_end_sec)
-                                            last_phoneme_end_sec = min(last_phoneme_end_sec, wav_sec)
-                                            
-                                            last_phoneme_end_htk = int(round(last_phoneme_end_sec * 10_000_000))
-                                            phonemes[-1][1] = str(last_phoneme_end_htk)
-                                            
-                                            if sil_end_htk > last_phoneme_end_htk:
-                                                if phonemes[-1][2] == "pau":
-                                                    phonemes[-1][1] = str(sil_end_htk)
-                                                else:
-                                                    phonemes.append([str(last_phoneme_end_htk), str(sil_end_htk), "pau"])
-                                            
-                                            
-                                        # save aligned phonemes
-                                        with open(os.path.splitext(filename)[0] + '.phonemes_aligned.txt', 'w') as f:
-                                            f.write('\n'.join('\t'.join(p) for p in phonemes))
-                                            
-                                        phonemeses[filename] = '\n'.join('\t'.join(p) for p in phonemes)
-                                            
-                                    # phoneme_aligned = get_ctc_forced_alignment(outputs["phoneme_logits"], phonemes, blank_id=transcription_g2p_tokenizers["phoneme_tokenizer"].pad_token_id)
-                                kanas = [transcription_phoneme_model.ctc_decode(kana_logits.to("cpu").tolist(), transcription_g2p_tokenizers["kana_tokenizer"], is_kana=True) for kana_logits in kana_logits_argmax]
-                                phonemes = [transcription_phoneme_model.ctc_decode(phoneme_logits.to("cpu").tolist(), transcription_g2p_tokenizers["phoneme_tokenizer"]) for phoneme_logits in phoneme_logits_argmax]
-                                kanas = ["…" if kana.strip() == "" else kana for kana in kanas]
-                                phonemes = ["…" if phoneme.strip() == "" else phoneme for phoneme in phonemes]
-                                transcribed_texts.extend([{"text": kana, "phoneme": phoneme} for kana, phoneme in zip(kanas, phonemes)])
+                                # phoneme_aligned = get_ctc_forced_alignment(outputs["phoneme_logits"], phonemes, blank_id=transcription_g2p_tokenizers["phoneme_tokenizer"].pad_token_id)
+                            # repeated ids are merged for the whole batch at once before decoding
+                            kanas = [transcription_phoneme_model.ctc_decode(kana_ids.tolist(), transcription_g2p_tokenizers["kana_tokenizer"], is_kana=True) for kana_ids in ctc_collapse_batch(kana_logits_argmax)]
+                            phonemes = [transcription_phoneme_model.ctc_decode(phoneme_ids.tolist(), transcription_g2p_tokenizers["phoneme_tokenizer"]) for phoneme_ids in ctc_collapse_batch(phoneme_logits_argmax)]
+                            kanas = ["…" if kana.strip() == "" else kana for kana in kanas]
+                            phonemes = ["…" if phoneme.strip() == "" else phoneme for phoneme in phonemes]
+                            for j, kana, phoneme in zip(batch_index, kanas, phonemes):
+                                transcribed_texts[j] = {"text": kana, "phoneme": phoneme}
+                        
+                        # decode and feature extraction of the next batches, model inference, and post-processing run overlapped
+                        with torch.no_grad(), ThreadPoolExecutor(max_workers=1) as postprocess_executor:
+                            postprocess_futures = deque()
+                            batches = list(zip(need_transcription_files_batched, batch_indices))
+                            for (need_transcription_files_batch, batch_index), (wav_files, max_wav_samples, features, windows) in tqdm(prefetch(lambda batch: prepare_batch(batch[0]), batches, num_workers=args.transcription_prefetch_workers, depth=args.transcription_prefetch), total=len(batches), desc='transcription+g2p'):
+                                def run_sub_batch(positions):
+                                    # the prefetched batch is decoded again only when it is split under memory pressure
+                                    if len(positions) == len(need_transcription_files_batch):
+                                        prepared = (wav_files, max_wav_samples, features, windows)
+                                    else:
+                                        prepared = prepare_batch([need_transcription_files_batch[p] for p in positions])
+                                    return prepared, run_phoneme_model(prepared[2].input_values, prepared[2].attention_mask, prepared[3])
                                 
-                                del features, input_values, attention_mask, outputs, kana_logits_argmax, phoneme_logits_argmax, kanas, phonemes
-                                del wav_files, wav_files_padded
+                                for positions, ((sub_wav_files, sub_max_wav_samples, _, _), outputs) in memory_backoff.run(run_sub_batch, list(range(len(need_transcription_files_batch)))):
+                                    postprocess_futures.append(postprocess_executor.submit(postprocess_batch, [need_transcription_files_batch[p] for p in positions], [batch_index[p] for p in positions], sub_wav_files, sub_max_wav_samples, outputs))
+                                    # bound the number of batches waiting for post-processing
+                                    while len(postprocess_futures) > max(1, args.transcription_prefetch):
+                                        postprocess_futures.popleft().result()
+                                
+                                del features, outputs, wav_files
                                 if device.type == "cuda":
                                     torch.cuda.empty_cache()
+                            while len(postprocess_futures) > 0:
+                                postprocess_futures.popleft().result()
+                
+                if stage_cache is not None:
+                    for f, transcribed_text in zip(need_transcription_files, transcribed_texts):
+                        value = {k: transcribed_text[k] for k in ["text", "phoneme"] if k in transcribed_text}
+                        if args.g2p_alignment_type.endswith('ctc') and f in phonemeses:
+                            value["aligned"] = phonemeses[f]
+                        elif cascade and f in ctc_aligned:
+                            value["aligned"], value["confidence"] = ctc_aligned[f]
+                        stage_cache.put("transcription", get_transcription_key(f, wav_durations[f] > WHISPER_WINDOW_SEC), value)
+                    for f, value in cached_transcriptions.items():
+                        if cascade and "confidence" in value:
+                            ctc_aligned[f] = (value["aligned"], value["confidence"])
+                        elif "aligned" in value:
+                            phonemeses[f] = value["aligned"]
+                            with open(os.path.splitext(f)[0] + '.phonemes_aligned.txt', 'w') as fp:
+                                fp.write(value["aligned"])
+                    transcribed_texts = dict(zip(need_transcription_files, transcribed_texts))
+                    transcribed_texts = [transcribed_texts[f] if f in transcribed_texts else cached_transcriptions[f] for f in all_need_transcription_files]
+                    need_transcription_files = all_need_transcription_files
                 
                 # save transcripted texts
                 for i in range(len(need_transcription_files)):
                     text_file = os.path.splitext(need_transcription_files[i])[0] + '.txt'
                     if not os.path.exists(text_file):
                         all_texts[need_transcription_files[i]] = transcribed_texts[i]["text"]
-                        with open(text_file, 'w') as f:
-                            f.write(transcribed_texts[i]["text"])
+                        write_output(text_file, transcribed_texts[i]["text"], need_transcription_files[i])
                     if args.transcription_phoneme_model != 'False':
                         if need_transcription_files[i] in already_phonemization_files:
                             continue
                         phoneme_file = os.path.splitext(need_transcription_files[i])[0] + '.phonemes.txt'
                         if not args.g2p_alignment_type.endswith('ctc'):
                             phonemeses[need_transcription_files[i]] = transcribed_texts[i]["phoneme"]
-                        with open(phoneme_file, 'w') as f:
-                            f.write(transcribed_texts[i]["phoneme"])
+                        write_output(phoneme_file, transcribed_texts[i]["phoneme"], need_transcription_files[i])
+                if cascade and len(ctc_aligned) > 0:
+                    # thresholds are applied here, so cached alignments follow changed thresholds
+                    fallback_route = 'SOFA' if args.g2p_alignment_type.endswith('SOFA') else 'domino'
+                    routes = []
+                    for f, (phonemes_htk, stats) in ctc_aligned.items():
+                        accepted = confidence_passes(stats, args.cascade_min_mean_score, args.cascade_min_p10_score, args.cascade_max_low_ratio)
+                        if accepted:
+                            cascade_accepted[f] = phonemes_htk
+                        routes.append({"file": f, "route": 'ctc' if accepted else fallback_route, **stats})
+                    append_routes(cascade_report, routes)
+                    print(f"CTC alignment used for {len(cascade_accepted)} of {len(ctc_aligned)} files, the others are aligned by {fallback_route}")
                 # read existing text files
                 for t in already_transcription_files:
                     with open(os.path.splitext(t)[0] + '.txt', 'r') as f:
@@ -481,8 +860,9 @@ def make_lab_files(args, root_path):
                 if args.g2p_alignment_type.endswith('SOFA'):
                     # g2p
                     # phonemeses = {k: g2p(text) for k, text in tqdm(all_texts.items(), desc='g2p')}
-                    should_be_phonemized = [k for k in all_texts.keys() if k not in phonemeses.keys()]
-                    added_phonemeses = {k: g2p(text, args.transcription_language) for k, text in tqdm([all_texts[k] for k in should_be_phonemized], desc='g2p')}
+                    # files with an accepted CTC alignment are not aligned by SOFA
+                    should_be_phonemized = [k for k in all_texts.keys() if k not in phonemeses.keys() and k not in cascade_accepted]
+                    added_phonemeses = dict(zip(should_be_phonemized, g2p_cached([all_texts[k] for k in should_be_phonemized])))
                     phonemeses.update(added_phonemeses)
                     
                     empty_phoneme_keys = []
@@ -505,7 +885,7 @@ def make_lab_files(args, root_path):
                             ("?", "？"),
                             ("...", "…"),
                         ]
-                        texts = {k: text for k, text in all_texts.items()}
+                        texts = {k: text for k, text in all_texts.items() if k not in cascade_accepted}
                         for half, full in replace_list:
                             texts = {k: text.replace(half, full) for k, text in texts.items()}
                         # make punctuations list
@@ -513,12 +893,8 @@ def make_lab_files(args, root_path):
                         # vowel_re = re.compile(r"([aiueo])\1{1,}")
                         vowel_list = ["a", "i", "u", "e", "o", 'N', "cl"]
                         extracted_punctuations = []
-                        # count pause and punctuation(s, the number of pauses should be equal to the number of punctuation. repeated punctuation will be merged to one)
-                        for i, (k, text) in tqdm(enumerate(texts.items()), desc='g2p and alignment', total=len(texts)):
-                            extracted_punctuations.append([])
-                            if punctuations_re.search(text):
-                                extracted_punctuations[i] = punctuations_re.findall(text)
-                                
+                        
+                        def split_by_punctuations(text):
                             split_by_punctuation = punctuations_re.split(text)
                             start_with_punctuation = False
                             if split_by_punctuation[0] == '' and len(split_by_punctuation) > 1:
@@ -529,8 +905,21 @@ def make_lab_files(args, root_path):
                             end_with_punctuation = split_by_punctuation[-1] == '' and len(split_by_punctuation) > 1
                             if end_with_punctuation:
                                 split_by_punctuation.pop(-1)
-                            # g2p split by punctuation
-                            phonemeses_list = [g2p(split_text, sandwich_pau=False, no_join=True) for split_text in split_by_punctuation]
+                            return split_by_punctuation, start_with_punctuation, end_with_punctuation
+                        
+                        # g2p of the split texts of all files at once
+                        split_texts = {k: split_by_punctuations(text) for k, text in texts.items()}
+                        unique_split_texts = list(dict.fromkeys(t for split_by_punctuation, _, _ in split_texts.values() for t in split_by_punctuation))
+                        split_phonemes = dict(zip(unique_split_texts, g2p_cached(unique_split_texts, sandwich_pau=False, no_join=True)))
+                        # count pause and punctuation(s, the number of pauses should be equal to the number of punctuation. repeated punctuation will be merged to one)
+                        for i, (k, text) in tqdm(enumerate(texts.items()), desc='g2p and alignment', total=len(texts)):
+                            extracted_punctuations.append([])
+                            if punctuations_re.search(text):
+                                extracted_punctuations[i] = punctuations_re.findall(text)
+                                
+                            split_by_punctuation, start_with_punctuation, end_with_punctuation = split_texts[k]
+                            # g2p split by punctuation, copied as the lists are edited below
+                            phonemeses_list = [list(split_phonemes[split_text]) for split_text in split_by_punctuation]
                             # remove duplicated vowels
                             for j, ps in enumerate(phonemeses_list):
                                 offset = 0
@@ -569,11 +958,10 @@ def make_lab_files(args, root_path):
                             phonemes_joined = ' pau '.join([aligner_pre_cleanup(' '.join(phoneme)) for phoneme in phonemeses_list])
                                                         
                             # save phonemes
-                            with open(os.path.splitext(k)[0] + '.phonemes.txt', 'w') as f:
-                                f.write(phonemes_joined)
+                            write_output(os.path.splitext(k)[0] + '.phonemes.txt', phonemes_joined, k)
                                 
                             # align
-                            phonemes_timestamped, g2p_model = aligner(phonemes_joined, k, g2p_model, model_path=args.g2p_model_path)
+                            phonemes_timestamped = align_cached(phonemes_joined, k)
                             # phonemes_timestamped: list of phonemes with timestamps split by '\n'
                             # <start>\t<end>\t<phoneme>\n
                             # ...
@@ -636,22 +1024,23 @@ def make_lab_files(args, root_path):
                         # phonemeses = [g2p(transcribed_text["text"]) for transcribed_text in tqdm(transcribed_texts, desc='g2p')]
                         # phonemeses = {k: g2p(text) for k, text in tqdm(all_texts.items(), desc='g2p')}
                         should_be_phonemized = [k for k in all_texts.keys() if k not in phonemeses.keys()]
-                        added_phonemeses = {k: g2p(text) for (k, text) in tqdm([(j, all_texts[j]) for j in should_be_phonemized], desc='g2p')}
+                        added_phonemeses = dict(zip(should_be_phonemized, g2p_cached([all_texts[j] for j in should_be_phonemized])))
                         phonemeses.update(added_phonemeses)
                         # phonemeses = [g2p(transcribed_text["text"]) for transcribed_text in tqdm(transcribed_texts, desc='g2p')]
                         # save phonemes
                         for k, p in added_phonemeses.items():
-                            with open(os.path.splitext(k)[0] + '.phonemes.txt', 'w') as f:
-                                f.write(p)
+                            write_output(os.path.splitext(k)[0] + '.phonemes.txt', p, k)
                         # align
                         empty_phoneme_keys = []
                         for k, p in tqdm(phonemeses.items(), desc='align'):
+                            if k in cascade_accepted:
+                                continue
                             if p == 'pau  pau' or p == '':
                                 # no phonemes, skip
                                 empty_phoneme_keys.append(k)
                                 # p = 'pau'
                                 continue
-                            phonemes, g2p_model = aligner(p, k, g2p_model, model_path=args.g2p_model_path)
+                            phonemes = align_cached(p, k)
                             phonemeses[k] = phonemes
                         # remove empty phonemes
                         for k in empty_phoneme_keys:
@@ -661,81 +1050,120 @@ def make_lab_files(args, root_path):
                 # save aligned phonemes
                 # for i in range(len(need_alignment_files)):
                 for k, text in all_texts.items():
+                    if k in cascade_accepted:
+                        write_output(os.path.splitext(k)[0] + '.lab', cascade_accepted[k], k)
+                        continue
                     if k not in phonemeses:
                         continue
-                    with open(os.path.splitext(k)[0] + '.lab', 'w') as f:
-                        f.write(phonemeses[k])
+                    write_output(os.path.splitext(k)[0] + '.lab', phonemeses[k], k)
+                    if args.g2p_alignment_type == 'openjtalk+SOFA':
+                        sofa_pending[k] = phonemeses[k]
                 # with open(os.path.splitext(file_path)[0] + '.lab', 'w') as f:
                 #     f.write(phonemes)
-            if wav_exists == True and args.g2p_alignment_type == 'openjtalk+SOFA':
-                # align phonemes by SOFA
-                cmd = f"python {sofa_infer_script} --ckpt {args.sofa_model_path} --folder {root} --dictionary {args.sofa_dict_path} --out_formats htk"
-                os.system(cmd)
-                # copy alined phonemes to lab file
-                for file in os.listdir(os.path.join(root, 'htk', 'phones')):
-                    if file.endswith('.lab'):
-                        # os.rename(os.path.join(root, file), os.path.join(root, os.path.splitext(file)[0] + '.lab'))
-                        shutil.copy(os.path.join(root, 'htk', 'phones', file), os.path.join(root, os.path.splitext(file)[0] + '.lab'))
                                 
-    for folder_name in os.listdir(root_path):
-        folder_path = os.path.join(root_path, folder_name)
-        print(f"Processing folder: {folder_path}")
-        if os.path.isdir(folder_path):
-            make_lab_into_dir(folder_path)
+    if work_units is not None:
+        make_lab_into_dir(root_path, work_units=work_units)
+        align_sofa_pending()
+        return
+    
+    try:
+        for folder_name in os.listdir(root_path):
+            folder_path = os.path.join(root_path, folder_name)
+            print(f"Processing folder: {folder_path}")
+            if os.path.isdir(folder_path):
+                make_lab_into_dir(folder_path)
+        # align phonemes of all folders by SOFA
+        align_sofa_pending()
+    finally:
+        if args.g2p_alignment_type.startswith('openjtalk'):
+            # the g2p processes were shared by all folders, leaked ones keep the interpreter alive on Windows
+            shutdown_g2p_pool()
+    # labels of the slices back to the long recordings
+    merge_sliced_recordings(root_path)
+    if cascade:
+        summarize_routes(args.cascade_report)
+
+
+def remove_full_rest_rows(folder_path):
+    # load transcriptions.csv
+    csv_path = os.path.join(folder_path, "transcriptions.csv")
+    if os.path.exists(csv_path):
+        # read with csv
+        with open(csv_path, 'r') as f:
+            reader = csv.reader(f)
+            rows = list(reader)
+        full_rest_files = [row[0] for row in rows[1:] if all(col == "rest" for col in row[4].split(" "))]
+        if len(full_rest_files) > 0:
+            print(f"Removing full rest files from list: {full_rest_files}")
+            # remove row with full of rest notes
+            rows = [rows[0]] + [row for row in rows[1:] if any(col != "rest" for col in row[4].split(" "))]
+            # write to csv
+            with open(csv_path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerows(rows)
+
+
+def reorganize_db_files(folder_path):
+    # Cleanup and reorganize files
+    # for file in os.listdir(folder_path):
+    for root, _, files in os.walk(folder_path):
+        if root.endswith("wavs"):
+            continue
+        for file in files:
+            if file.endswith(('.wav', '.lab')):
+                os.remove(os.path.join(root, file))
+        # if file.endswith(('.wav', '.lab')):
+        #     os.remove(os.path.join(folder_path, file))
+    
+    diffsinger_db_path = os.path.join(folder_path, "diffsinger_db")
+    if os.path.exists(diffsinger_db_path):
+        for item in os.listdir(diffsinger_db_path):
+            src = os.path.join(diffsinger_db_path, item)
+            dst = os.path.join(folder_path, item)
+            # if os.path.isfile(src):
+            shutil.move(src, dst)
+        shutil.rmtree(diffsinger_db_path)
+
+
+def remove_ds_files(folder_path):
+    for file in os.listdir(folder_path):
+        if file.endswith('.ds'):
+            os.remove(os.path.join(folder_path, file))
 
 
 def process_data(args, all_shits, all_shits_not_wav_n_lab):
+    from job_scheduler import run_jobs
+    # per-folder steps run in order, folders run concurrently
+    jobs = []
     if args.data_type == "lab_wav":
         db_converter_script = "./nnsvs-db-converter/db_converter.py"
+        some_folders = []
         for folder_name in os.listdir(all_shits_not_wav_n_lab):
             folder_path = os.path.join(all_shits_not_wav_n_lab, folder_name)
             if os.path.isdir(folder_path):
                 # Convert to DS format
-                cmd = f"python {db_converter_script} -s {args.max_silence_phoneme} -l {args.segment_length} -D"
+                cmd = [sys.executable, db_converter_script, "-s", str(args.max_silence_phoneme), "-l", str(args.segment_length), "-D"]
                 if args.estimate_midi != "False":
-                    cmd += " -m -c"
-                cmd += f' -L "./nnsvs-db-converter/lang.sample.json" {folder_path}'
-                os.system(cmd)
-                
-                # load transcriptions.csv
-                csv_path = os.path.join(folder_path, "transcriptions.csv")
-                if os.path.exists(csv_path):
-                    # read with csv
-                    with open(csv_path, 'r') as f:
-                        reader = csv.reader(f)
-                        rows = list(reader)
-                    full_rest_files = [row[0] for row in rows[1:] if all(col == "rest" for col in row[4].split(" "))]
-                    if len(full_rest_files) > 0:
-                        print(f"Removing full rest files from list: {full_rest_files}")
-                        # remove row with full of rest notes
-                        rows = [rows[0]] + [row for row in rows[1:] if any(col != "rest" for col in row[4].split(" "))]
-                        # write to csv
-                        with open(csv_path, 'w', newline='') as f:
-                            writer = csv.writer(f)
-                            writer.writerows(rows)
-                
-                # Cleanup and reorganize files
-                # for file in os.listdir(folder_path):
-                for root, _, files in os.walk(folder_path):
-                    if root.endswith("wavs"):
-                        continue
-                    for file in files:
-                        if file.endswith(('.wav', '.lab')):
-                            os.remove(os.path.join(root, file))
-                    # if file.endswith(('.wav', '.lab')):
-                    #     os.remove(os.path.join(folder_path, file))
-                
-                diffsinger_db_path = os.path.join(folder_path, "diffsinger_db")
-                if os.path.exists(diffsinger_db_path):
-                    for item in os.listdir(diffsinger_db_path):
-                        src = os.path.join(diffsinger_db_path, item)
-                        dst = os.path.join(folder_path, item)
-                        # if os.path.isfile(src):
-                        shutil.move(src, dst)
-                    shutil.rmtree(diffsinger_db_path)
+                    cmd += ["-m", "-c"]
+                cmd += ["-L", "./nnsvs-db-converter/lang.sample.json", folder_path]
+                jobs.append((folder_name, [
+                    cmd,
+                    functools.partial(remove_full_rest_rows, folder_path),
+                    functools.partial(reorganize_db_files, folder_path),
+                ]))
                 
                 if args.estimate_midi == "SOME":
-                    os.system(f'python ./SOME/batch_infer.py --model "./DiffSinger/checkpoints/SOME/0119_continuous256_5spk/model_ckpt_steps_100000_simplified.ckpt" --dataset {folder_path} --overwrite')
+                    some_folders.append(folder_path)
+        run_jobs(jobs, max_workers=args.process_workers)
+        
+        if args.estimate_midi == "SOME" and len(some_folders) > 0:
+            # estimate MIDI of all folders at once, SOME is loaded once
+            from estimate_midi_some import estimate_midi
+            stage_cache = None
+            if args.stage_cache_dir != 'False':
+                from stage_cache import StageCache
+                stage_cache = StageCache(args.stage_cache_dir)
+            estimate_midi(some_folders, model_path=args.some_model_path, stage_cache=stage_cache, batch_size=args.some_batch_size)
     
     elif args.data_type == "ds":
         for folder_name in os.listdir(all_shits_not_wav_n_lab):
@@ -743,11 +1171,12 @@ def process_data(args, all_shits, all_shits_not_wav_n_lab):
             if os.path.isdir(folder_path):
                 ds_exp_path = os.path.join(folder_path, "ds")
                 csv_exp_path = os.path.join(folder_path, "transcriptions.csv")
-                os.system(f"python ./ghin_shenanigans/scripts/ds_segmentor.py {folder_path} --export_path {ds_exp_path}")
-                for file in os.listdir(folder_path):
-                    if file.endswith('.ds'):
-                        os.remove(os.path.join(folder_path, file))
-                os.system(f"python ./MakeDiffSinger/variance-temp-solution/convert_ds.py ds2csv {ds_exp_path} {csv_exp_path}")
+                jobs.append((folder_name, [
+                    [sys.executable, "./ghin_shenanigans/scripts/ds_segmentor.py", folder_path, "--export_path", ds_exp_path],
+                    functools.partial(remove_ds_files, folder_path),
+                    [sys.executable, "./MakeDiffSinger/variance-temp-solution/convert_ds.py", "ds2csv", ds_exp_path, csv_exp_path],
+                ]))
+        run_jobs(jobs, max_workers=args.process_workers)
                 
 def fix_initial_sp(folder_path):
     for root, _, files in os.walk(folder_path):
@@ -773,19 +1202,27 @@ def main():
         all_shits, all_shits_not_wav_n_lab = setup_directories()
     
     # Extract archive
-    extract_archive(args.data_zip_path, all_shits_not_wav_n_lab)
+    on_audio = None
+    if args.transcription_model != 'False' or args.transcription_phoneme_model != 'False':
+        # decode audio for the transcription while the archive is being extracted
+        from audio_store import configure_audio_store
+        audio_store = configure_audio_store(args.audio_cache_dir, max_bytes=int(args.audio_cache_size_gb * 1024 ** 3))
+        on_audio = lambda wav_path: audio_store.load(wav_path, sr=16_000)
+    extract_archives(args.data_zip_path, all_shits_not_wav_n_lab, ingest=args.archive_ingest, workers=args.ingest_workers, on_audio=on_audio)
     
     # Make lab files
     make_lab_files(args, all_shits_not_wav_n_lab)
     
     if args.data_type != "lab_wav":
-        process_lab_files(all_shits)
+        process_lab_files(all_shits, workers=args.scan_workers)
     
     # Generate phoneme dictionary and related files
-    phonemes = collect_phonemes(args.data_type, all_shits if args.data_type == "lab_wav" else all_shits_not_wav_n_lab)
+    # (for lab_wav the labels are read once, in the same pass as their counts)
+    phoneme_counts = count_phonemes(args.data_type, all_shits if args.data_type == "lab_wav" else all_shits_not_wav_n_lab, workers=args.scan_workers)
+    phonemes = sorted(phoneme_counts)
     
     # TODO: support merge same language files
-    vowels, liquids, consonants = generate_phoneme_files(phonemes, "./DiffSinger/dictionaries/custom_dict.txt")
+    vowels, liquids, consonants = generate_phoneme_files(phonemes, "./DiffSinger/dictionaries/custom_dict.txt", counts=phoneme_counts)
     
     # Generate language JSON
     liquid_list = {liquid: True for liquid in liquids}
@@ -3,6 +3,76 @@ import os
 import glob
 import argparse
 import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from stage_cache import StageCache
+
+# Remove any non-English or non-Japanese characters
+# \u2026: horizontal ellipsis
+_CLEAN_RE = re.compile(r'[^\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff01-\uff5e\u2026\w\s]+')
+
+# cleaned text and options -> phonemes, shared by the calls in this process
+_G2P_MEMO = {}
+
+# g2p processes, started on the first large batch and reused for the rest of the run
+_G2P_POOL = None
+_G2P_POOL_WORKERS = 0
+_G2P_POOL_LOCK = threading.Lock()
+# smaller batches are converted in this process, starting pyopenjtalk in the workers costs more
+G2P_POOL_MIN_TEXTS = 64
+
+
+def clean_text(text):
+    """
+    Returns the text given to pyopenjtalk: only English and Japanese characters, with "～" replaced by "ー".
+    """
+    # text = re.sub(r'[^\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff01-\uff5e]+', '', text)
+    return _CLEAN_RE.sub('', text).replace("～", "ー")
+
+
+def _g2p_cleaned(text_cleaned, dictionary_path=None, sandwich_pau=True, no_join=False):
+    args = {
+        "kana": False,
+    }
+    if dictionary_path:
+        args["dialect"] = dictionary_path
+    if no_join:
+        args["join"] = False
+
+    # Convert to phonemes using pyopenjtalk
+    phonemes = pyopenjtalk.g2p(text_cleaned, **args)
+        
+    # Add a pause at the start and end of the phoneme sequence
+    if sandwich_pau:
+        if isinstance(phonemes, str):
+            phonemes = f"pau {phonemes} pau"
+        else:
+            phonemes = ["pau"] + phonemes + ["pau"]
+    return phonemes
+
+
+def _g2p_key(text_cleaned, options, kana_trie=None):
+    return StageCache.key("g2p", text=text_cleaned, pyopenjtalk=getattr(pyopenjtalk, "__version__", None), kana=kana_trie.digest if kana_trie is not None else None, **options)
+
+
+def _format_phonemes(phonemes, sandwich_pau=True, no_join=False):
+    # same form as the output of `_g2p_cleaned`
+    if no_join:
+        return ["pau"] + phonemes + ["pau"] if sandwich_pau else phonemes
+    phonemes = " ".join(phonemes)
+    return f"pau {phonemes} pau" if sandwich_pau else phonemes
+
+
+def _g2p_cleaned_safe(job):
+    text_cleaned, options = job
+    try:
+        return _g2p_cleaned(text_cleaned, **options)
+    except Exception as e:
+        print(f"An unexpected error occurred processing {text_cleaned}: {e}")
+        return None
+
 
 def g2p_openjtalk(text, dictionary_path=None, sandwich_pau=True, no_join=False, return_cleaned_text=False):
     """
@@ -18,34 +88,12 @@ def g2p_openjtalk(text, dictionary_path=None, sandwich_pau=True, no_join=False,
     """
     
     try:
-        # Remove any non-Japanese characters (optional, but good for cleaning)
-        # text = re.sub(r'[^\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff01-\uff5e]+', '', text)
-        # Remove any non-English or non-Japanese characters (optional, but good for cleaning)
-        text_cleaned = re.sub(r'[^\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff01-\uff5e\u2026\w\s]+', '', text)
+        text_cleaned = clean_text(text)
         if not text_cleaned:
             print(f"WARNING: text '{text}' is empty because it contains no English or Japanese text after cleaning.")
             return ""
         
-        # Replace "～" with "ー"
-        text_cleaned = text_cleaned.replace("～", "ー")
-        
-        args = {
-            "kana": False,
-        }
-        if dictionary_path:
-            args["dialect"] = dictionary_path
-        if no_join:
-            args["join"] = False
-
-        # Convert to phonemes using pyopenjtalk
-        phonemes = pyopenjtalk.g2p(text_cleaned, **args)
-            
-        # Add a pause at the start and end of the phoneme sequence
-        if sandwich_pau:
-            if isinstance(phonemes, str):
-                phonemes = f"pau {phonemes} pau"
-            else:
-                phonemes = ["pau"] + phonemes + ["pau"]
+        phonemes = _g2p_cleaned(text_cleaned, dictionary_path=dictionary_path, sandwich_pau=sandwich_pau, no_join=no_join)
             
         if return_cleaned_text:
             return phonemes, text_cleaned
@@ -56,7 +104,120 @@ def g2p_openjtalk(text, dictionary_path=None, sandwich_pau=True, no_join=False,
         print(f"An unexpected error occurred processing {text}: {e}")
     
 
-def text_to_phonemes_openjtalk(input_dir, output_dir, dictionary_path=None, sandwich_pau=True, no_join=False, return_cleaned_text=False):
+def _g2p_pool(workers):
+    global _G2P_POOL, _G2P_POOL_WORKERS
+    with _G2P_POOL_LOCK:
+        if _G2P_POOL is None or _G2P_POOL_WORKERS != workers:
+            if _G2P_POOL is not None:
+                _G2P_POOL.shutdown(wait=True)
+            _G2P_POOL = ProcessPoolExecutor(max_workers=workers)
+            _G2P_POOL_WORKERS = workers
+        return _G2P_POOL
+
+
+def shutdown_g2p_pool():
+    """
+    Stops the g2p processes started by `g2p_batch`, if any.
+    """
+    global _G2P_POOL
+    with _G2P_POOL_LOCK:
+        if _G2P_POOL is not None:
+            _G2P_POOL.shutdown(wait=True)
+            _G2P_POOL = None
+
+
+def _g2p_openjtalk_batch(texts_cleaned, options, workers=1):
+    jobs = [(text_cleaned, options) for text_cleaned in texts_cleaned]
+    if workers > 1 and len(jobs) >= max(G2P_POOL_MIN_TEXTS, workers):
+        try:
+            return list(_g2p_pool(workers).map(_g2p_cleaned_safe, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+        except BrokenProcessPool:
+            # a worker died, convert in this process and start a new pool next time
+            print("g2p worker processes stopped unexpectedly, converting in this process")
+            shutdown_g2p_pool()
+    return [_g2p_cleaned_safe(job) for job in jobs]
+
+
+def g2p_batch(texts, dictionary_path=None, sandwich_pau=True, no_join=False, cache_dir=None, workers=1, kana_trie=None):
+    """
+    Converts many texts at once, same as calling `g2p_openjtalk` for each of them.
+
+    Texts are memoized by their cleaned text, the dictionary and the options, in this
+    process and, with `cache_dir`, on disk, so repeated lyrics and reruns are converted
+    only once. The texts not found are converted on a process pool when `workers` > 1
+    and there are at least `G2P_POOL_MIN_TEXTS` of them; the pool is kept for later calls.
+    With `kana_trie`, texts written only in kana are converted by the dictionary trie.
+    Texts with kanji or other characters go to pyopenjtalk as a whole, since it reads
+    okurigana and particles from the context.
+
+    Args:
+        texts: List of texts.
+        dictionary_path: Optional path to a custom Open JTalk dictionary.
+        sandwich_pau: Add "pau" at the start and the end.
+        no_join: Return lists of phonemes instead of strings.
+        cache_dir: Directory of the on-disk cache (None: memoize in this process only).
+        workers: Number of processes converting the texts not found in the cache.
+        kana_trie: Optional `kana_g2p.KanaTrie` for texts written only in kana.
+
+    Returns:
+        A list of phonemes in the order of `texts` (None where the conversion failed).
+    """
+    options = {"dictionary_path": dictionary_path, "sandwich_pau": sandwich_pau, "no_join": no_join}
+    stage_cache = StageCache(cache_dir) if cache_dir is not None else None
+    if kana_trie is not None:
+        from kana_g2p import is_kana_text
+
+    cleaned_texts = [clean_text(text) for text in texts]
+    keys = {}
+    for text, text_cleaned in zip(texts, cleaned_texts):
+        if not text_cleaned:
+            print(f"WARNING: text '{text}' is empty because it contains no English or Japanese text after cleaning.")
+            continue
+        if text_cleaned not in keys:
+            use_trie = kana_trie is not None and is_kana_text(text_cleaned)
+            keys[text_cleaned] = _g2p_key(text_cleaned, options, kana_trie=kana_trie if use_trie else None)
+
+    misses = []
+    for text_cleaned, key in keys.items():
+        if key in _G2P_MEMO:
+            continue
+        phonemes = stage_cache.get("g2p", key) if stage_cache is not None else None
+        if phonemes is None:
+            misses.append(text_cleaned)
+        else:
+            _G2P_MEMO[key] = phonemes
+
+    if len(misses) > 0:
+        kana_misses = [text_cleaned for text_cleaned in misses if kana_trie is not None and is_kana_text(text_cleaned)]
+        other_misses = [text_cleaned for text_cleaned in misses if kana_trie is None or not is_kana_text(text_cleaned)]
+        results = {}
+        if len(kana_misses) > 0:
+            # kana the dictionary does not have (e.g. small ゎ) still goes to pyopenjtalk
+            span_options = {"dictionary_path": dictionary_path, "sandwich_pau": False, "no_join": True}
+            converted = kana_trie.convert_batch(kana_misses, fallback=lambda spans: _g2p_openjtalk_batch(spans, span_options, workers=workers))
+            for text_cleaned, phonemes in zip(kana_misses, converted):
+                results[text_cleaned] = None if phonemes is None else _format_phonemes(phonemes, sandwich_pau=sandwich_pau, no_join=no_join)
+        if len(other_misses) > 0:
+            results.update(zip(other_misses, _g2p_openjtalk_batch(other_misses, options, workers=workers)))
+        for text_cleaned, phonemes in results.items():
+            if phonemes is None:
+                continue
+            _G2P_MEMO[keys[text_cleaned]] = phonemes
+            if stage_cache is not None:
+                stage_cache.put("g2p", keys[text_cleaned], phonemes)
+
+    results = []
+    for text_cleaned in cleaned_texts:
+        if not text_cleaned:
+            results.append("")
+            continue
+        phonemes = _G2P_MEMO.get(keys[text_cleaned])
+        # callers may edit the lists
+        results.append(list(phonemes) if isinstance(phonemes, list) else phonemes)
+    return results
+
+
+def text_to_phonemes_openjtalk(input_dir, output_dir, dictionary_path=None, sandwich_pau=True, no_join=False, return_cleaned_text=False, cache_dir=None, workers=1, kana_trie=None):
     """
     Converts Japanese text files in a directory to phoneme sequences using pyopenjtalk.
 
@@ -65,6 +226,9 @@ def text_to_phonemes_openjtalk(input_dir, output_dir, dictionary_path=None, sand
         output_dir: The directory to save the phoneme files (.lab).
         dictionary_path: Optional path to a custom Open JTalk dictionary.
                           If None, the default dictionary is used.
+        cache_dir: Directory of the g2p cache (None: no cache), see `g2p_batch`.
+        workers: Number of g2p processes.
+        kana_trie: Optional `kana_g2p.KanaTrie` converting kana without pyopenjtalk.
     """
 
     if not os.path.exists(input_dir):
@@ -82,48 +246,29 @@ def text_to_phonemes_openjtalk(input_dir, output_dir, dictionary_path=None, sand
         print(f"No .txt files found in {input_dir}")
         return
 
-    file_count = 0
+    texts = {}
     for text_file in text_files:
         try:
             with open(text_file, 'r', encoding='utf-8') as infile:
                 text = infile.read()
-
-            # Remove any non-Japanese characters (optional, but good for cleaning)
-            # text = re.sub(r'[^\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff01-\uff5e]+', '', text)
-            # Remove any non-English or non-Japanese characters (optional, but good for cleaning)
-            # text = re.sub(r'[^\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff01-\uff5e\w\s]+', '', text)
-            # \u2026: horizontal ellipsis
-            text_cleaned = re.sub(r'[^\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff01-\uff5e\u2026\w\s]+', '', text)
             if not text:
                 print(f"Skipping file {text_file} because it contains no Japanese text after cleaning.")
                 continue
-            
-            # Replace "～" with "ー"
-            text_cleaned = text_cleaned.replace("～", "ー")
-            
-            args = {
-                "kana": False,
-            }
-            if dictionary_path:
-                args["dialect"] = dictionary_path
-            if no_join:
-                args["join"] = False
-
-            # Convert to phonemes using pyopenjtalk
-            # if dictionary_path:
-            #     phonemes = pyopenjtalk.g2p(text_cleaned, kana=False, dialect=dictionary_path)
-            # else:
-            #     phonemes = pyopenjtalk.g2p(text_cleaned, kana=False)
-            phonemes = pyopenjtalk.g2p(text_cleaned, **args)
-                
-            # Add a pause at the start and end of the phoneme sequence
-            if sandwich_pau:
-                # phonemes = f"pau {phonemes} pau"
-                if isinstance(phonemes, str):
-                    phonemes = f"pau {phonemes} pau"
-                else:
-                    phonemes = ["pau"] + phonemes + ["pau"]
-                    phonemes = "|".join(phonemes)
+            texts[text_file] = text
+        except FileNotFoundError:
+            print(f"Error: Text file not found: {text_file}")
+        except UnicodeDecodeError:
+            print(f"Error: Could not decode text in file: {text_file}.  Check file encoding (should be UTF-8).")
+
+    phonemes_list = g2p_batch(list(texts.values()), dictionary_path=dictionary_path, sandwich_pau=sandwich_pau, no_join=no_join, cache_dir=cache_dir, workers=workers, kana_trie=kana_trie)
+
+    file_count = 0
+    for (text_file, text), phonemes in zip(texts.items(), phonemes_list):
+        if phonemes is None:
+            continue
+        try:
+            if sandwich_pau and not isinstance(phonemes, str):
+                phonemes = "|".join(phonemes)
 
             # Get the base filename (without extension)
             base_filename = os.path.splitext(os.path.basename(text_file))[0]
@@ -131,7 +276,7 @@ def text_to_phonemes_openjtalk(input_dir, output_dir, dictionary_path=None, sand
 
             with open(output_filename, 'w', encoding='utf-8') as outfile:
                 if return_cleaned_text:
-                    outfile.write(f"{text_cleaned}\n")
+                    outfile.write(f"{clean_text(text)}\n")
                     outfile.write(phonemes)
                 else:
                     outfile.write(phonemes)
@@ -139,10 +284,6 @@ def text_to_phonemes_openjtalk(input_dir, output_dir, dictionary_path=None, sand
             file_count += 1
             print(f"Converted {text_file} -> {output_filename}")
 
-        except FileNotFoundError:
-            print(f"Error: Text file not found: {text_file}")
-        except UnicodeDecodeError:
-            print(f"Error: Could not decode text in file: {text_file}.  Check file encoding (should be UTF-8).")
         except Exception as e:
             print(f"An unexpected error occurred processing {text_file}: {e}")
             
@@ -155,9 +296,17 @@ def main():
     parser.add_argument("-s", "--sandwich_pau", help="Add PAU (silence) at the beginning and end of each phoneme sequence.", action="store_true")
     parser.add_argument("-n", "--no_join", help="Don't join phonemes into a single string.", action="store_true")
     parser.add_argument("-c", "--return_cleaned_text", help="Return the cleaned text as well as the phonemes.", action="store_true")
+    parser.add_argument("--cache_dir", help="Directory to cache the phonemes of texts across runs.", default=None)
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of g2p processes.")
+    parser.add_argument("-k", "--kana_dict", help="Optional dictionary with kana entries (e.g. jpn_dict_stops.txt) to convert kana without pyopenjtalk.", default=None)
     args = parser.parse_args()
 
-    text_to_phonemes_openjtalk(args.input_dir, args.output_dir, args.dictionary, args.sandwich_pau, args.no_join, args.return_cleaned_text)
+    kana_trie = None
+    if args.kana_dict is not None:
+        from kana_g2p import KanaTrie
+        kana_trie = KanaTrie.from_files([args.kana_dict])
+
+    text_to_phonemes_openjtalk(args.input_dir, args.output_dir, args.dictionary, args.sandwich_pau, args.no_join, args.return_cleaned_text, cache_dir=args.cache_dir, workers=args.workers, kana_trie=kana_trie)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,81 @@
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class JobFailed(RuntimeError):
+    def __init__(self, name, step, returncode, output):
+        self.name = name
+        self.step = step
+        self.returncode = returncode
+        self.output = output
+        super().__init__(f"{name}: `{step}` failed with exit status {returncode}\n{output[-4000:]}")
+
+
+def _step_name(step):
+    if callable(step):
+        return getattr(step, "__name__", repr(step))
+    return subprocess.list2cmdline(step)
+
+
+def run_jobs(jobs, max_workers=4, verbose=True):
+    """
+    Runs chains of steps concurrently.
+
+    Each job is (name, steps). The steps of a job run in order, and different jobs
+    run in parallel on up to `max_workers` threads. A step is either a command (list of
+    arguments) run as a subprocess with its output captured, or a callable run in the
+    worker thread. The output of a command is printed as a whole when it finishes, so
+    the logs of parallel jobs are not interleaved.
+    When a command exits with a non-zero status (or a callable raises), the jobs which
+    have not started are cancelled and the error is raised after the running ones finish.
+
+    Args:
+        jobs: List of (name, steps).
+        max_workers: Maximum number of jobs running at once.
+        verbose: Print the output of the jobs.
+
+    Returns:
+        A dict of name -> list of (step, returncode, output) of the job.
+    """
+    print_lock = threading.Lock()
+    failed = threading.Event()
+
+    def run_job(name, steps):
+        results = []
+        for step in steps:
+            if failed.is_set():
+                break
+            if callable(step):
+                try:
+                    step()
+                except Exception:
+                    failed.set()
+                    raise
+                results.append((_step_name(step), 0, ""))
+                continue
+            proc = subprocess.run(step, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace")
+            results.append((_step_name(step), proc.returncode, proc.stdout))
+            if verbose:
+                with print_lock:
+                    print(f"[{name}] $ {_step_name(step)}\n{proc.stdout}", end="" if proc.stdout.endswith("\n") else "\n")
+            if proc.returncode != 0:
+                failed.set()
+                raise JobFailed(name, _step_name(step), proc.returncode, proc.stdout)
+        return results
+
+    all_results = {}
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(run_job, name, steps): name for name, steps in jobs}
+        for future in as_completed(futures):
+            try:
+                all_results[futures[future]] = future.result()
+            except Exception as e:
+                failed.set()
+                for f in futures:
+                    f.cancel()
+                errors.append(e)
+    if len(errors) > 0:
+        raise errors[0]
+    return all_results
@@ -0,0 +1,239 @@
+import os
+import argparse
+import hashlib
+
+
+# punctuations read as a pause inside a text, like pyopenjtalk
+PAUSE_CHARS = set("、。，．,.！？!?…・「」『』")
+VOWELS = set("aiueoAIUEON")
+
+
+def is_kana(c):
+    return "ぁ" <= c <= "ゟ" or "゠" <= c <= "ヿ"
+
+
+def is_kana_text(text):
+    """
+    True if the text has nothing but kana, pauses and spaces, such texts are converted by the trie.
+    """
+    return any(is_kana(c) for c in text) and all(is_kana(c) or c in PAUSE_CHARS or c in "ーｰ～" or c.isspace() for c in text)
+
+
+def katakana_to_hiragana(text):
+    # ァ(U+30A1)..ヶ(U+30F6) are ぁ(U+3041)..ゖ(U+3096) shifted by 0x60
+    return "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in text)
+
+
+def load_dictionary(dict_path):
+    """
+    Reads a `<word>\t<phonemes>` dictionary (jpn_dict_stops.txt, japanese-extension-sofa-added.txt).
+
+    Returns:
+        A dict of word -> list of phonemes.
+    """
+    entries = {}
+    with open(dict_path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\r\n").split("\t")
+            if len(parts) < 2 or parts[0].strip() == "":
+                continue
+            entries[parts[0].strip()] = parts[1].split()
+    return entries
+
+
+class KanaTrie:
+    """
+    Longest-match converter of kana to phonemes.
+
+    Kana runs are converted by the longest dictionary entry at each position, so that
+    きゃ is read as `ky a` rather than き + ゃ. "ー" repeats the previous vowel,
+    punctuations become `pau`, and spaces are ignored. Anything else (kanji, latin,
+    unknown kana) is left as a span for a fallback converter such as pyopenjtalk.
+
+    Args:
+        entries: Dict of kana -> list of phonemes.
+        fold_katakana: Read katakana as hiragana, as pyopenjtalk does.
+    """
+    def __init__(self, entries, fold_katakana=True):
+        self.fold_katakana = fold_katakana
+        self.root = {}
+        for word, phonemes in entries.items():
+            node = self.root
+            for c in word:
+                node = node.setdefault(c, {})
+            # None can not be a character of a word
+            node[None] = list(phonemes)
+        self.digest = hashlib.sha1(repr((sorted(entries.items()), fold_katakana)).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def from_files(cls, dict_paths, inventory_path=None, fold_katakana=True):
+        """
+        Builds the trie from the kana entries of dictionaries.
+
+        Args:
+            dict_paths: Dictionaries with kana entries (jpn_dict_stops.txt).
+            inventory_path: Optional dictionary of the phonemes the aligner knows
+                (japanese-extension-sofa-added.txt). Entries producing other phonemes
+                are dropped and left to the fallback.
+            fold_katakana: Read katakana as hiragana.
+        """
+        entries = {}
+        for dict_path in dict_paths:
+            for word, phonemes in load_dictionary(dict_path).items():
+                if all(is_kana(c) for c in word):
+                    entries[word] = phonemes
+        if fold_katakana:
+            # hiragana entries win over their katakana spelling, capital vowels of katakana entries are plain vowels
+            folded = {word: phonemes for word, phonemes in entries.items() if katakana_to_hiragana(word) == word}
+            for word, phonemes in entries.items():
+                folded.setdefault(katakana_to_hiragana(word), [p.lower() if p in "AIUEO" else p for p in phonemes])
+            entries = folded
+        if inventory_path is not None:
+            inventory = set()
+            for word, phonemes in load_dictionary(inventory_path).items():
+                inventory.add(word)
+                inventory.update(phonemes)
+            entries = {word: phonemes for word, phonemes in entries.items() if all(p in inventory for p in phonemes)}
+        return cls(entries, fold_katakana=fold_katakana)
+
+    def _longest_match(self, text, pos):
+        node = self.root
+        match = None
+        for i in range(pos, len(text)):
+            node = node.get(text[i])
+            if node is None:
+                break
+            if None in node:
+                match = (i + 1 - pos, node[None])
+        return match
+
+    def segment(self, text):
+        """
+        Splits a text into converted and unknown parts.
+
+        Returns:
+            A list of (phonemes, None) for converted parts and (None, span) for unknown spans.
+        """
+        if self.fold_katakana:
+            text = katakana_to_hiragana(text)
+        segments = []
+        unknown = []
+        phonemes = []
+
+        def flush():
+            if len(phonemes) > 0:
+                segments.append((list(phonemes), None))
+                phonemes.clear()
+            if len(unknown) > 0:
+                segments.append((None, "".join(unknown)))
+                unknown.clear()
+
+        pos = 0
+        while pos < len(text):
+            c = text[pos]
+            if c.isspace():
+                pos += 1
+                continue
+            if c in PAUSE_CHARS:
+                if len(unknown) > 0:
+                    flush()
+                if len(phonemes) > 0 and phonemes[-1] != "pau":
+                    phonemes.append("pau")
+                pos += 1
+                continue
+            if c in "ーｰ～" and len(unknown) == 0 and len(phonemes) > 0 and phonemes[-1] in VOWELS:
+                phonemes.append(phonemes[-1])
+                pos += 1
+                continue
+            match = self._longest_match(text, pos)
+            if match is None:
+                if len(phonemes) > 0:
+                    flush()
+                unknown.append(c)
+                pos += 1
+                continue
+            if len(unknown) > 0:
+                flush()
+            length, match_phonemes = match
+            phonemes.extend(match_phonemes)
+            pos += length
+        flush()
+        return segments
+
+    def convert_batch(self, texts, fallback=None):
+        """
+        Converts texts to phoneme lists.
+
+        Unknown spans of all texts are given to `fallback` at once, which returns a phoneme
+        list (or None on failure) for each of them. Identical texts are converted once.
+
+        Args:
+            texts: List of texts.
+            fallback: Function converting a list of spans (None: unknown spans are dropped).
+
+        Returns:
+            A list of phoneme lists without surrounding pauses, None where the fallback failed.
+        """
+        unique_texts = list(dict.fromkeys(texts))
+        segmented = {text: self.segment(text) for text in unique_texts}
+        spans = list(dict.fromkeys(span for segments in segmented.values() for _, span in segments if span is not None))
+        span_phonemes = dict(zip(spans, fallback(spans))) if fallback is not None and len(spans) > 0 else {}
+
+        converted = {}
+        for text, segments in segmented.items():
+            phonemes = []
+            for seg_phonemes, span in segments:
+                if span is not None:
+                    seg_phonemes = span_phonemes.get(span, []) if fallback is not None else []
+                    if seg_phonemes is None:
+                        phonemes = None
+                        break
+                phonemes.extend(seg_phonemes)
+            if phonemes is not None:
+                # pauses only inside the text
+                while len(phonemes) > 0 and phonemes[0] == "pau":
+                    phonemes.pop(0)
+                while len(phonemes) > 0 and phonemes[-1] == "pau":
+                    phonemes.pop()
+            converted[text] = phonemes
+        return [None if converted[text] is None else list(converted[text]) for text in texts]
+
+    def convert(self, text, fallback=None):
+        return self.convert_batch([text], fallback=fallback)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert kana text files to phonemes with the dictionary, other text files with pyopenjtalk.")
+    parser.add_argument("input_dir", help="Directory containing the text files.")
+    parser.add_argument("-d", "--dict_path", nargs='+', default=["jpn_dict_stops.txt"], help="Dictionaries with kana entries.")
+    parser.add_argument("-i", "--inventory_path", default=None, help="Dictionary of the phonemes of the aligner (e.g. japanese-extension-sofa-added.txt).")
+    parser.add_argument("-o", "--output_ext", default=".phonemes.txt", help="Extension of the output files.")
+    parser.add_argument("-k", "--keep_katakana", action="store_true", help="Use the katakana entries of the dictionary instead of reading katakana as hiragana.")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of pyopenjtalk processes for the fallback.")
+    args = parser.parse_args()
+
+    from g2p_openjtalk import g2p_batch
+
+    trie = KanaTrie.from_files(args.dict_path, inventory_path=args.inventory_path, fold_katakana=not args.keep_katakana)
+    text_files = sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(args.input_dir)
+        for file in files
+        if file.endswith(".txt") and not file.endswith(args.output_ext)
+    )
+    texts = []
+    for text_file in text_files:
+        with open(text_file, "r", encoding="utf-8") as f:
+            texts.append(f.read())
+    phonemes_list = g2p_batch(texts, kana_trie=trie, workers=args.workers)
+    for text_file, phonemes in zip(text_files, phonemes_list):
+        if phonemes is None:
+            print(f"Failed to convert {text_file}")
+            continue
+        with open(os.path.splitext(text_file)[0] + args.output_ext, "w", encoding="utf-8") as f:
+            f.write(phonemes)
+    print(f"Converted {len(text_files)} files")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+import json
+import hashlib
+import threading
+
+
+def hash_text(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def hash_file(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class StageCache:
+    """
+    Content-addressed cache of pipeline stage outputs.
+
+    Entries are keyed by a hash of the stage name and its inputs (audio hash, model
+    id, stage parameters, upstream text, ...), so a rerun only recomputes entries
+    whose inputs changed, no matter where the audio file is.
+
+    The cache also records which sibling files (.txt, .phonemes.txt, .lab, ...) were
+    generated by the pipeline and with which inputs. A generated file whose inputs
+    changed is stale and should be regenerated, while files written or edited by the
+    user are always kept.
+
+    Args:
+        cache_dir: Directory to store the entries.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(stage, **inputs):
+        return hashlib.sha1(json.dumps({"stage": stage, **inputs}, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _entry_path(self, stage, key):
+        return os.path.join(self.cache_dir, stage, key[:2], key + ".json")
+
+    def _write_json(self, path, value):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # unique per thread, threads of one process may write the same entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def get(self, stage, key):
+        """
+        Returns the stored value, or None if there is no entry.
+        """
+        path = self._entry_path(stage, key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def put(self, stage, key, value):
+        self._write_json(self._entry_path(stage, key), value)
+
+    def _output_record_path(self, path):
+        return self._entry_path("outputs", hash_text(os.path.abspath(path)))
+
+    def write_output(self, path, content, key):
+        """
+        Writes a generated sibling file and records the key of its inputs.
+        """
+        with open(path, "w") as f:
+            f.write(content)
+        self._write_json(self._output_record_path(path), {"path": os.path.abspath(path), "key": key, "sha1": hash_file(path)})
+
+    def is_generated(self, path):
+        """
+        Returns True if `path` was written by `write_output` and has not been edited since.
+        """
+        record_path = self._output_record_path(path)
+        if not os.path.exists(path) or not os.path.exists(record_path):
+            return False
+        with open(record_path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+        return record["sha1"] == hash_file(path)
+
+    def is_stale(self, path, key):
+        """
+        Returns True if `path` was generated from other inputs than `key`.
+        """
+        record_path = self._output_record_path(path)
+        if not os.path.exists(path) or not os.path.exists(record_path):
+            return False
+        with open(record_path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+        return record["key"] != key and record["sha1"] == hash_file(path)
@@ -0,0 +1,76 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ctc_align import get_ctc_forced_alignment, get_ctc_forced_alignment_batch
+
+
+BLANK = 0
+NUM_TOKENS = 12
+
+
+def random_batch(generator, batch_size, max_frames, min_frames=4):
+    """
+    Random log-softmax emissions and sparse greedy-like token ids, padded to the longest item.
+    Every item has at most half as many targets as frames, so that it can be aligned.
+    """
+    lengths = torch.randint(min_frames, max_frames + 1, (batch_size,), generator=generator)
+    num_frames = int(lengths.max())
+    logits = torch.randn((batch_size, num_frames, NUM_TOKENS), generator=generator) * 3
+    logits = torch.log_softmax(logits, dim=-1)
+    token_ids = torch.full((batch_size, num_frames), BLANK, dtype=torch.long)
+    for b in range(batch_size):
+        n = int(lengths[b])
+        num_targets = int(torch.randint(0, n // 2 + 1, (1,), generator=generator))
+        positions = torch.randperm(n, generator=generator)[:num_targets]
+        token_ids[b, positions] = torch.randint(1, NUM_TOKENS, (num_targets,), generator=generator)
+    return logits, token_ids, lengths
+
+
+class TestForcedAlignmentBatch(unittest.TestCase):
+    def assert_matches_reference(self, logits, token_ids, lengths, pad_secs):
+        results = get_ctc_forced_alignment_batch(logits, token_ids, blank_id=BLANK, pad_secs=pad_secs, input_lengths=lengths)
+        self.assertEqual(len(results), logits.shape[0])
+        for b, (span_tokens, start_times, end_times, scores) in enumerate(results):
+            n = int(lengths[b])
+            if not torch.any(token_ids[b, :n] != BLANK):
+                # torchaudio can not align an empty target
+                self.assertEqual(len(span_tokens), 0)
+                continue
+            expected, _ = get_ctc_forced_alignment(logits[b, :n], token_ids[b, :n], blank_id=BLANK, pad_sec=pad_secs[b])
+            self.assertEqual(span_tokens.tolist(), [span["token_id"] for span in expected])
+            self.assertEqual(start_times.tolist(), [span["start_time"] for span in expected])
+            self.assertEqual(end_times.tolist(), [span["end_time"] for span in expected])
+            np.testing.assert_allclose(scores, [span["score"] for span in expected], atol=1e-4)
+
+    def test_full_length_items(self):
+        generator = torch.Generator().manual_seed(0)
+        for _ in range(20):
+            logits, token_ids, _ = random_batch(generator, 1, 40)
+            lengths = torch.tensor([logits.shape[1]])
+            self.assert_matches_reference(logits, token_ids, lengths, [0.1])
+
+    def test_padded_batches(self):
+        generator = torch.Generator().manual_seed(1)
+        for _ in range(20):
+            logits, token_ids, lengths = random_batch(generator, 6, 60)
+            pad_secs = torch.rand((6,), generator=generator).mul(0.2).tolist()
+            self.assert_matches_reference(logits, token_ids, lengths, pad_secs)
+
+    def test_repeated_targets(self):
+        generator = torch.Generator().manual_seed(2)
+        logits, _, _ = random_batch(generator, 2, 30, min_frames=30)
+        # repeated targets need a blank between them
+        token_ids = torch.zeros((2, 30), dtype=torch.long)
+        token_ids[0, [2, 3, 4, 10, 11]] = torch.tensor([5, 5, 5, 7, 7])
+        token_ids[1, [0, 1, 2, 3]] = torch.tensor([3, 3, 4, 4])
+        self.assert_matches_reference(logits, token_ids, torch.tensor([30, 20]), [0.1, 0.1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,251 @@
+import os
+import gc
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def bucket_by_duration(durations, batch_size, bucket_sec=1.0, long_sec=0, max_batch_sec=0):
+    """
+    Groups items into batches of similar duration to reduce padding.
+
+    Items are sorted by their duration quantized to `bucket_sec`, items in the same
+    bucket keep their original order, and the sorted list is cut into batches.
+    The result is deterministic for the same inputs.
+
+    Args:
+        durations: Durations of the items in seconds.
+        batch_size: Maximum number of items in a batch.
+        bucket_sec: Bucket granularity in seconds. If <= 0, the original order is kept.
+        long_sec: Items longer than this are put in batches of their own at the end (0: disabled).
+        max_batch_sec: If > 0, batches are packed so that the padded duration (longest item
+            times number of items) stays under this budget, and `batch_size` is ignored.
+
+    Returns:
+        A list of batches, each batch is a list of indices into `durations`.
+    """
+    batch_size = max(1, batch_size)
+    indices = list(range(len(durations)))
+    long_indices = []
+    if long_sec > 0:
+        long_indices = [i for i in indices if durations[i] > long_sec]
+        indices = [i for i in indices if durations[i] <= long_sec]
+    if bucket_sec > 0:
+        order = sorted(indices, key=lambda i: (int(durations[i] // bucket_sec), i))
+    else:
+        order = indices
+    if max_batch_sec <= 0:
+        return [order[i:i+batch_size] for i in range(0, len(order), batch_size)] + [[i] for i in long_indices]
+
+    batches = []
+    batch = []
+    longest = 0.0
+    for i in order:
+        if len(batch) > 0 and max(longest, durations[i]) * (len(batch) + 1) > max_batch_sec:
+            batches.append(batch)
+            batch = []
+            longest = 0.0
+        batch.append(i)
+        longest = max(longest, durations[i])
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches + [[i] for i in long_indices]
+
+
+def chunk_windows(num_samples, chunk_samples, overlap_samples, frame_samples=320):
+    """
+    Splits a signal into overlapping windows for chunked inference.
+
+    Window starts are multiples of `frame_samples` (the total stride of the model),
+    so the frames of every window line up with the frames of the whole signal.
+    All windows have `chunk_samples` samples except the last one or two.
+
+    Args:
+        num_samples: Length of the signal.
+        chunk_samples: Length of a window.
+        overlap_samples: Overlap between neighbouring windows (at least one frame).
+        frame_samples: Number of samples per output frame.
+
+    Returns:
+        A list of (start, end) sample indices.
+    """
+    chunk_samples = max(2 * frame_samples, chunk_samples // frame_samples * frame_samples)
+    overlap_samples = min(max(frame_samples, overlap_samples), chunk_samples - frame_samples)
+    hop_samples = (chunk_samples - overlap_samples) // frame_samples * frame_samples
+    windows = []
+    start = 0
+    while True:
+        end = min(start + chunk_samples, num_samples)
+        if num_samples - end < frame_samples:
+            # do not leave a tail shorter than a frame for the last window
+            end = num_samples
+        windows.append((start, end))
+        if end >= num_samples:
+            break
+        start += hop_samples
+    return windows
+
+
+def stitch_windows(window_outputs, windows, frame_samples=320):
+    """
+    Joins the frame-wise outputs of overlapping windows into the output of the whole signal.
+
+    Each overlap is cut in the middle, so every frame is taken from the window where it
+    has the most context on both sides.
+
+    Args:
+        window_outputs: Outputs of the windows, each one is a tensor of shape (frames, ...).
+        windows: (start, end) sample indices of the windows from `chunk_windows`.
+        frame_samples: Number of samples per output frame.
+
+    Returns:
+        A tensor of shape (frames, ...).
+    """
+    import torch
+    stitched = []
+    begin = 0
+    for i, (output, (start, end)) in enumerate(zip(window_outputs, windows)):
+        start_frame = start // frame_samples
+        if i + 1 < len(windows):
+            next_start = windows[i + 1][0]
+            boundary = next_start // frame_samples + (end - next_start) // frame_samples // 2
+        else:
+            boundary = start_frame + output.shape[0]
+        stitched.append(output[begin - start_frame:min(boundary - start_frame, output.shape[0])])
+        begin = start_frame + min(boundary - start_frame, output.shape[0])
+    return torch.cat(stitched, dim=0)
+
+
+def prefetch(fn, items, num_workers=2, depth=2):
+    """
+    Applies `fn` to `items` on worker threads, up to `depth` items ahead of the consumer.
+
+    Decoding, resampling and feature extraction mostly release the GIL, so preparing
+    the next batches this way overlaps them with the model inference of the current one.
+
+    Args:
+        fn: Function to apply to each item.
+        items: Iterable of items.
+        num_workers: Number of worker threads.
+        depth: Number of items prepared ahead. If <= 0, `fn` is called in the consumer thread.
+
+    Yields:
+        (item, fn(item)) in the order of `items`.
+    """
+    if depth <= 0:
+        for item in items:
+            yield item, fn(item)
+        return
+
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        pending = deque((item, executor.submit(fn, item)) for item in itertools.islice(items, depth))
+        while len(pending) > 0:
+            item, future = pending.popleft()
+            result = future.result()
+            for next_item in itertools.islice(items, 1):
+                pending.append((next_item, executor.submit(fn, next_item)))
+            yield item, result
+
+
+def current_rss_bytes():
+    """
+    Returns the resident set size of this process in bytes, or None if it is not available.
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def is_out_of_memory(e):
+    if isinstance(e, MemoryError):
+        return True
+    # torch raises RuntimeError (or its subclass torch.cuda.OutOfMemoryError) when an allocation fails
+    message = str(e).lower()
+    return isinstance(e, RuntimeError) and ("out of memory" in message or "can't allocate memory" in message)
+
+
+def free_memory():
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+class MemoryBackoff:
+    """
+    Runs batches and makes them smaller under memory pressure.
+
+    A batch that fails with an out-of-memory error is split in halves and retried.
+    If `max_rss_bytes` is set, batches are also split when the resident memory of the
+    process is over the ceiling. After a back off, later batches are split to the
+    reduced size before they run.
+
+    Args:
+        max_rss_bytes: Resident memory ceiling in bytes (0: only back off on errors).
+    """
+    def __init__(self, max_rss_bytes=0):
+        self.max_rss_bytes = max_rss_bytes
+        # maximum number of items in a batch (None: unlimited)
+        self.max_items = None
+
+    def under_pressure(self):
+        if self.max_rss_bytes <= 0:
+            return False
+        rss = current_rss_bytes()
+        if rss is None or rss <= self.max_rss_bytes:
+            return False
+        free_memory()
+        rss = current_rss_bytes()
+        return rss is not None and rss > self.max_rss_bytes
+
+    def back_off(self, num_items):
+        if self.max_items is not None:
+            num_items = min(num_items, self.max_items)
+        self.max_items = max(1, num_items // 2)
+        print(f"Memory pressure, reducing batches to {self.max_items} items")
+
+    def split(self, items):
+        max_items = len(items) if self.max_items is None else self.max_items
+        return [items[i:i+max_items] for i in range(0, len(items), max(1, max_items))]
+
+    def run(self, fn, items):
+        """
+        Applies `fn` to `items`, split into smaller batches if needed.
+
+        Returns:
+            A list of (batch, fn(batch)) covering `items` in order.
+        """
+        results = []
+        pending = self.split(items)
+        while len(pending) > 0:
+            batch = pending.pop(0)
+            if self.max_items is not None and len(batch) > self.max_items:
+                # reduced by a back off after this batch was split
+                pending[0:0] = self.split(batch)
+                continue
+            if len(batch) > 1 and self.under_pressure():
+                self.back_off(len(batch))
+                pending[0:0] = self.split(batch)
+                continue
+            try:
+                result = fn(batch)
+            except Exception as e:
+                if len(batch) == 1 or not is_out_of_memory(e):
+                    raise
+                free_memory()
+                self.back_off(len(batch))
+                pending[0:0] = self.split(batch)
+                continue
+            results.append((batch, result))
+        return results
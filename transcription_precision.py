@@ -0,0 +1,138 @@
+import os
+import time
+import argparse
+import contextlib
+
+import numpy as np
+import torch
+
+
+PRECISIONS = ['auto', 'fp32', 'bf16', 'int8']
+
+
+def cpu_supports_bf16():
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def resolve_precision(precision, device):
+    """
+    Returns the precision to use on `device` ('fp32', 'bf16' or 'int8').
+    auto is bf16 on CUDA and fp32 on CPU. Dynamic int8 quantization is CPU only,
+    and bf16 on CPU needs native support, otherwise fp32 is used.
+    """
+    device = torch.device(device)
+    if precision == 'auto':
+        return 'bf16' if device.type == 'cuda' else 'fp32'
+    if precision == 'int8' and device.type != 'cpu':
+        print("int8 quantization is only supported on CPU, using fp32")
+        return 'fp32'
+    if precision == 'bf16' and device.type == 'cpu' and not cpu_supports_bf16():
+        print("This CPU does not support bf16, using fp32")
+        return 'fp32'
+    return precision
+
+
+def torch_dtype(precision):
+    return torch.bfloat16 if precision == 'bf16' else torch.float32
+
+
+def quantize_model(model):
+    """
+    Applies dynamic int8 quantization to the linear layers of `model`, returns a quantized copy.
+    """
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def apply_precision(model, precision):
+    """
+    Returns `model` for `precision`: quantized for int8, unchanged otherwise (bf16 runs in `autocast`).
+    """
+    if precision == 'int8':
+        return quantize_model(model)
+    return model
+
+
+def autocast(precision, device):
+    if precision == 'bf16':
+        return torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def edit_distance(ref, hyp):
+    row = list(range(len(hyp) + 1))
+    for i in range(1, len(ref) + 1):
+        prev, row[0] = row[0], i
+        for j in range(1, len(hyp) + 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (ref[i - 1] != hyp[j - 1]))
+    return row[-1]
+
+
+def error_rate(refs, hyps):
+    """
+    Returns the token error rate of `hyps` against `refs` (lists of token sequences).
+    """
+    errors = sum(edit_distance(ref, hyp) for ref, hyp in zip(refs, hyps))
+    return errors / max(1, sum(len(ref) for ref in refs))
+
+
+def transcribe_phonemes(model, feature_extractor, phoneme_tokenizer, wavs, precision, batch_size=8):
+    """
+    Returns the greedy CTC phoneme sequences of `wavs` and the time spent in the model.
+    """
+    from ctc_align import ctc_collapse_batch
+    phonemes = []
+    elapsed = 0.0
+    for i in range(0, len(wavs), batch_size):
+        batch = wavs[i:i+batch_size]
+        max_samples = max(len(wav) for wav in batch) + 8_000
+        padded = np.array([np.pad(wav, (max_samples - len(wav), 0), 'constant') for wav in batch])
+        features = feature_extractor(padded, sampling_rate=16_000, return_tensors="pt", return_attention_mask=True)
+        start = time.perf_counter()
+        with torch.no_grad(), autocast(precision, "cpu"):
+            logits = model(features.input_values, attention_mask=features.attention_mask)["phoneme_logits"]
+        elapsed += time.perf_counter() - start
+        for ids in ctc_collapse_batch(logits.float().argmax(dim=-1)):
+            phonemes.append(model.ctc_decode(ids.tolist(), phoneme_tokenizer).split())
+    return phonemes, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the phoneme error and speed of a reduced precision phoneme model against fp32 on CPU.")
+    parser.add_argument("wav_dir", help="Directory containing sample wav files.")
+    parser.add_argument("-m", "--model", required=True, help="Phoneme model (e.g. TylorShine/wavlm-base-plus-hiragana-ctc-v2).")
+    parser.add_argument("-p", "--precision", choices=['bf16', 'int8'], default='int8', help="Precision to check.")
+    parser.add_argument("-n", "--num_samples", type=int, default=32, help="Number of wav files to check.")
+    parser.add_argument("-b", "--batch_size", type=int, default=8, help="Batch size.")
+    parser.add_argument("--audio_cache_dir", default="False", help="Directory to store decoded audio for later runs (False: no store).")
+    args = parser.parse_args()
+
+    from transformers import AutoModel, AutoTokenizer, AutoFeatureExtractor
+    from audio_store import load_audio, configure_audio_store
+    if args.audio_cache_dir != "False":
+        configure_audio_store(args.audio_cache_dir)
+
+    wav_paths = sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(args.wav_dir)
+        for file in files
+        if file.endswith('.wav')
+    )[:args.num_samples]
+    wavs = [np.asarray(load_audio(wav_path, sr=16_000)) for wav_path in wav_paths]
+
+    feature_extractor = AutoFeatureExtractor.from_pretrained(args.model, trust_remote_code=True)
+    phoneme_tokenizer = AutoTokenizer.from_pretrained(args.model, trust_remote_code=True, subfolder="phoneme_tokenizer")
+    model = AutoModel.from_pretrained(args.model, trust_remote_code=True).eval()
+    precision = resolve_precision(args.precision, "cpu")
+
+    refs, fp32_sec = transcribe_phonemes(model, feature_extractor, phoneme_tokenizer, wavs, 'fp32', batch_size=args.batch_size)
+    hyps, sec = transcribe_phonemes(apply_precision(model, precision), feature_extractor, phoneme_tokenizer, wavs, precision, batch_size=args.batch_size)
+    print(f"{len(wavs)} files, {sum(len(wav) for wav in wavs) / 16_000:.1f} sec")
+    print(f"phoneme error against fp32 ({precision}): {error_rate(refs, hyps) * 100:.2f}%")
+    print(f"model time: fp32 {fp32_sec:.2f} sec, {precision} {sec:.2f} sec (x{fp32_sec / max(sec, 1e-9):.2f})")
+
+
+if __name__ == "__main__":
+    main()
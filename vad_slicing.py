@@ -0,0 +1,226 @@
+import os
+import json
+import shutil
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# slices of `<stem>.wav` are written to `<stem>.slices/`
+SLICES_SUFFIX = ".slices"
+SLICES_MANIFEST = "slices.json"
+SILENCE_LABELS = ("pau", "sil", "SP")
+
+
+def slices_dir(wav_path):
+    return os.path.splitext(wav_path)[0] + SLICES_SUFFIX
+
+
+def is_sliced(wav_path):
+    return os.path.exists(os.path.join(slices_dir(wav_path), SLICES_MANIFEST))
+
+
+def plan_slices(wav, sr, max_sec, top_db=30, min_silence_sec=0.1):
+    """
+    Plans cut points of a recording at silences so that every slice is at most `max_sec` long.
+
+    Cuts are placed in the middle of the silences found by `librosa.effects.split`,
+    as late as possible in each slice. A voiced part longer than `max_sec` is cut at
+    the quietest frame of the last quarter of the slice.
+
+    Returns:
+        A list of (start, end) samples covering the whole recording.
+    """
+    import librosa
+    max_samples = max(1, int(max_sec * sr))
+    intervals = librosa.effects.split(wav, top_db=top_db)
+    min_silence_samples = int(min_silence_sec * sr)
+    candidates = [
+        (intervals[i][1] + intervals[i + 1][0]) // 2
+        for i in range(len(intervals) - 1)
+        if intervals[i + 1][0] - intervals[i][1] >= min_silence_samples
+    ]
+
+    slices = []
+    start = 0
+    i = 0
+    while len(wav) - start > max_samples:
+        cut = None
+        while i < len(candidates) and candidates[i] - start <= max_samples:
+            if candidates[i] > start:
+                cut = candidates[i]
+            i += 1
+        if cut is None:
+            # no silence, cut at the quietest frame
+            lo = start + max_samples * 3 // 4
+            rms = librosa.feature.rms(y=wav[lo:start + max_samples], frame_length=2048, hop_length=512)[0]
+            cut = lo + int(np.argmin(rms)) * 512 if len(rms) > 0 else start + max_samples
+            cut = min(max(cut, start + 1), start + max_samples)
+        slices.append((start, cut))
+        start = cut
+    slices.append((start, len(wav)))
+    return slices
+
+
+def slice_recording(wav_path, max_sec, top_db=30):
+    """
+    Writes the slices of a recording to `<stem>.slices/` with a manifest of their offsets.
+    """
+    import soundfile
+    info = soundfile.info(wav_path)
+    y, sr = soundfile.read(wav_path, always_2d=True)
+    mono = y.mean(axis=1)
+    slices = plan_slices(mono, sr, max_sec, top_db=top_db)
+
+    out_dir = slices_dir(wav_path)
+    os.makedirs(out_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(wav_path))[0]
+    names = []
+    for i, (start, end) in enumerate(slices):
+        name = f"{stem}_{i:03d}.wav"
+        soundfile.write(os.path.join(out_dir, name), y[start:end], sr, subtype=info.subtype)
+        names.append(name)
+    # the manifest is written last, a directory without it is an unfinished slicing
+    with open(os.path.join(out_dir, SLICES_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump({"source": os.path.basename(wav_path), "sample_rate": sr, "slices": [[name, int(start), int(end)] for name, (start, end) in zip(names, slices)]}, f, ensure_ascii=False)
+    return len(slices)
+
+
+def slice_long_recordings(wav_paths, max_sec, top_db=30, workers=8):
+    """
+    Slices recordings in parallel, returns the number of slices.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return sum(executor.map(lambda wav_path: slice_recording(wav_path, max_sec, top_db=top_db), wav_paths))
+
+
+def merge_htk(labels_list, offsets):
+    """
+    Shifts HTK labels of slices by their offsets (seconds) and joins them into one timeline.
+    Silences at the boundaries of two slices are merged into one.
+
+    Raises:
+        ValueError: If a row has no start and end times (e.g. an unaligned phoneme list).
+    """
+    separator = "\t"
+    rows = []
+    for labels, offset in zip(labels_list, offsets):
+        if "\t" not in labels and labels.strip() != "":
+            separator = " "
+        offset = int(round(offset * 10_000_000))
+        for line in labels.splitlines():
+            parts = line.split()
+            if len(parts) < 3:
+                continue
+            try:
+                start, end, label = int(parts[0]) + offset, int(parts[1]) + offset, parts[2]
+            except ValueError:
+                raise ValueError(f"not an HTK label row: {line!r}") from None
+            if len(rows) > 0 and label in SILENCE_LABELS and rows[-1][2] in SILENCE_LABELS and rows[-1][1] >= start:
+                rows[-1][1] = end
+                continue
+            rows.append([start, end, label])
+    return "\n".join(separator.join(map(str, row)) for row in rows)
+
+
+def merge_sliced_recording(wav_path, keep_slices=False):
+    """
+    Merges the labels, texts and phonemes of the slices back to the recording.
+
+    Returns:
+        True if merged, False if some slice has no label yet.
+
+    Raises:
+        ValueError: If the labels of a slice can not be merged, nothing is written then.
+    """
+    out_dir = slices_dir(wav_path)
+    with open(os.path.join(out_dir, SLICES_MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    stems = [os.path.join(out_dir, os.path.splitext(name)[0]) for name, _, _ in manifest["slices"]]
+    offsets = [start / manifest["sample_rate"] for _, start, _ in manifest["slices"]]
+    if not all(os.path.exists(stem + ".lab") for stem in stems):
+        return False
+
+    stem = os.path.splitext(wav_path)[0]
+    # merge everything first, so that a broken slice does not leave half merged files
+    merged = {}
+    for ext, merge in [
+        (".lab", lambda contents: merge_htk(contents, offsets)),
+        (".phonemes_aligned.txt", lambda contents: merge_htk(contents, offsets)),
+        (".txt", lambda contents: " ".join(c.strip() for c in contents)),
+        (".phonemes.txt", lambda contents: " ".join(c.strip() for c in contents)),
+    ]:
+        if os.path.exists(stem + ext) and ext != ".lab":
+            continue
+        if not all(os.path.exists(s + ext) for s in stems):
+            continue
+        contents = []
+        for s in stems:
+            with open(s + ext, "r") as f:
+                contents.append(f.read())
+        merged[ext] = merge(contents)
+    for ext, content in merged.items():
+        with open(stem + ext, "w") as f:
+            f.write(content)
+    if not keep_slices:
+        shutil.rmtree(out_dir)
+    return True
+
+
+def merge_sliced_recordings(root_path, keep_slices=False):
+    """
+    Merges every sliced recording under `root_path` whose slices are all labeled.
+    """
+    merged = 0
+    pending = 0
+    for root, dirs, _ in os.walk(root_path):
+        for d in list(dirs):
+            if not d.endswith(SLICES_SUFFIX) or not os.path.exists(os.path.join(root, d, SLICES_MANIFEST)):
+                continue
+            dirs.remove(d)
+            wav_path = os.path.join(root, d[:-len(SLICES_SUFFIX)] + ".wav")
+            try:
+                done = merge_sliced_recording(wav_path, keep_slices=keep_slices)
+            except ValueError as e:
+                pending += 1
+                print(f"Failed to merge the slices of {wav_path}: {e}, keeping {os.path.join(root, d)}")
+                continue
+            if done:
+                merged += 1
+            else:
+                pending += 1
+                print(f"Some slices of {wav_path} are not labeled, keeping {os.path.join(root, d)}")
+    return merged, pending
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slice long recordings at silences, or merge the labels of the slices back.")
+    parser.add_argument("command", choices=["slice", "merge"], help="slice: write slices of long wav files, merge: merge labels of slices back.")
+    parser.add_argument("input_dir", help="Directory containing the wav files.")
+    parser.add_argument("-m", "--max_sec", type=float, default=20.0, help="Maximum length of a slice in seconds.")
+    parser.add_argument("-t", "--top_db", type=float, default=30, help="Threshold below the peak in dB to detect silences.")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="Number of threads.")
+    parser.add_argument("-k", "--keep_slices", action="store_true", help="Keep the slices after merging.")
+    args = parser.parse_args()
+
+    if args.command == "slice":
+        import soundfile
+        wav_paths = []
+        for root, dirs, files in os.walk(args.input_dir):
+            dirs[:] = [d for d in dirs if not d.endswith(SLICES_SUFFIX)]
+            for file in files:
+                wav_path = os.path.join(root, file)
+                stem = os.path.splitext(file)[0]
+                if file.endswith(".wav") and stem + ".lab" not in files and stem + ".txt" not in files \
+                        and not is_sliced(wav_path) and soundfile.info(wav_path).duration > args.max_sec:
+                    wav_paths.append(wav_path)
+        num_slices = slice_long_recordings(wav_paths, args.max_sec, top_db=args.top_db, workers=args.workers)
+        print(f"Sliced {len(wav_paths)} recordings into {num_slices} slices")
+    else:
+        merged, pending = merge_sliced_recordings(args.input_dir, keep_slices=args.keep_slices)
+        print(f"Merged {merged} recordings, {pending} not labeled yet")
+
+
+if __name__ == "__main__":
+    main()